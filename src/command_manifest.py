@@ -0,0 +1,53 @@
+"""Where each ryppl command lives.
+
+ryppl.py consults this table before importing anything else, so that
+'ryppl help' and shell completion (ryppl.py --complete WORDS...) don't
+pay for loading the commands, their option parsers or git.  For bash
+completion:
+
+  complete -C 'python /path/to/ryppl.py --complete' ryppl
+"""
+
+COMMANDS = ( # see workflows.rst
+    # (name, module, function, needs git)
+    ("help", "commands", "help", False),
+    ("install", "commands", "install", True),
+    ("maintain", "commands", "maintain", True),
+    ("checkout", "commands", "checkout", True),
+    ("publish", "commands", "publish", True),
+    ("merge-request", "commands", "merge_request", True),
+    ("release", "commands", "release", True),
+    ("show", "commands", "show", True),
+    ("test", "commands", "test", True),
+    ("remote-test", "commands", "remote_test", True),
+    ("slave", "commands", "slave", True),
+)
+
+def command_names():
+    return [entry[0] for entry in COMMANDS]
+
+def lookup(name):
+    """The COMMANDS entry for 'name', or None."""
+    for entry in COMMANDS:
+        if entry[0] == name:
+            return entry
+    return None
+
+def load(name):
+    """Import and return the function implementing command 'name', or
+    None if there is no such command.
+    """
+    entry = lookup(name)
+    if entry is None:
+        return None
+    module = __import__(entry[1])
+    return getattr(module, entry[2])
+
+def complete(words):
+    """Completions for the last of 'words', the command line typed so
+    far (without the program name).
+    """
+    if len(words) > 1:
+        return []
+    prefix = words and words[0] or ""
+    return [name for name in command_names() if name.startswith(prefix)]
@@ -1,74 +1,575 @@
-from optparse import OptionParser
+import os
 import sys
 
 def install(git, parser=None, parameters=None):
+    """install [--source=NAME=URL] [--mode=[NAME=]MODE] [--dissociate]
+    [requirements]: pick versions of the requirements (or of the
+    dependencies of the project in the current directory) and their
+    dependencies, and clone those not in the workspace yet, sharing
+    objects through ~/.ryppl/objects.git (copying them, with
+    --dissociate).  Packages installed "shallow" or "partial" (see
+    ryppl.workspace) are moved to the versions picked each time.
+    """
+    from ryppl.resolver import (DEPENDS_FILE, GitPackageIndex,
+                                ResolutionError, resolve,
+                                parse_requirements, read_depends)
+    from ryppl.tagcache import TagCache
+    from ryppl.workspace import Workspace, MODES
     print ("install command")
-    print ("DEBUG install parameters: " + ','.join(parameters))
     parser.add_option("--test", action="callback", callback=call_test, callback_args=(git, parameters,))
-    parser.parse_args(parameters)
+    parser.add_option("--offline", action="store_true", default=False,
+                      help="use cached tag listings, however old")
+    parser.add_option("--refresh", action="store_true", default=False,
+                      help="list the tags of every remote again")
+    parser.add_option("--source", action="append", default=[],
+                      metavar="NAME=URL",
+                      help="package NAME is to be cloned from URL")
+    parser.add_option("--mode", action="append", default=[],
+                      metavar="[NAME=]MODE",
+                      help="install NAME (or every package not installed "
+                           "yet) full (the default), shallow or partial")
+    parser.add_option("--dissociate", action="store_true", default=False,
+                      help="give new clones copies of the objects they "
+                           "share, so they don't rely on the object store")
+    options, args = parser.parse_args(parameters)
+    # From inside a project, its dependencies are its siblings (which is
+    # where "ryppl test" looks for them too).
+    root = os.path.isfile(DEPENDS_FILE) and os.pardir or os.curdir
+    workspace = Workspace(git, root, dissociate=options.dissociate)
+    new = dict(source.split("=", 1) for source in options.source
+               if "=" in source)
+    if new:
+        workspace.add_sources(new)
+    modes = {}
+    for mode in options.mode:
+        name, sep, mode = mode.rpartition("=")
+        if mode not in MODES:
+            print ("ryppl: unknown install mode '%s' (not one of %s)"
+                   % (mode, ", ".join(MODES)))
+            return
+        modes[name] = mode
+    sources = workspace.sources()
+    # Not project_names(): constraints may themselves contain commas.
+    if args:
+        requirements = parse_requirements(args)
+    else:
+        requirements = read_depends(os.curdir)
+    cache = TagCache(ttl=options.refresh and 0 or 3600,
+                     offline=options.offline)
+    git.tag_cache = cache
+    try:
+        chosen = resolve(requirements,
+                         GitPackageIndex(git, root, cache, sources,
+                                         workspace.store))
+    except ResolutionError, e:
+        print ("ryppl: %s" % e)
+        return
+    for name in sorted(chosen):
+        print ("%s %s" % (name, chosen[name]))
+        if workspace.installed(name):
+            # Full clones are the user's to move; the others are ours.
+            if workspace.mode(name) == "full":
+                continue
+        elif name in modes or "" in modes:
+            workspace.set_mode(name, modes.get(name, modes.get("")))
+        if name not in sources:
+            print ("ryppl: don't know where to get %s (use --source)" % name)
+            continue
+        try:
+            workspace.checkout(name, sources[name], chosen[name])
+        except RuntimeError, e:
+            print ("ryppl: %s" % e)
+
+def maintain(git, parser=None, parameters=None):
+    """maintain [--dissociate] [projects]: repack the object store the
+    workspace's clones share (~/.ryppl/objects.git), which is never
+    pruned.  With --dissociate, first give the named clones (or every
+    clone of the workspace) copies of what they borrow from it.
+    """
+    from ryppl.resolver import DEPENDS_FILE
+    from ryppl.workspace import Workspace
+    if parser is None:
+        from optparse import OptionParser
+        parser = OptionParser()
+    parser.add_option("--dissociate", action="store_true", default=False,
+                      help="stop the clones relying on the object store")
+    options, args = parser.parse_args(parameters or [])
+    root = os.path.isfile(DEPENDS_FILE) and os.pardir or os.curdir
+    workspace = Workspace(git, root)
+    if options.dissociate:
+        names = project_names(args) or [name for name in
+                                        sorted(os.listdir(root))
+                                        if workspace.installed(name)]
+        for name in names:
+            try:
+                if workspace.dissociate(name):
+                    print ("%s no longer relies on the object store" % name)
+            except RuntimeError, e:
+                print ("ryppl: %s" % e)
+    output = workspace.store.maintain()
+    if output.strip():
+        print (output.strip())
 
 def checkout(git, parser=None, parameters=None):
+    """checkout [--connections=N] [--status] [projects]: for a
+    superproject, check out the recorded commit of every submodule at
+    once, cloning and fetching as needed, and show how each stands.
+    """
+    from ryppl.superproject import GITMODULES, Superproject, print_table
     print ("checkout command")
-    git.git("status", verbose=True) # placeholder
+    if parser is None:
+        from optparse import OptionParser
+        parser = OptionParser()
+    parser.add_option("--connections", type="int", default=4,
+                      help="talk to remotes over at most N connections "
+                           "at once")
+    parser.add_option("--status", action="store_true", default=False,
+                      help="only show how each submodule stands")
+    options, projects = parse_projects(parser, parameters)
+    for project in projects:
+        if not os.path.isfile(os.path.join(project, GITMODULES)):
+            git.git("status", cwd=project, verbose=True) # placeholder
+            continue
+        superproject = Superproject(project, git.git_executable,
+                                    connections=options.connections,
+                                    info=git.info)
+        if options.status:
+            print_table(superproject.status())
+        else:
+            print_table(superproject.checkout())
 
 def help(git, parser=None, parameters=None):
-    print( HELP_MSG )
+    print( help_message() )
 
 def publish(git, parser=None, parameters=None):
     print ("publish command")
+    deepen(git)
     git.git("status", verbose=True) # placeholder
 
 
 def merge_request(git, parser=None, parameters=None):
     print ("merge-request command")
+    deepen(git)
     git.git("status", verbose=True) # placeholder
 
 
 def release(git, parser=None, parameters=None):
+    """release [version]: with no argument, show the latest release of
+    the project in the current directory; otherwise tag HEAD as
+    'version', which must be newer than every existing release.
+    """
+    from ryppl.refs import tag_names
+    from ryppl.version import Version, latest
     print ("release command")
-    git.git("status", verbose=True) # placeholder
+    if parser is None:
+        from optparse import OptionParser
+        parser = OptionParser()
+    parser.add_option("--force", action="store_true", default=False,
+                      help="release even if the release criteria aren't met")
+    options, args = parser.parse_args(parameters or [])
+    current = latest(tag_names(git, os.curdir), final=False)
+    if not args:
+        print ("latest release: %s" % (current or "none"))
+        return
+    try:
+        version = Version(args[0])
+    except ValueError, e:
+        print ("ryppl: %s" % e)
+        return
+    if current is not None and version <= current:
+        print ("ryppl: %s is not newer than the latest release, %s"
+               % (version, current))
+        return
+    verdict = judge_release(os.curdir)
+    if verdict is not None and not verdict.releasable():
+        print_verdict(verdict)
+        if not options.force:
+            print ("ryppl: not releasable (use --force to release anyway)")
+            return
+    git.git("tag", str(version), verbose=True)
 
 
 def show(git, parser=None, parameters=None):
+    """show [workspace | release-criteria | dependents] [projects]"""
     print ("show command")
-    git.git("status", verbose=True) # placeholder
+    if parameters and parameters[0] == "workspace":
+        return show_workspace(git, parser, parameters[1:])
+    if parameters and parameters[0] == "release-criteria":
+        return show_release_criteria(git, parser, parameters[1:])
+    if parameters and parameters[0] == "dependents":
+        return show_dependents(git, parser, parameters[1:])
+    def show_project(git, project):
+        for line in git.stream("status", cwd=project, verbose=True): # placeholder
+            sys.stdout.write(line)
+    for_each_project(git, parser, parameters, show_project)
+
+
+def show_workspace(git, parser, parameters):
+    """Show the branch, HEAD and origin of every project in the
+    workspace (from its state index; see ryppl.stateindex).
+    """
+    from ryppl.stateindex import StateIndex
+    index = StateIndex(git, os.curdir)
+    index.refresh()
+    for name in sorted(index.projects):
+        info = index.projects[name]
+        print ("%-20s %-16s %-10s %s" % (name, info.branch or "(detached)",
+                                         (info.commit or "-")[:10],
+                                         info.remote or ""))
+
+def show_release_criteria(git, parser, parameters):
+    """Summarize each project's releasability markup and judge it on
+    the test outcomes recorded so far.
+    """
+    from ryppl.releasability import describe, read_markup
+    options, projects = parse_projects(parser, parameters)
+    for project in projects:
+        print ("== %s" % project_name(project))
+        for line in describe(read_markup(project)):
+            print (line)
+        print_verdict(judge_release(project, always=True))
+
+def show_dependents(git, parser, parameters):
+    """show dependents [--direct] NAME[:VERSION]...: list the projects
+    in the workspace depending on each NAME (at VERSION, if given).
+    """
+    from ryppl.depindex import DependencyIndex
+    if parser is None:
+        from optparse import OptionParser
+        parser = OptionParser()
+    parser.add_option("--direct", action="store_true", default=False,
+                      help="only the projects depending on NAME directly")
+    options, args = parser.parse_args(parameters or [])
+    index = DependencyIndex(os.curdir)
+    try:
+        index.refresh()
+        for name in sorted(index.problems):
+            print ("warning: leaving out %s: %s"
+                   % (name, index.problems[name]))
+        for arg in args:
+            name, sep, version = arg.partition(":")
+            try:
+                dependents = index.dependents(name, version or None,
+                                              not options.direct)
+            except ValueError, e:
+                print ("ryppl: %s" % e)
+                continue
+            print ("%s: %s" % (arg, " ".join(dependents) or "(none)"))
+    finally:
+        index.close()
+
+def judge_release(project, always=False):
+    """The releasability Verdict of 'project', or None if it has no
+    releasability markup (unless 'always').
+    """
+    from ryppl.releasability import (MARKUP_FILE, ResultLog, evaluate,
+                                     read_markup)
+    from ryppl.resolver import read_ryppl
+    from ryppl.scheduler import read_aliases
+    if not always and not read_ryppl(project, MARKUP_FILE).strip():
+        return None
+    return evaluate(ResultLog().load(), project_name(project),
+                    read_markup(project), read_aliases(project))
+
+def print_verdict(verdict):
+    print ("%s: %s (results: %d, expected failures: %d, failures on "
+           "unusable slaves: %d)" % (verdict.project,
+                                     verdict.releasable() and "releasable"
+                                     or "not releasable", verdict.cells,
+                                     verdict.expected, verdict.unusable))
+    for pattern in verdict.missing:
+        print ("  no results from required slave %s" % pattern)
+    for test, slave in verdict.failures:
+        print ("  %s failed on %s" % (test, slave))
+
+def project_name(project):
+    return os.path.basename(os.path.abspath(project))
 
 
 def test(git, parser=None, parameters=None):
+    """test [--deep] [--all] [projects]: run the test suites of the
+    projects that changed since they last passed, or that depend on
+    one that did.  Projects whose exact state (their tree and those of
+    their dependencies) was tested before get that earlier outcome.
+    """
+    from ryppl.testselect import TestResults, closure_of, select, run_suite
+    from ryppl.executor import ProjectResult, print_result
+    from ryppl.releasability import ResultLog
+    from ryppl.stateindex import StateIndex
+    from ryppl.workspace import STATE_DIR
     print ("test command")
-    git.git("status", verbose=True) # placeholder
+    if parser is None:
+        from optparse import OptionParser
+        parser = OptionParser()
+    parser.add_option("--deep", action="store_true", default=False,
+                      help="also test the projects these depend on")
+    parser.add_option("--all", action="store_true", default=False,
+                      help="test even projects that haven't changed, "
+                           "ignoring earlier results")
+    options, projects = parse_projects(parser, parameters)
+    projects = [os.path.normpath(p) for p in projects]
+    # From inside a project, its dependencies are its siblings.
+    workspace = projects == [os.curdir] and os.pardir or os.curdir
+    results = TestResults()
+    index = None
+    if os.path.isdir(os.path.join(workspace, STATE_DIR)):
+        index = StateIndex(git, workspace)
+        index.refresh()
+    try:
+        to_test, cached, graph, states = select(git, projects, workspace,
+                                                results, options.deep, index)
+        if options.all:
+            to_test = [p for p in projects if p not in to_test] + to_test
+        for project in projects + sorted(set(cached) - set(projects)):
+            if project in to_test:
+                continue
+            if project in cached:
+                ok, output = cached[project]
+                result = ProjectResult(project)
+                result.output = output + "(result of an earlier run)\n"
+                if not ok:
+                    result.error = "failed before"
+                print_result(result)
+            else:
+                print ("%s: unchanged since it passed, skipped" % project)
+        outcomes = run_each(git, lambda git, project: run_suite(project),
+                            to_test, options.jobs)
+        log = ResultLog()
+        for outcome in outcomes:
+            log.record(project_name(outcome.project), "all", "local",
+                       outcome.ok())
+            results.record(outcome.project, outcome.ok(),
+                           [states[p] for p in closure_of(outcome.project,
+                                                          graph)],
+                           outcome.output)
+        results.evict()
+    finally:
+        results.close()
 
 def remote_test(git, parser=None, parameters=None):
+    """remote-test [--slave=SLAVES] [projects]: test HEAD of the projects
+    on the given slaves (keys or aliases; the "default" alias if none),
+    spreading the projects over them according to their workload.
+    Projects whose exact state (their tree and those of their
+    dependencies) was tested before on the kind of machine one of the
+    slaves is get that earlier outcome instead.
+    """
+    from ryppl.releasability import ResultLog
+    from ryppl.scheduler import Scheduler, Shard, expand, read_aliases
+    from ryppl.testselect import (ProjectState, TestResults, closure_of,
+                                  dependency_closure, result_key)
     print ("remote-test command")
-    git.git("status", verbose=True) # placeholder
+    if parser is None:
+        from optparse import OptionParser
+        parser = OptionParser()
+    parser.add_option("--slave", action="append", default=[],
+                      help="test on these slaves or slave aliases")
+    options, projects = parse_projects(parser, parameters)
+    projects = [os.path.normpath(p) for p in projects]
+    # From inside a project, its dependencies are its siblings.
+    workspace = projects == [os.curdir] and os.pardir or os.curdir
+    graph = dependency_closure(projects, workspace)
+    states = dict((p, ProjectState(git, p)) for p in graph)
+    for project in projects:
+        if states[project].commit is not None and not states[project].clean:
+            print ("warning: %s has uncommitted changes, which won't be "
+                   "tested" % project)
+    try:
+        keys = expand(project_names(options.slave), read_aliases())
+    except ValueError, e:
+        print ("ryppl: %s" % e)
+        return
+    slaves = []
+    for key in keys:
+        slave = connect_slave(key, git)
+        if slave is None:
+            print ("ryppl: can't reach slave %s" % key)
+        else:
+            slaves.append(slave)
+    if not slaves:
+        print ("ryppl: no slaves to test on")
+        return
+    platforms = dict((slave.key, slave.platform) for slave in slaves)
+    results = TestResults()
+    try:
+        shards = []
+        for project in projects:
+            members = [states[p] for p in closure_of(project, graph)]
+            for platform in sorted(set(platforms.values()) - set([None])):
+                found = results.lookup(result_key(members, platform))
+                if found is not None:
+                    ok, output = found
+                    print ("== %s on %s (%s, result of an earlier run)"
+                           % (project, platform, ok and "ok" or "FAILED"))
+                    sys.stdout.write(output)
+                    break
+            else:
+                shards.append(Shard(os.path.abspath(project), project))
+        def report(outcome):
+            # Slaves return the job's status; an error means no slave
+            # could run the tests at all.
+            ok = outcome.error is None and outcome.value["ok"]
+            print ("== %s on %s (%s)" % (outcome.shard.payload, outcome.slave,
+                                         ok and "ok" or "FAILED"))
+            if outcome.error is not None:
+                print (outcome.error)
+        log = ResultLog()
+        # Recorded once the run is over: the reports come from the
+        # scheduler's threads, and the result store is this thread's.
+        for outcome in Scheduler(slaves).run(shards, report):
+            if outcome.error is not None:
+                continue
+            project = outcome.shard.payload
+            ok = outcome.value["ok"]
+            log.record(project_name(project), "all", outcome.slave, ok)
+            platform = platforms[outcome.slave]
+            if platform is not None and "output" in outcome.value:
+                members = [states[p] for p in closure_of(project, graph)]
+                results.store(result_key(members, platform), ok,
+                              outcome.value["output"])
+        results.evict()
+    finally:
+        results.close()
+
+def slave(git, parser=None, parameters=None):
+    """slave [--key=KEY] [-j JOBS] [--subscribe=URL] [--once]: run a test
+    slave, working through the jobs remote-test queues for slave KEY
+    (a new key if none is given).
+    """
+    from ryppl.slave import SlaveDaemon, new_key, slave_dir
+    if parser is None:
+        from optparse import OptionParser
+        parser = OptionParser()
+    parser.add_option("--key", default=None,
+                      help="serve the queue of slave KEY")
+    parser.add_option("-j", "--jobs", type="int", default=2,
+                      help="run up to JOBS test jobs at once")
+    parser.add_option("--subscribe", action="append", default=[],
+                      help="keep a warm clone of URL and only accept jobs "
+                           "for subscribed URLs")
+    parser.add_option("--once", action="store_true", default=False,
+                      help="stop once the queue is empty")
+    options, args = parser.parse_args(parameters or [])
+    key = options.key or new_key()
+    spool = slave_dir(key)
+    daemon = SlaveDaemon(git, spool, options.jobs)
+    if options.subscribe:
+        f = open(os.path.join(spool, "subscriptions"), "a")
+        try:
+            f.write("".join(url + "\n" for url in options.subscribe))
+        finally:
+            f.close()
+    # Jobs run in threads of their own; the cat-file workers aren't
+    # shared between threads.
+    git.pooled = False
+    print ("slave %s serving %s" % (key, spool))
+    try:
+        daemon.serve(options.once)
+    except KeyboardInterrupt:
+        pass
+
+def connect_slave(key, git=None):
+    """A Slave (see ryppl.scheduler) for slave 'key', or None.  The key
+    "local" stands for this machine; keys with a queue on this machine
+    (see ryppl.slave) are served by the daemons running "ryppl slave",
+    if any still are.
+    """
+    import ryppl.slave
+    from ryppl.executor import ProjectFailed
+    from ryppl.scheduler import LocalSlave
+    from ryppl.testselect import platform_key, run_suite
+    def run_locally(shard):
+        # What this prints isn't captured, so nothing gets stored; what
+        # "ryppl test" stored still counts.
+        try:
+            run_suite(shard.payload)
+        except ProjectFailed, e:
+            print (e)
+            return {"ok": False}
+        return {"ok": True}
+    if key == "local":
+        slave = LocalSlave(key, run_locally)
+        slave.platform = platform_key()
+        return slave
+    if git is not None and os.path.isdir(ryppl.slave.slave_dir(key)):
+        try:
+            return ryppl.slave.SpoolSlave(key, git)
+        except ValueError:
+            pass                        # no daemon left serving it
+    return None
 
 
 def call_test(option, opt_str, value, parser, *args, **kwargs):
     test(git=args[0], parameters=args[1])
 
-ALL_COMMANDS = ( # see workflows.rst
-    ("help", help),
-    ("install", install),
-    ("checkout", checkout),
-    ("publish", publish),
-    ("merge-request", merge_request),
-    ("release", release),
-    ("show", show),
-    ("test", test),
-    ("remote-test", remote_test),
-)
+def project_names(args):
+    """Split command-line project names, which may be separated by
+    commas and/or spaces, into a list.
+    """
+    names = []
+    for arg in args:
+        names.extend(name.strip() for name in arg.split(",") if name.strip())
+    return names
+
+def deepen(git, project=os.curdir):
+    """Fetch the history 'project' lacks if it was installed shallow or
+    partial, as publishing needs all of it.
+    """
+    from ryppl.workspace import Workspace
+    project = os.path.abspath(project)
+    workspace = Workspace(git, os.path.dirname(project))
+    if workspace.mode(os.path.basename(project)) != "full":
+        print ("fetching the history of %s" % os.path.basename(project))
+        try:
+            workspace.deepen(os.path.basename(project))
+        except RuntimeError, e:
+            print ("ryppl: %s" % e)
+
+def parse_projects(parser, parameters):
+    """Parse 'parameters' with 'parser' (adding the --jobs option) and
+    return (options, projects): the projects named on the command line,
+    or the current directory if none are.
+    """
+    if parser is None:
+        from optparse import OptionParser
+        parser = OptionParser()
+    if not parser.has_option("--jobs"):
+        parser.add_option("-j", "--jobs", type="int", default=1,
+                          help="work on up to JOBS projects at once")
+    options, args = parser.parse_args(parameters or [])
+    return options, project_names(args) or [os.curdir]
+
+def run_each(git, action, projects, jobs=1):
+    """Call action(git, project) for each of 'projects'.  Up to 'jobs'
+    projects are processed concurrently, each on its own Git; their
+    output is still reported in order.  Returns the ProjectResults.
+    """
+    from ryppl.executor import run_projects
+    def make_git():
+        worker = git.__class__(git.git_executable,
+                               getattr(git, 'pooled', True))
+        worker.info = getattr(git, 'info', None)
+        return worker
+    return run_projects(action, projects, make_git, jobs)
+
+def for_each_project(git, parser, parameters, action):
+    """Parse 'parameters' and call action(git, project) for each project
+    named on the command line, or for the current directory if none
+    are (see parse_projects and run_each).
+    """
+    options, projects = parse_projects(parser, parameters)
+    return run_each(git, action, projects, options.jobs)
 
 def handle_command(git, command=None, parameters=None):
     """handle commands from the line interface.
     """
-    parser = OptionParser()
-
-    known_cmds = {}
-    known_cmds.update(ALL_COMMANDS)
-    try:
-        known_cmds[command](git, parser, parameters)    
-    except KeyError:
-        help(parser, parameters)
+    from command_manifest import load
+    action = load(command)
+    if action is None or action is help:
+        help(git)
+        return
+    from optparse import OptionParser
+    action(git, OptionParser(), parameters)
 
 HELP_MSG = """
 Usage python %(program_name)s command-name [ options... ] [ project-names... ]
@@ -76,6 +577,9 @@ where command-name is one of the following
     %(known_cmds)s
 options are specified with the usual syntax (--...)
 and project-names are an (optional) list of space separated names.
-""" % ({"program_name": sys.argv[0],
-        "known_cmds": "\n    ".join(sorted(x[0] for x in ALL_COMMANDS))})
+"""
 
+def help_message():
+    from command_manifest import command_names
+    return HELP_MSG % ({"program_name": sys.argv[0],
+                        "known_cmds": "\n    ".join(sorted(command_names()))})
@@ -1,15 +1,21 @@
 """Tests for ryppl.
 
-The tests for ryppl are defined in the ryppl.tests package;
+The tests for ryppl are defined in the ryppl.tests package; they are
+run in parallel, one module at a time per worker process (see
+ryppl.testrunner).  Pass -j JOBS to choose how many workers.
 """
 
+import sys
 import ryppl.tests
-from ryppl.tests import run_unittest, reap_children
+from ryppl.tests import reap_children
+from ryppl.testrunner import main
 
-def test_main():
-    run_unittest(ryppl.tests.test_suite())
-    reap_children()
+def test_main(args=None):
+    try:
+        return main(list(args or []) + ["ryppl.tests"])
+    finally:
+        reap_children()
 
 
 if __name__ == "__main__":
-    test_main()
+    sys.exit(not test_main(sys.argv[1:]))
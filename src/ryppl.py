@@ -1,12 +1,31 @@
 import sys
-from commands import handle_command
+import os
 import subprocess as sub
 # take a single command arg[1]
 # then parse sys.argv[2:] to optionparser
 # it must be space separated, commit correction to workflows doc
 class Git:
-    def __init__(self, git_executable="git"):
+    def __init__(self, git_executable="git", pooled=True):
         self.git_executable = git_executable
+        self.pooled = pooled
+        self._pool = None
+        self.tag_cache = None       # a ryppl.tagcache.TagCache, if any
+        self.info = None            # a ryppl.gitinfo.GitInfo, once found
+
+    def pool(self):
+        """The GitPool answering read-only queries for this Git, created
+        on first use.
+        """
+        if self._pool is None:
+            from ryppl.gitpool import GitPool
+            self._pool = GitPool(self.git_executable)
+        return self._pool
+
+    def close(self):
+        """Shut down any pooled git processes."""
+        if self._pool is not None:
+            self._pool.close()
+            self._pool = None
 
     def git(self, *args, **kwargs):
         # From Troy Straszheim git-ryppl
@@ -19,7 +38,21 @@ class Git:
         if 'req' in kwargs:
             req = kwargs['req']
             del kwargs['req']
-        
+
+        # Read-only queries go to the long-lived cat-file workers when
+        # they can answer them exactly; a nonzero 'req' means the caller
+        # wants git's own failure, so that always takes a real process.
+        if self.pooled and not req and not set(kwargs) - set(['cwd']):
+            stdouttxt = self.pool().query(args, kwargs.get('cwd'))
+            if stdouttxt is not None:
+                if verbose: print(stdouttxt)
+                return stdouttxt
+
+        fetching = self.tag_cache is not None and args[:1] == ("fetch",)
+        if fetching:
+            repository = kwargs.get('cwd') or os.curdir
+            tags = self.tag_cache.local_tags(repository)
+
         p = sub.Popen((self.git_executable,)  + args,
                       bufsize=0,
                       stdin=sub.PIPE,
@@ -29,6 +62,10 @@ class Git:
         stdouttxt = str(p.stdout.read())
         p.stdin.close()
         rv = p.wait()
+        if self._pool is not None:
+            self._pool.after_command(args, kwargs.get('cwd'))
+        if fetching:
+            self.tag_cache.fetched(repository, tags)
         if verbose: print(stdouttxt)
         if req:
             if rv != req:
@@ -38,19 +75,36 @@ class Git:
                 if verbose: print ("Ok, returned %d as expected." % rv)
         if verbose: print("Returned %d, okay I guess." % rv) 
         return stdouttxt
-        
 
-    def check_for_git(self):
-        """checks if the current self.git_executable can be found on the path.
-It works by checking the return code.
-"""
-        try:
-            found = self.git("", req=1, verbose=False)
-            return True
-        except RuntimeError:
-            return False
-        except OSError:
-            return False
+    def stream(self, *args, **kwargs):
+        """Like git(), but return a GitStream over the command's output
+        instead of reading all of it into memory first.
+        """
+        verbose = kwargs.pop('verbose', False)
+        req = kwargs.pop('req', None)
+        if verbose: print("$ git " + ' '.join(args))
+        return GitStream(self, args, req, verbose, kwargs)
+
+    def find(self):
+        """Locate git_executable (asking the user for another one until
+        it is found) and record what it supports in self.info.  What
+        is known about a git binary is cached until it changes, so
+        this normally doesn't run git at all.
+        """
+        from ryppl.gitinfo import discover
+        info = discover(self.git_executable)
+        while info is None:
+            self.install_git()
+            info = discover(self.git_executable)
+        self.git_executable = info.path
+        self.info = info
+        return info
+
+    def supports(self, feature):
+        """Whether our git has 'feature' (see ryppl.gitinfo.FEATURES);
+        False if find() hasn't been called.
+        """
+        return self.info is not None and self.info.supports(feature)
 
     def install_git(self):
         INSTALL_MESSAGE = """
@@ -59,14 +113,123 @@ It works by checking the return code.
     """ 
         self.git_executable = raw_input(INSTALL_MESSAGE)
 
-def main():
-    if len(sys.argv) < 2:
-        handle_command("help", None)
+
+class GitStream:
+    """The output of a running git command, read incrementally.
+
+    Iterating yields stdout one line at a time; chunks() yields it in
+    fixed-size blocks.  Nothing is read ahead of the consumer, so git
+    blocks on a full pipe instead of filling our memory.  stderr is
+    kept apart in a temporary file (so git never stalls on it) and is
+    available as 'stderr' once the command has finished.  The exit
+    status is checked against 'req' exactly as Git.git does, when the
+    output is exhausted or close() is called.
+    """
+
+    # How much of stderr to keep for reporting.
+    stderr_limit = 64 * 1024
+
+    def __init__(self, git, args, req=None, verbose=False, popen_kwargs={}):
+        self.git = git
+        self.args = args
+        self.req = req
+        self.verbose = verbose
+        self.cwd = popen_kwargs.get('cwd')
+        self.returncode = None
+        self.stderr = None
+        self._eof = False
+        import tempfile
+        self._errfile = tempfile.TemporaryFile()
+        self._devnull = open(os.devnull)
+        self._p = sub.Popen((git.git_executable,) + args,
+                            bufsize=-1,
+                            stdin=self._devnull,
+                            stdout=sub.PIPE,
+                            stderr=self._errfile,
+                            **popen_kwargs)
+
+    def __iter__(self):
+        try:
+            for line in iter(self._p.stdout.readline, ''):
+                yield line
+            self._eof = True
+        finally:
+            self.close()
+
+    def chunks(self, size=64 * 1024):
+        try:
+            for chunk in iter(lambda: self._p.stdout.read(size), ''):
+                yield chunk
+            self._eof = True
+        finally:
+            self.close()
+
+    def close(self):
+        """Wait for git to finish (killing it if it is still running
+        and its output wasn't all read) and check its exit status.
+        Returns the exit status.
+        """
+        if self.returncode is not None:
+            return self.returncode
+        # Never read to find out whether more is coming: git may be busy
+        # producing it, and we'd block until it is.
+        killed = not self._eof and self._p.poll() is None
+        if killed:
+            self._p.terminate()
+        self._p.stdout.close()
+        rv = self.returncode = self._p.wait()
+        self._devnull.close()
+        self._errfile.seek(0, 2)
+        self._errfile.seek(max(0, self._errfile.tell() - self.stderr_limit))
+        self.stderr = self._errfile.read()
+        self._errfile.close()
+        if self.git._pool is not None:
+            self.git._pool.after_command(self.args, self.cwd)
+        if self.verbose and self.stderr: print(self.stderr)
+        if self.req and not killed:
+            if rv != self.req:
+                raise RuntimeError("Expected exit status %d, but got %d"
+                                   % (self.req, rv))
+            elif self.verbose:
+                print ("Ok, returned %d as expected." % rv)
+        return rv
+
+
+def complete():
+    """Print completions for the command line in COMP_LINE (as set by
+    bash's complete -C), or else for the words after --complete.
+    """
+    from command_manifest import complete
+    line = os.environ.get("COMP_LINE")
+    if line is None:
+        words = sys.argv[2:]
     else:
-        git = Git()
-        if not git.check_for_git():
-            git.install_git()
-        handle_command(git, sys.argv[1], sys.argv[2:])
+        line = line[:int(os.environ.get("COMP_POINT", len(line)))]
+        words = line.split()[1:]
+        if not words or line[-1:].isspace():
+            words.append("")
+    for word in complete(words):
+        print(word)
+
+def main():
+    # Look the command up before importing or running anything else:
+    # help and completion must not wait for git.
+    from command_manifest import lookup
+    command = len(sys.argv) > 1 and sys.argv[1] or "help"
+    if command == "--complete":
+        complete()
+        return
+    from commands import handle_command
+    entry = lookup(command)
+    if entry is None or not entry[3]:
+        handle_command(None, command, sys.argv[2:])
+        return
+    git = Git()
+    git.find()
+    try:
+        handle_command(git, command, sys.argv[2:])
+    finally:
+        git.close()
 
 if __name__ == '__main__':
     main()
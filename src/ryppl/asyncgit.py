@@ -0,0 +1,235 @@
+"""ryppl.asyncgit
+
+An AsyncGit runs many git commands at once from a single thread.
+Commands are queued with git(), which returns a GitCall right away;
+run() then drives every queued process with select(), starting new
+ones as running ones finish, until the calls of interest are done.
+This lets network-bound work (clone and fetch across a dependency
+closure) overlap without a thread per repository.
+"""
+
+import os
+import time
+import errno
+import select
+import signal
+import tempfile
+import subprocess as sub
+
+
+class GitTimeout(RuntimeError):
+    """A git command ran longer than its timeout and was killed."""
+
+
+class GitCancelled(RuntimeError):
+    """A git command was cancelled before it finished."""
+
+
+class GitCall:
+    """One git command queued on an AsyncGit.
+
+    Once done(), 'output' holds what it printed on stdout, 'stderr' what
+    it printed on stderr (kept apart, so that warnings never end up in
+    output meant for parsing) and 'returncode' its exit status.
+    result() returns the output, or raises the error that ended the
+    call: RuntimeError for an unexpected exit status when 'req' was
+    given, GitTimeout, or GitCancelled.
+    """
+
+    def __init__(self, runner, args, req=None, timeout=None,
+                 verbose=False, popen_kwargs={}):
+        self.runner = runner
+        self.args = args
+        self.req = req
+        self.timeout = timeout
+        self.verbose = verbose
+        self.popen_kwargs = popen_kwargs
+        self.output = None
+        self.stderr = None
+        self.returncode = None
+        self.error = None
+        self.callbacks = []
+        self._proc = None
+        self._errfile = None
+        self._chunks = []
+        self._deadline = None
+        self._done = False
+
+    def done(self):
+        return self._done
+
+    def running(self):
+        return self._proc is not None
+
+    def add_done_callback(self, fn):
+        """Call fn(self) from the event loop when this call is done.
+        The callback may queue further calls on the same AsyncGit.
+        """
+        if self._done:
+            fn(self)
+        else:
+            self.callbacks.append(fn)
+
+    def cancel(self):
+        """Stop this call: drop it if it hasn't started, kill it if it
+        has.  Returns False if it was already done.
+        """
+        if self._done:
+            return False
+        self.runner._cancel(self)
+        return True
+
+    def result(self):
+        """Run the event loop until this call is done, then return its
+        output or raise its error.
+        """
+        if not self._done:
+            self.runner.run([self])
+        if self.error is not None:
+            raise self.error
+        return self.output
+
+
+class AsyncGit:
+    """Runs queued git commands with at most 'max_processes' of them
+    alive at any time.
+    """
+
+    def __init__(self, git_executable="git", max_processes=8):
+        self.git_executable = git_executable
+        self.max_processes = max_processes
+        self.pending = []
+        self.running = {}           # stdout fd -> GitCall
+
+    def git(self, *args, **kwargs):
+        """Queue 'git <args>' and return its GitCall.  Accepts the
+        'verbose' and 'req' keywords of Git.git, 'timeout' in seconds,
+        and any keywords for subprocess.Popen (e.g. cwd).
+        """
+        verbose = kwargs.pop('verbose', False)
+        req = kwargs.pop('req', None)
+        timeout = kwargs.pop('timeout', None)
+        call = GitCall(self, args, req, timeout, verbose, kwargs)
+        self.pending.append(call)
+        return call
+
+    def run(self, calls=None):
+        """Drive the loop until every GitCall in 'calls' is done, or, if
+        'calls' is None, until nothing is left queued or running.
+        Raises ValueError if one of 'calls' was queued on another
+        AsyncGit.
+        """
+        if calls is None:
+            unfinished = lambda: self.pending or self.running
+        else:
+            for call in calls:
+                if call.runner is not self:
+                    raise ValueError("git %s was not queued here"
+                                     % ' '.join(call.args))
+            unfinished = lambda: [c for c in calls if not c._done]
+        while unfinished():
+            self._start_pending()
+            if not self.running:
+                if not self.pending:
+                    break               # nothing left that could finish
+                continue
+            wait = None
+            deadlines = [c._deadline for c in self.running.values()
+                         if c._deadline is not None]
+            if deadlines:
+                wait = max(0, min(deadlines) - time.time())
+            try:
+                ready = select.select(self.running.keys(), [], [], wait)[0]
+            except select.error, e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                raise
+            for fd in ready:
+                call = self.running.get(fd)
+                if call is not None:    # else a callback cancelled it
+                    self._read(call)
+            self._expire()
+
+    def _start_pending(self):
+        while self.pending and len(self.running) < self.max_processes:
+            call = self.pending.pop(0)
+            if call.verbose: print("$ git " + ' '.join(call.args))
+            devnull = open(os.devnull)
+            # stderr goes to a file, so that only stdout needs watching
+            # and git never stalls on a full stderr pipe.
+            call._errfile = tempfile.TemporaryFile()
+            try:
+                try:
+                    call._proc = sub.Popen((self.git_executable,) + call.args,
+                                           stdin=devnull,
+                                           stdout=sub.PIPE,
+                                           stderr=call._errfile,
+                                           **call.popen_kwargs)
+                except OSError, e:
+                    self._finish(call, error=e)
+                    continue
+            finally:
+                devnull.close()
+            if call.timeout is not None:
+                call._deadline = time.time() + call.timeout
+            self.running[call._proc.stdout.fileno()] = call
+
+    def _read(self, call):
+        fd = call._proc.stdout.fileno()
+        data = os.read(fd, 64 * 1024)
+        if data:
+            call._chunks.append(data)
+            return
+        del self.running[fd]
+        call._proc.stdout.close()
+        rv = call._proc.wait()
+        error = None
+        if call.req and rv != call.req:
+            error = RuntimeError("Expected exit status %d, but got %d"
+                                 % (call.req, rv))
+        self._finish(call, rv, error)
+
+    def _expire(self):
+        now = time.time()
+        for call in self.running.values():
+            if call._deadline is not None and call._deadline <= now:
+                self._kill(call, GitTimeout("git %s timed out after %ss"
+                                            % (' '.join(call.args),
+                                               call.timeout)))
+
+    def _kill(self, call, error):
+        del self.running[call._proc.stdout.fileno()]
+        try:
+            os.kill(call._proc.pid, signal.SIGTERM)
+        except OSError:
+            pass
+        call._proc.stdout.close()
+        self._finish(call, call._proc.wait(), error)
+
+    def _cancel(self, call):
+        error = GitCancelled("git %s was cancelled" % ' '.join(call.args))
+        if call._proc is None:
+            self.pending.remove(call)
+            self._finish(call, error=error)
+        else:
+            self._kill(call, error)
+
+    def _finish(self, call, returncode=None, error=None):
+        call.returncode = returncode
+        call.error = error
+        call.output = ''.join(call._chunks)
+        call._chunks = []
+        if call._errfile is not None:
+            call._errfile.seek(0)
+            call.stderr = call._errfile.read()
+            call._errfile.close()
+            call._errfile = None
+        call._proc = None
+        call._done = True
+        if call.verbose:
+            print(call.output)
+            if call.stderr: print(call.stderr)
+            if error is not None: print(error)
+        callbacks, call.callbacks = call.callbacks, []
+        for fn in callbacks:
+            fn(call)
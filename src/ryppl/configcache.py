@@ -0,0 +1,78 @@
+"""ryppl.configcache
+
+Remembers the merged contents of ryppl's configuration files, so that
+Distribution.parse_config_files can skip ConfigParser entirely while
+none of them has changed.  Entries are keyed by the path, size and
+modification time of every file read, and the whole cache is a single
+marshal file under ~/.ryppl, loaded with one read.
+"""
+
+import os
+
+from ryppl.util import user_dir, load_cache, save_cache
+
+CACHE_FILE = "config.cache"
+
+# How many distinct sets of configuration files to remember; each
+# directory with its own .ryppl/ryppl.cfg makes one.
+MAX_ENTRIES = 64
+
+_FORMAT = 1
+
+
+def _stamp(filenames):
+    stamp = []
+    for filename in filenames:
+        try:
+            st = os.stat(filename)
+        except OSError:
+            return None
+        stamp.append((os.path.abspath(filename), st.st_size,
+                      int(st.st_mtime * 1000000)))
+    return tuple(stamp)
+
+
+def read_config_files(filenames):
+    """Return {section: {option: (filename, value)}} for 'filenames',
+    later files overriding earlier ones, with option names spelled
+    with underscores as Distribution.command_options expects.
+    """
+    from ConfigParser import ConfigParser
+    merged = {}
+    for filename in filenames:
+        # A fresh parser per file, so we know where each option came from.
+        parser = ConfigParser()
+        parser.read(filename)
+        for section in parser.sections():
+            opt_dict = merged.setdefault(section, {})
+            for opt in parser.options(section):
+                if opt != '__name__':
+                    opt_dict[opt.replace('-', '_')] = \
+                        (filename, parser.get(section, opt))
+    return merged
+
+
+class ConfigCache:
+    """The cache file at 'path' (by default ~/.ryppl/config.cache)."""
+
+    def __init__(self, path=None):
+        if path is None:
+            path = user_dir(CACHE_FILE)
+        self.path = path
+
+    def read(self, filenames):
+        """Like read_config_files(filenames), but from the cache when
+        the files are the same as last time.
+        """
+        stamp = _stamp(filenames)
+        if stamp is None:               # vanished since it was found
+            return read_config_files(filenames)
+        entries = load_cache(self.path, _FORMAT) or []
+        for key, merged in entries:
+            if key == stamp:
+                return merged
+        merged = read_config_files(filenames)
+        # Most recently stored first; the oldest fall off the end.
+        entries.insert(0, (stamp, merged))
+        save_cache(self.path, _FORMAT, entries[:MAX_ENTRIES])
+        return merged
@@ -10,7 +10,7 @@ __revision__ = "$Id: core.py 77704 2010-01-23 09:23:15Z tarek.ziade $"
 
 import sys
 import os
-distutils2.core import *
+from distutils2.core import *
 from ryppl.dist import Distribution
 
 import distutils2.core
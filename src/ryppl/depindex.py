@@ -0,0 +1,154 @@
+"""ryppl.depindex
+
+An index of the dependencies declared by the projects of a workspace,
+kept in .ryppl-workspace/depends.db, so that "what depends on libX?"
+(as when pushing a patch downstream; see "Developer Update" in
+doc/dependency-management.rst) is a lookup rather than a read of every
+project's .ryppl file.
+
+Each project's dependencies are stored with their constraints, indexed
+both ways.  refresh() brings the index up to date by looking at the
+size and modification time of every .ryppl file, reading only those
+that changed; projects that disappeared are dropped.  A project whose
+.ryppl file can't be parsed is left out (and read again next time).
+"""
+
+import os
+import sqlite3
+
+from ryppl.resolver import DEPENDS_FILE, allows, parse_constraint, \
+    parse_depends, read_ryppl
+from ryppl.workspace import STATE_DIR
+
+INDEX_FILE = "depends.db"
+
+_SCHEMA_VERSION = 1
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS project (
+    name TEXT PRIMARY KEY,
+    stamp TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS edge (
+    project TEXT NOT NULL,
+    dependency TEXT NOT NULL,
+    constraint_text TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS edge_project ON edge (project);
+CREATE INDEX IF NOT EXISTS edge_dependency ON edge (dependency);
+"""
+
+
+def _stamp(project_dir):
+    """What identifies the current state of the project's dependency
+    declarations without reading them: "" if it has none.
+    """
+    path = os.path.join(project_dir, DEPENDS_FILE)
+    if os.path.isdir(path):
+        path = os.path.join(path, "depends")
+    try:
+        st = os.stat(path)
+    except OSError:
+        return ""
+    return "%d %r" % (st.st_size, st.st_mtime)
+
+
+class DependencyIndex:
+    """The dependency index of the workspace at 'workspace' (stored in
+    'path', by default in the workspace's .ryppl-workspace directory).
+    Projects are the workspace's subdirectories, known by name.
+    """
+
+    def __init__(self, workspace=os.curdir, path=None):
+        self.workspace = workspace
+        if path is None:
+            state = os.path.join(workspace, STATE_DIR)
+            if not os.path.isdir(state):
+                os.makedirs(state)
+            path = os.path.join(state, INDEX_FILE)
+        self.db = sqlite3.connect(path, timeout=30)
+        self.problems = {}
+        if self.db.execute("PRAGMA user_version").fetchone()[0] \
+               != _SCHEMA_VERSION:
+            self.db.executescript("DROP TABLE IF EXISTS project;"
+                                  "DROP TABLE IF EXISTS edge;")
+            self.db.executescript(_SCHEMA)
+            self.db.execute("PRAGMA user_version = %d" % _SCHEMA_VERSION)
+            self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+    def refresh(self):
+        """Re-read the .ryppl files that changed since the last refresh.
+        Returns the names of the projects whose entries changed.  The
+        projects left out for a malformed .ryppl file are in
+        'problems', with the error ({name: message}).
+        """
+        known = dict(self.db.execute("SELECT name, stamp FROM project"))
+        changed = []
+        present = set()
+        self.problems = {}
+        for name in os.listdir(self.workspace):
+            path = os.path.join(self.workspace, name)
+            if name.startswith(".") or not os.path.isdir(path):
+                continue
+            present.add(name)
+            stamp = _stamp(path)
+            if known.get(name) == stamp:
+                continue
+            try:
+                edges = [(name, dependency,
+                          constraint and str(constraint) or "")
+                         for dependency, constraint
+                         in parse_depends(read_ryppl(path, "depends"))]
+            except ValueError, e:
+                self.problems[name] = str(e)
+                edges = []
+            if name in known or name not in self.problems:
+                changed.append(name)
+            self.db.execute("DELETE FROM edge WHERE project = ?", (name,))
+            self.db.executemany(
+                "INSERT INTO edge (project, dependency, constraint_text) "
+                "VALUES (?, ?, ?)", edges)
+            if name in self.problems:
+                # Unstamped, so that it is read (and reported) again.
+                self.db.execute("DELETE FROM project WHERE name = ?",
+                                (name,))
+            else:
+                self.db.execute("INSERT OR REPLACE INTO project "
+                                "(name, stamp) VALUES (?, ?)", (name, stamp))
+        gone = [(name,) for name in known if name not in present]
+        self.db.executemany("DELETE FROM project WHERE name = ?", gone)
+        self.db.executemany("DELETE FROM edge WHERE project = ?", gone)
+        self.db.commit()
+        return sorted(changed + [name for name, in gone])
+
+    def dependencies(self, name):
+        """The (dependency, constraint) pairs declared by 'name'."""
+        return [(dependency, parse_constraint(text))
+                for dependency, text in self.db.execute(
+                    "SELECT dependency, constraint_text FROM edge "
+                    "WHERE project = ?", (name,))]
+
+    def dependents(self, name, version=None, transitive=True):
+        """The names of the projects that depend on 'name', sorted: those
+        whose constraint on it admits 'version' (any, if None) and, if
+        'transitive', whatever depends on those in turn.
+        """
+        found = set()
+        todo = [name]
+        while todo:
+            target = todo.pop()
+            for project, text in self.db.execute(
+                    "SELECT project, constraint_text FROM edge "
+                    "WHERE dependency = ?", (target,)):
+                if project in found or project == name:
+                    continue
+                if target == name and version is not None \
+                       and not allows(parse_constraint(text), version):
+                    continue
+                found.add(project)
+                if transitive:
+                    todo.append(project)
+        return sorted(found)
@@ -4,11 +4,15 @@ Provides the Distribution class, which represents the module distribution
 being built/installed/distributed.
 """
 
+import os
+import sys
+
 import distutils2.dist
 from distutils2.util import check_environ, strtobool
 from distutils2 import log
 from distutils2.errors import (DistutilsOptionError, DistutilsArgError,
                               DistutilsModuleError)
+from ryppl.util import USER_DIR
 
 class Distribution(distutils2.dist.Distribution):
     global_options = list(distutils2.dist.Distribution.global_options)
@@ -50,10 +54,7 @@ Common commands: (see '--help-commands' for more)
             files.append(sys_file)
 
         # What to call the per-user config file
-        if os.name == 'posix':
-            user_filename = ".ryppl/ryppl.cfg"
-        else:
-            user_filename = "ryppl/ryppl.cfg"
+        user_filename = os.path.join(USER_DIR, "ryppl.cfg")
 
         # And look for the user config file
         if self.want_user_cfg:
@@ -70,30 +71,17 @@ Common commands: (see '--help-commands' for more)
         return files
 
     def parse_config_files(self, filenames=None):
-        from ConfigParser import ConfigParser
+        from ryppl.configcache import ConfigCache
 
         if filenames is None:
             filenames = self.find_config_files()
 
         log.debug("Distribution.parse_config_files():")
 
-        parser = ConfigParser()
-        for filename in filenames:
-            log.debug("  reading %s" % filename)
-            parser.read(filename)
-            for section in parser.sections():
-                options = parser.options(section)
-                opt_dict = self.get_option_dict(section)
-
-                for opt in options:
-                    if opt != '__name__':
-                        val = parser.get(section,opt)
-                        opt = opt.replace('-', '_')
-                        opt_dict[opt] = (filename, val)
-
-            # Make the ConfigParser forget everything (so we retain
-            # the original filenames that options come from)
-            parser.__init__()
+        # The merged options of an unchanged set of files come straight
+        # from the cache, without running ConfigParser again.
+        for section, options in ConfigCache().read(filenames).items():
+            self.get_option_dict(section).update(options)
 
         # If there was a "global" section in the config file, use it
         # to set Distribution options.
@@ -0,0 +1,144 @@
+"""ryppl.executor
+
+Runs one command over many projects at once with a bounded pool of
+worker threads.  Each worker owns its own Git instance; whatever a
+project's run prints is buffered and reported in the order the
+projects were given, as soon as every project before it is done.
+"""
+
+import sys
+import threading
+import traceback
+from Queue import Queue, Empty
+
+
+class _ThreadOutput:
+    """A stand-in for sys.stdout that sends writes from threads with a
+    buffer installed to that buffer, and everything else to 'stream'.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.local = threading.local()
+
+    def write(self, text):
+        buffer = getattr(self.local, 'buffer', None)
+        if buffer is None:
+            self.stream.write(text)
+        else:
+            buffer.append(text)
+
+    def flush(self):
+        if getattr(self.local, 'buffer', None) is None:
+            self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+class ProjectFailed(Exception):
+    """Raised by an action to report that a project failed, with a
+    message instead of a traceback.
+    """
+
+
+class ProjectResult:
+    """What happened when running a command on one project."""
+
+    def __init__(self, project):
+        self.project = project
+        self.output = ''
+        self.value = None
+        self.error = None
+
+    def ok(self):
+        return self.error is None
+
+
+def run_projects(action, projects, make_git, jobs=1, report=None):
+    """Call action(git, project) for every project in 'projects', using
+    at most 'jobs' threads.  'make_git' creates the Git each thread
+    uses (it is closed when the thread is done, if it has close()).
+
+    'report', if given, is called with each ProjectResult in project
+    order; by default the project's output is written to stdout under
+    a header line.  Returns the list of ProjectResults, in order.
+
+    An action raising something other than an Exception (SystemExit,
+    say) stops the run: no more projects are started, and it is raised
+    again here.
+    """
+    if report is None:
+        report = print_result
+    projects = list(projects)
+    results = [ProjectResult(p) for p in projects]
+    done = [threading.Event() for p in projects]
+    todo = Queue()
+    for i in range(len(projects)):
+        todo.put(i)
+
+    # The exc_info of anything other than an Exception (SystemExit,
+    # KeyboardInterrupt) raised in a worker, for the caller to get.
+    fatal = []
+
+    def work():
+        git = None
+        try:
+            git = make_git()
+            output.local.buffer = buffer = []
+            while not fatal:
+                try:
+                    i = todo.get_nowait()
+                except Empty:
+                    return
+                result = results[i]
+                del buffer[:]
+                try:
+                    result.value = action(git, result.project)
+                except ProjectFailed, e:
+                    result.error = e
+                    buffer.append("%s\n" % e)
+                except Exception:
+                    result.error = sys.exc_info()[1]
+                    buffer.append(traceback.format_exc())
+                except BaseException:
+                    result.error = sys.exc_info()[1]
+                    fatal.append(sys.exc_info())
+                finally:
+                    result.output = ''.join(buffer)
+                    done[i].set()
+        except BaseException:
+            fatal.append(sys.exc_info())
+        finally:
+            output.local.buffer = None
+            if hasattr(git, 'close'):
+                git.close()
+
+    threads = [threading.Thread(target=work)
+               for n in range(max(1, min(jobs, len(projects))))]
+    real_stdout = sys.stdout
+    output = sys.stdout = _ThreadOutput(real_stdout)
+    try:
+        for t in threads:
+            t.setDaemon(True)
+            t.start()
+        for i, result in enumerate(results):
+            # Event.wait() with a timeout stays interruptible by ^C.
+            while not done[i].isSet() and not fatal:
+                done[i].wait(0.5)
+            if fatal:
+                type, value, tb = fatal[0]
+                raise type, value, tb
+            report(result)
+        for t in threads:
+            t.join()
+    finally:
+        sys.stdout = real_stdout
+    return results
+
+
+def print_result(result):
+    status = result.ok() and "ok" or "FAILED"
+    sys.stdout.write("== %s (%s)\n" % (result.project, status))
+    sys.stdout.write(result.output)
+    sys.stdout.flush()
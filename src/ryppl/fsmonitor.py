@@ -0,0 +1,341 @@
+"""ryppl.fsmonitor
+
+A file system watcher for git's fsmonitor hook on Linux, where git has
+no built-in monitor.
+
+A daemon per working tree watches every directory in it with inotify
+and numbers the changes it sees.  Asked over a unix socket for what
+changed since a token it handed out earlier, it answers with a new
+token and the paths touched since; anything it can't vouch for (a
+token from before it started, an inotify queue overflow) is answered
+with "/", meaning "assume everything changed".  Git uses this through
+the hook (core.fsmonitor = hook_command()), implementing version 2 of
+the hook protocol; ryppl.status asks the daemon directly.
+
+This file doesn't import the rest of ryppl: as the hook, it is run as
+a script by git on every status, and must start quickly.  Daemons exit
+after IDLE_TIMEOUT seconds without a query, or when their tree goes.
+A daemon only remembers changes that tokens handed out in the last
+TOKEN_LIFETIME seconds may ask about; older tokens get "/".
+"""
+
+import os
+import sys
+import time
+import errno
+import socket
+import struct
+import select
+import hashlib
+
+IDLE_TIMEOUT = 3 * 3600
+TOKEN_LIFETIME = 3600
+
+# inotify(7)
+IN_MODIFY = 0x2
+IN_ATTRIB = 0x4
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_DELETE_SELF = 0x400
+IN_MOVE_SELF = 0x800
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_ONLYDIR = 0x1000000
+IN_DONT_FOLLOW = 0x2000000
+IN_EXCL_UNLINK = 0x4000000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0x80000
+
+_WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM
+               | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+               | IN_MOVE_SELF | IN_ONLYDIR | IN_DONT_FOLLOW | IN_EXCL_UNLINK)
+
+_EVENT = struct.Struct("iIII")
+
+_libc = None
+
+
+def _inotify():
+    """libc, if it has inotify; else None."""
+    global _libc
+    if _libc is None:
+        _libc = False
+        if sys.platform.startswith("linux"):
+            try:
+                import ctypes
+                libc = ctypes.CDLL(None, use_errno=True)
+                libc.inotify_init1, libc.inotify_add_watch
+                _libc = libc
+            except (OSError, AttributeError, ImportError):
+                pass
+    return _libc or None
+
+
+def available():
+    """Whether this machine can run the watcher."""
+    return _inotify() is not None and hasattr(socket, "AF_UNIX")
+
+
+def socket_path(worktree):
+    """Where the daemon watching 'worktree' listens."""
+    import tempfile
+    directory = os.path.join(tempfile.gettempdir(),
+                             "ryppl-fsmonitor-%d" % os.getuid())
+    if not os.path.isdir(directory):
+        try:
+            os.mkdir(directory, 0700)
+        except OSError, e:
+            if e.errno != errno.EEXIST:
+                raise
+    name = hashlib.sha1(os.path.realpath(worktree)).hexdigest()[:16]
+    return os.path.join(directory, name)
+
+
+def hook_command():
+    """The value of core.fsmonitor that makes git use this hook."""
+    script = os.path.abspath(__file__)
+    if script.endswith((".pyc", ".pyo")):
+        script = script[:-1]
+    return '"%s" "%s" hook' % (sys.executable, script)
+
+
+def query(worktree, token, timeout=1.0):
+    """Ask the daemon watching 'worktree' what changed since 'token'.
+    Returns (new token, [paths]), paths relative to the tree and "/"
+    standing for everything, or None if no daemon is listening.
+    """
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    s.settimeout(timeout)
+    try:
+        try:
+            s.connect(socket_path(worktree))
+            s.sendall((token or "") + "\n")
+            chunks = []
+            while True:
+                data = s.recv(65536)
+                if not data:
+                    break
+                chunks.append(data)
+        except socket.error:
+            return None
+    finally:
+        s.close()
+    reply = "".join(chunks).split("\0")
+    if len(reply) < 2:
+        return None
+    return reply[0], [path for path in reply[1:] if path]
+
+
+def start(worktree):
+    """Start a daemon watching 'worktree' in the background."""
+    import subprocess
+    script = os.path.abspath(__file__)
+    if script.endswith((".pyc", ".pyo")):
+        script = script[:-1]
+    devnull = open(os.devnull, "r+")
+    try:
+        subprocess.Popen([sys.executable, script, "serve",
+                          os.path.realpath(worktree)],
+                         stdin=devnull, stdout=devnull, stderr=devnull,
+                         close_fds=True, preexec_fn=os.setsid,
+                         cwd="/")
+    finally:
+        devnull.close()
+
+
+class Watcher:
+    """Watches every directory under 'root' except .git, numbering the
+    changes.  'changes' maps relative paths to the number of their
+    last change; 'issued' lists the (time, number) of the tokens
+    handed out, oldest first.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.libc = _inotify()
+        self.fd = self.libc.inotify_init1(IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(_errno(), "inotify_init1 failed")
+        self.id = "%d.%d" % (os.getpid(), time.time())
+        self.seq = 0
+        self.since = 0              # tokens before this can't be answered
+        self.changes = {}
+        self.issued = []
+        self.dirs = {}              # watch descriptor -> relative path
+        self.watch_tree("")
+
+    def watch_tree(self, top):
+        for dirpath, dirnames, filenames in os.walk(
+                os.path.join(self.root, top)):
+            if dirpath == self.root and ".git" in dirnames:
+                dirnames.remove(".git")
+            relative = os.path.relpath(dirpath, self.root)
+            self.watch(relative != "." and relative or "")
+
+    def watch(self, relative):
+        wd = self.libc.inotify_add_watch(
+            self.fd, os.path.join(self.root, relative), _WATCH_MASK)
+        if wd < 0:
+            if _errno() == errno.ENOSPC:
+                # Out of watches: we can't vouch for anything.
+                raise OSError(errno.ENOSPC, "inotify watch limit reached")
+            return                  # gone already
+        self.dirs[wd] = relative
+
+    def token(self):
+        if self.issued and self.issued[-1][1] == self.seq:
+            self.issued.pop()       # handed out again: keep the latest
+        self.issued.append((time.time(), self.seq))
+        return "ryppl:%s:%d" % (self.id, self.seq)
+
+    def compact(self, lifetime=TOKEN_LIFETIME):
+        """Forget the tokens handed out over 'lifetime' seconds ago, and
+        the changes only they could ask about.
+        """
+        cutoff = time.time() - lifetime
+        while self.issued and self.issued[0][0] < cutoff:
+            self.issued.pop(0)
+        if self.issued:
+            oldest = self.issued[0][1]
+        else:
+            oldest = self.seq
+        if oldest > self.since:
+            self.since = oldest
+            for path, n in self.changes.items():
+                if n <= oldest:
+                    del self.changes[path]
+
+    def changed_since(self, token):
+        """The paths changed since 'token' (["/"] if unknown)."""
+        parts = (token or "").split(":")
+        if len(parts) != 3 or parts[:2] != ["ryppl", self.id]:
+            return ["/"]
+        try:
+            seq = int(parts[2])
+        except ValueError:
+            return ["/"]
+        if seq < self.since:
+            return ["/"]
+        return sorted(path for path, n in self.changes.iteritems()
+                      if n > seq)
+
+    def read(self):
+        data = os.read(self.fd, 65536)
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = _EVENT.unpack_from(data, offset)
+            offset += _EVENT.size
+            name = data[offset:offset + length].rstrip("\0")
+            offset += length
+            self.seq += 1
+            if mask & IN_Q_OVERFLOW:
+                self.since = self.seq
+                continue
+            parent = self.dirs.get(wd)
+            if parent is None:
+                continue
+            if mask & IN_IGNORED:
+                del self.dirs[wd]
+                continue
+            path = name and os.path.join(parent, name) or parent
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    self.watch_tree(path)
+                path += "/"
+            if path and path != "/" and path.split("/", 1)[0] != ".git":
+                self.changes[path] = self.seq
+
+    def serve(self, path, idle_timeout=IDLE_TIMEOUT):
+        """Answer queries on the unix socket at 'path' until idle."""
+        if os.path.exists(path):
+            os.remove(path)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(path)
+        server.listen(16)
+        last_query = compacted = time.time()
+        try:
+            while os.path.isdir(self.root):
+                ready = select.select([self.fd, server], [], [], 60)[0]
+                if self.fd in ready:
+                    self.read()
+                if server in ready:
+                    self.answer(server.accept()[0])
+                    last_query = time.time()
+                elif time.time() - last_query > idle_timeout:
+                    break
+                if time.time() - compacted > 60:
+                    self.compact()
+                    compacted = time.time()
+        finally:
+            server.close()
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def answer(self, connection):
+        try:
+            connection.settimeout(1.0)
+            request = ""
+            while not request.endswith("\n"):
+                data = connection.recv(4096)
+                if not data:
+                    break
+                request += data
+            # Events already queued belong before the new token.
+            while select.select([self.fd], [], [], 0)[0]:
+                self.read()
+            paths = self.changed_since(request.strip())
+            connection.sendall(self.token() + "\0" + "\0".join(paths) + "\0")
+        except socket.error:
+            pass
+        finally:
+            connection.close()
+
+
+def _errno():
+    import ctypes
+    return ctypes.get_errno()
+
+
+def hook(args):
+    """git's fsmonitor hook, protocol version 2: print a new token and
+    the paths changed since the token given, NUL-terminated.
+    """
+    if args[:1] != ["2"]:
+        return 1                    # git falls back to a full scan
+    worktree = os.getcwd()
+    reply = query(worktree, len(args) > 1 and args[1] or "")
+    if reply is None:
+        if available():
+            start(worktree)
+        reply = ("ryppl:none", ["/"])
+    token, paths = reply
+    sys.stdout.write(token + "\0" + "".join(path + "\0" for path in paths))
+    return 0
+
+
+def main(args):
+    if args[:1] == ["hook"]:
+        return hook(args[1:])
+    if args[:1] == ["serve"] and len(args) == 2:
+        path = socket_path(args[1])
+        if query(args[1], "") is not None:
+            return 0                # someone else is watching already
+        try:
+            watcher = Watcher(args[1])
+        except OSError:
+            return 1
+        import signal
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        watcher.serve(path)
+        return 0
+    sys.stderr.write("usage: fsmonitor.py hook VERSION TOKEN | serve TREE\n")
+    return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,129 @@
+"""ryppl.gitinfo
+
+Finds the git executable and what it can do, without starting git on
+every run.  The executable is looked up on PATH; its version is asked
+once and the features ryppl cares about are derived from it.  The
+result is kept in ~/.ryppl/git.cache and trusted until the binary's
+size or modification time changes (i.e. git was upgraded).
+"""
+
+import os
+import re
+import sys
+
+from ryppl.util import user_dir, load_cache, save_cache
+
+CACHE_FILE = "git.cache"
+
+_FORMAT = 1
+
+# The first git release supporting each feature.
+FEATURES = {
+    "dissociate": (2, 3),               # clone --dissociate
+    "batch-all-objects": (2, 6),        # cat-file --batch-all-objects
+    "untracked-cache": (2, 8),          # core.untrackedCache
+    "split-index": (2, 13),             # core.splitIndex
+    "porcelain-v2": (2, 11),            # status --porcelain=v2
+    "partial-clone": (2, 19),           # clone/fetch --filter
+    "sparse-checkout": (2, 25),         # git sparse-checkout
+    "batch-command": (2, 36),           # cat-file --batch-command
+    "refetch": (2, 36),                 # fetch --refetch
+    "builtin-fsmonitor": (2, 36),       # core.fsmonitor=true
+    "fsmonitor-hook": (2, 26),          # hook protocol version 2
+    }
+
+# Features git only has on some platforms.
+PLATFORMS = {
+    "builtin-fsmonitor": ("darwin", "win32"),
+    }
+
+
+class GitInfo:
+    """What we know about one git executable."""
+
+    def __init__(self, path, version):
+        self.path = path
+        self.version = version          # tuple of ints, e.g. (2, 39, 1)
+        self.features = frozenset(
+            name for name, first in FEATURES.items()
+            if version >= first
+            and sys.platform in PLATFORMS.get(name, (sys.platform,)))
+
+    def supports(self, feature):
+        return feature in self.features
+
+    def __repr__(self):
+        return "GitInfo(%r, %r)" % (self.path, self.version)
+
+
+def find_executable(name):
+    """The full path of the program 'name' (searched for on PATH unless
+    it contains a directory), or None if there is no such program.
+    """
+    if os.path.dirname(name):
+        candidates = [name]
+    else:
+        candidates = [os.path.join(d, name)
+                      for d in os.environ.get("PATH", os.defpath).split(
+                          os.pathsep)]
+    exts = [""]
+    if os.name == "nt":
+        exts += os.environ.get("PATHEXT", ".EXE").lower().split(os.pathsep)
+    for candidate in candidates:
+        for ext in exts:
+            path = candidate + ext
+            if os.path.isfile(path) and os.access(path, os.X_OK):
+                return os.path.abspath(path)
+    return None
+
+
+def parse_version(output):
+    """The version tuple in the output of "git --version", or None."""
+    m = re.search(r"git version (\d+(?:\.\d+)*)", output)
+    if m is None:
+        return None
+    return tuple(int(n) for n in m.group(1).split("."))
+
+
+def _stamp(path):
+    st = os.stat(path)
+    return st.st_size, int(st.st_mtime * 1000000)
+
+
+def _ask_version(path):
+    import subprocess as sub
+    devnull = open(os.devnull)
+    try:
+        try:
+            p = sub.Popen((path, "--version"), stdin=devnull,
+                          stdout=sub.PIPE, stderr=sub.STDOUT)
+        except OSError:
+            return None
+        output = p.communicate()[0]
+    finally:
+        devnull.close()
+    if p.returncode != 0:
+        return None
+    return parse_version(output)
+
+
+def discover(git_executable="git", cache_path=None):
+    """Return a GitInfo for 'git_executable', or None if it can't be
+    found or doesn't run.
+    """
+    path = find_executable(git_executable)
+    if path is None:
+        return None
+    stamp = _stamp(path)
+    if cache_path is None:
+        cache_path = user_dir(CACHE_FILE)
+    entries = load_cache(cache_path, _FORMAT) or {}
+    cached = entries.get(path)
+    if cached is not None and cached[0] == stamp:
+        return GitInfo(path, cached[1])
+    version = _ask_version(path)
+    if version is None:
+        return None
+    entries[path] = (stamp, version)
+    save_cache(cache_path, _FORMAT, entries)
+    return GitInfo(path, version)
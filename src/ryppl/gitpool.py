@@ -0,0 +1,324 @@
+"""ryppl.gitpool
+
+Keeps long-lived "git cat-file --batch" and "--batch-check" processes
+around, one pair per repository, so that read-only queries (rev-parse,
+object lookups, ls-tree) don't cost a fork/exec each.  Used by the Git
+class in ryppl.py; any query that can't be answered exactly the way
+the corresponding one-shot git command would answer it is declined
+(query() returns None) and the caller runs the real command instead.
+Objects that ryppl.objects can read straight from the repository are
+read that way, without even the batch processes; the readers of a
+pool share one ObjectCache, so the memory they keep objects in and
+the packs they map don't grow with the number of repositories.
+"""
+
+import os
+import re
+import zlib
+import struct
+import binascii
+import threading
+import subprocess as sub
+
+from ryppl.objects import ObjectCache, ObjectReader, find_git_dir
+
+# Commands that never change repository state.  Running anything else
+# through a one-shot process may move refs or add objects, so the
+# repository's workers are thrown away afterwards.
+READ_ONLY_COMMANDS = frozenset([
+    "blame", "cat-file", "config", "describe", "diff", "for-each-ref",
+    "grep", "help", "log", "ls-files", "ls-remote", "ls-tree",
+    "merge-base", "name-rev", "rev-list", "rev-parse", "shortlog", "show",
+    "show-ref", "status", "version", "whatchanged",
+    ])
+
+# Settings that change where git finds a repository's objects, which
+# the object reader doesn't follow.
+_GIT_ENVIRONMENT = ("GIT_DIR", "GIT_COMMON_DIR", "GIT_OBJECT_DIRECTORY",
+                    "GIT_ALTERNATE_OBJECT_DIRECTORIES")
+
+# Names that ls-tree would print without C-style quoting.
+_plain_name = re.compile(r'^[\x20-\x21\x23-\x5b\x5d-\x7e]+$')
+
+_tree_entry_types = {"40000": "tree", "160000": "commit"}
+
+
+class CatFile:
+    """A pair of "git cat-file" batch processes bound to one repository.
+
+    Both processes are started on first use.  All access is serialized
+    with a lock, so one CatFile may be shared between threads.  Objects
+    read without git are kept in 'cache' (an ObjectCache), if given.
+    """
+
+    def __init__(self, git_executable, cwd, cache=None):
+        self.git_executable = git_executable
+        self.cwd = cwd
+        self.cache = cache
+        self.lock = threading.Lock()
+        self._batch = None
+        self._check = None
+        self._objects = None        # an ObjectReader, or False if none
+
+    def _local(self, rev, whole=True):
+        """(sha, type, data) for 'rev' read without git, or None; with
+        'whole' false, (sha, type, size).
+        """
+        if self._objects is None:
+            gitdir = not [name for name in _GIT_ENVIRONMENT
+                          if name in os.environ] and find_git_dir(self.cwd)
+            self._objects = gitdir and ObjectReader(gitdir, self.cache) \
+                or False
+        if not self._objects:
+            return None
+        try:
+            if whole:
+                return self._objects.lookup(rev)
+            return self._objects.info(rev)
+        except (ValueError, zlib.error, EnvironmentError, struct.error,
+                IndexError):
+            # Corrupt, or being rewritten as we read (a truncated idx
+            # or pack, say): git knows what to make of it.
+            return None
+
+    def _start(self, mode):
+        return sub.Popen((self.git_executable, "cat-file", mode),
+                         stdin=sub.PIPE,
+                         stdout=sub.PIPE,
+                         stderr=open(os.devnull, "w"),
+                         cwd=self.cwd)
+
+    def _ask(self, proc, rev):
+        proc.stdin.write(rev + "\n")
+        proc.stdin.flush()
+        header = proc.stdout.readline()
+        if not header:
+            raise EOFError("git cat-file exited unexpectedly in %s" % self.cwd)
+        fields = header.split()
+        if len(fields) != 3:                # "<rev> missing", "ambiguous"
+            return None
+        return fields[0], fields[1], int(fields[2])
+
+    def info(self, rev):
+        """Return (sha, type, size) for 'rev', or None if git can't
+        resolve it to a single object.
+        """
+        self.lock.acquire()
+        try:
+            found = self._local(rev, whole=False)
+            if found is not None:
+                return found
+            if self._check is None:
+                self._check = self._start("--batch-check")
+            return self._ask(self._check, rev)
+        finally:
+            self.lock.release()
+
+    def read(self, rev):
+        """Return (sha, type, data) for 'rev', or None if git can't
+        resolve it to a single object.
+        """
+        self.lock.acquire()
+        try:
+            found = self._local(rev)
+            if found is not None:
+                return found
+            if self._batch is None:
+                self._batch = self._start("--batch")
+            found = self._ask(self._batch, rev)
+            if found is None:
+                return None
+            sha, type, size = found
+            data = self._batch.stdout.read(size)
+            self._batch.stdout.read(1)      # trailing newline
+            return sha, type, data
+        finally:
+            self.lock.release()
+
+    def close(self):
+        self.lock.acquire()
+        try:
+            for proc in (self._batch, self._check):
+                if proc is not None:
+                    proc.stdin.close()
+                    proc.wait()
+            self._batch = self._check = None
+            if self._objects:
+                self._objects.close()
+            self._objects = None
+        finally:
+            self.lock.release()
+
+
+def _valid_rev(rev):
+    return rev and not rev.startswith("-") and not re.search(r"\s", rev)
+
+
+def format_tree(data):
+    """Format the raw contents of a tree object the way "git ls-tree"
+    prints it.  Returns None if some entry would need quoting.
+    """
+    lines = []
+    pos = 0
+    while pos < len(data):
+        space = data.index(" ", pos)
+        nul = data.index("\0", space)
+        mode = data[pos:space]
+        name = data[space + 1:nul]
+        sha = binascii.hexlify(data[nul + 1:nul + 21])
+        pos = nul + 21
+        if not _plain_name.match(name):
+            return None
+        lines.append("%06d %s %s\t%s\n"
+                     % (int(mode), _tree_entry_types.get(mode, "blob"),
+                        sha, name))
+    return "".join(lines)
+
+
+class GitPool:
+    """Per-repository CatFile workers, keyed by working directory.
+
+    At most 'max_repos' repositories keep live workers; the least
+    recently used ones are closed when that limit is exceeded, so a
+    walk over hundreds of projects doesn't run out of file descriptors.
+    The workers share one ObjectCache.
+    """
+
+    def __init__(self, git_executable="git", max_repos=32):
+        self.git_executable = git_executable
+        self.max_repos = max_repos
+        self.cache = ObjectCache()
+        self.lock = threading.Lock()
+        self.workers = {}
+        self.lru = []
+
+    def worker(self, cwd=None):
+        key = os.path.abspath(cwd or os.getcwd())
+        self.lock.acquire()
+        try:
+            worker = self.workers.get(key)
+            if worker is None:
+                worker = self.workers[key] = CatFile(self.git_executable, key,
+                                                     self.cache)
+            else:
+                self.lru.remove(key)
+            self.lru.append(key)
+            stale = []
+            while len(self.lru) > self.max_repos:
+                stale.append(self.workers.pop(self.lru.pop(0)))
+        finally:
+            self.lock.release()
+        for old in stale:
+            old.close()
+        return worker
+
+    def discard(self, cwd=None):
+        """Close the workers for the repository at 'cwd', e.g. because
+        a command may have changed what its refs point at.
+        """
+        key = os.path.abspath(cwd or os.getcwd())
+        self.lock.acquire()
+        try:
+            worker = self.workers.pop(key, None)
+            if worker is not None:
+                self.lru.remove(key)
+        finally:
+            self.lock.release()
+        if worker is not None:
+            worker.close()
+
+    def after_command(self, args, cwd=None):
+        """Note that the git command 'args' was run as a separate
+        process in 'cwd'.
+        """
+        if args[:1] and args[0] not in READ_ONLY_COMMANDS:
+            self.discard(cwd)
+
+    def close(self):
+        self.lock.acquire()
+        try:
+            workers = self.workers.values()
+            self.workers = {}
+            self.lru = []
+        finally:
+            self.lock.release()
+        for worker in workers:
+            worker.close()
+
+    def query(self, args, cwd=None):
+        """Answer the git command 'args' from the pool.  Returns the
+        text the one-shot command would have printed, or None if the
+        command isn't one we handle (or failed, in which case the
+        caller should rerun it to get git's own error message).
+        """
+        if not args:
+            return None
+        handler = self._handlers.get(args[0])
+        if handler is None:
+            return None
+        return handler(self, args[1:], cwd)
+
+    def _rev_parse(self, args, cwd):
+        if args[:1] == ("--verify",):
+            args = args[1:]
+            if len(args) != 1:
+                return None
+        if not args or not all(_valid_rev(a) for a in args):
+            return None
+        worker = self.worker(cwd)
+        shas = []
+        for rev in args:
+            found = worker.info(rev)
+            if found is None:
+                return None
+            shas.append(found[0] + "\n")
+        return "".join(shas)
+
+    def _cat_file(self, args, cwd):
+        if len(args) != 2 or not _valid_rev(args[1]):
+            return None
+        flag, rev = args
+        worker = self.worker(cwd)
+        if flag in ("-t", "-s", "-e"):
+            found = worker.info(rev)
+            if found is None:
+                return None
+            return {"-t": found[1] + "\n",
+                    "-s": "%d\n" % found[2],
+                    "-e": ""}[flag]
+        found = worker.read(rev)
+        if found is None:
+            return None
+        sha, type, data = found
+        if flag == "-p":
+            if type == "tree":
+                return format_tree(data)
+            return data
+        if flag == type:
+            return data
+        return None
+
+    def _ls_tree(self, args, cwd):
+        if len(args) != 1 or not _valid_rev(args[0]):
+            return None
+        found = self.worker(cwd).read(args[0] + "^{tree}")
+        if found is None:
+            return None
+        return format_tree(found[2])
+
+    def _show(self, args, cwd):
+        # Only "git show <rev>:<path>" naming a blob; everything else
+        # gets decorated by show and goes to a real git process.
+        if len(args) != 1 or ":" not in args[0] or not _valid_rev(args[0]):
+            return None
+        found = self.worker(cwd).read(args[0])
+        if found is None or found[1] != "blob":
+            return None
+        return found[2]
+
+    _handlers = {
+        "rev-parse": _rev_parse,
+        "cat-file": _cat_file,
+        "ls-tree": _ls_tree,
+        "show": _show,
+        }
@@ -0,0 +1,633 @@
+"""ryppl.objects
+
+Reads git objects straight from a repository's object database, so
+that looking at a file as of some commit (a .ryppl file, say) costs
+no git process at all.
+
+Loose objects are inflated with zlib.  Packed ones are found through
+each pack's .idx, memory-mapped: its fan-out table narrows the search
+to the objects whose sha starts with the same byte, a binary search
+does the rest.  Deltified objects are rebuilt from their bases, the
+objects built lately being kept (up to CACHE_SIZE bytes of them, the
+least recently used dropped first) since neighbouring files tend to
+share bases.  Alternates are followed; a pack that appears after the
+reader started (after a fetch, say) is noticed when an object isn't
+found.  Readers of many repositories can share one ObjectCache, and
+with it that budget and the packs they have in common (those of an
+object store they all borrow from, say), each mapped once.
+
+An object's type and size are read from its header alone, as "git
+cat-file --batch-check" does: a delta gives the size of its result
+before its instructions, and only the headers of its bases are looked
+at for the type.
+
+The reader only answers what it can answer exactly as "git cat-file"
+would; anything else (abbreviated shas, revision expressions beyond
+<name>, <name>^{<type>} and <name>:<path>, replaced objects, sha-256
+repositories) gets None, for the caller to ask git.
+"""
+
+import os
+import re
+import mmap
+import zlib
+import struct
+import threading
+from binascii import hexlify, unhexlify
+from collections import OrderedDict
+
+from ryppl.refs import common_dir, git_dir, list_refs, read_ref
+from ryppl.util import parse_git_config
+
+# How many bytes of objects to keep for building others from.
+CACHE_SIZE = 32 * 1024 * 1024
+
+TYPES = {1: "commit", 2: "tree", 3: "blob", 4: "tag"}
+_OFS_DELTA = 6
+_REF_DELTA = 7
+
+_sha_re = re.compile(r'^[0-9a-f]{40}$')
+_rev_re = re.compile(r'^([^:^]+)(\^\{(commit|tree|blob|tag|)\})?(:(.*))?$',
+                     re.S)
+
+# The places git looks for <name>, in order (see gitrevisions(7)).
+_DWIM = ("%s", "refs/%s", "refs/tags/%s", "refs/heads/%s",
+         "refs/remotes/%s", "refs/remotes/%s/HEAD")
+
+_uint32 = struct.Struct(">I")
+_uint64 = struct.Struct(">Q")
+
+
+class _Pack:
+    """One pack and its index (version 2), both memory-mapped."""
+
+    def __init__(self, idx_path):
+        self.path = idx_path
+        self.idx = _map(idx_path)
+        self.pack = _map(idx_path[:-len(".idx")] + ".pack")
+        if self.idx is None or self.idx[:8] != "\377tOc\0\0\0\2" or \
+               self.pack is None or self.pack[:4] != "PACK":
+            self.close()
+            raise ValueError("%s: not a version 2 pack index and its pack"
+                             % idx_path)
+        self.count = _uint32.unpack_from(self.idx, 8 + 255 * 4)[0]
+        self.names = 8 + 256 * 4
+        self.offsets = self.names + self.count * (20 + 4)
+        self.large = self.offsets + self.count * 4
+
+    def close(self):
+        for m in (self.idx, self.pack):
+            if m is not None:
+                m.close()
+
+    def find(self, binsha):
+        """The offset in the pack of the object 'binsha', or None."""
+        idx = self.idx
+        first = ord(binsha[0])
+        lo = first and _uint32.unpack_from(idx, 8 + (first - 1) * 4)[0] or 0
+        hi = _uint32.unpack_from(idx, 8 + first * 4)[0]
+        names = self.names
+        while lo < hi:
+            mid = (lo + hi) // 2
+            at = names + mid * 20
+            found = idx[at:at + 20]
+            if found < binsha:
+                lo = mid + 1
+            elif found > binsha:
+                hi = mid
+            else:
+                offset = _uint32.unpack_from(idx, self.offsets + mid * 4)[0]
+                if offset & 0x80000000:
+                    offset = _uint64.unpack_from(
+                        idx, self.large + (offset & 0x7fffffff) * 8)[0]
+                return offset
+        return None
+
+    def header(self, offset):
+        """(type, size, where the data begins, base) of the entry at
+        'offset'; base is the offset of a delta's base in this pack or
+        the binary sha of one elsewhere, else None.
+        """
+        pack = self.pack
+        c = ord(pack[offset])
+        type = (c >> 4) & 7
+        size = c & 15
+        shift = 4
+        pos = offset + 1
+        while c & 0x80:
+            c = ord(pack[pos])
+            size |= (c & 0x7f) << shift
+            shift += 7
+            pos += 1
+        base = None
+        if type == _OFS_DELTA:
+            c = ord(pack[pos])
+            pos += 1
+            distance = c & 0x7f
+            while c & 0x80:
+                c = ord(pack[pos])
+                pos += 1
+                distance = ((distance + 1) << 7) | (c & 0x7f)
+            base = offset - distance
+        elif type == _REF_DELTA:
+            base = pack[pos:pos + 20]
+            pos += 20
+        return type, size, pos, base
+
+    def inflate(self, pos, size):
+        """The 'size' bytes zlib-compressed at 'pos' in the pack."""
+        d = zlib.decompressobj()
+        chunks = []
+        got = 0
+        step = size + 64
+        while got < size:
+            chunk = self.pack[pos:pos + step]
+            if not chunk:
+                raise zlib.error("truncated pack entry")
+            pos += step
+            data = d.decompress(chunk, size - got)
+            chunks.append(data)
+            got += len(data)
+            while d.unconsumed_tail and got < size:
+                data = d.decompress(d.unconsumed_tail, size - got)
+                chunks.append(data)
+                got += len(data)
+            step = 65536
+        return "".join(chunks)
+
+
+def _map(path):
+    try:
+        f = open(path, "rb")
+    except IOError:
+        return None
+    try:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    finally:
+        f.close()
+
+
+def _varint(data, pos):
+    value = shift = 0
+    while True:
+        c = ord(data[pos])
+        pos += 1
+        value |= (c & 0x7f) << shift
+        shift += 7
+        if not c & 0x80:
+            return value, pos
+
+
+def apply_delta(base, delta):
+    """The object 'delta' (a git delta) describes in terms of 'base'."""
+    size, pos = _varint(delta, 0)
+    if size != len(base):
+        raise ValueError("delta base size mismatch")
+    size, pos = _varint(delta, pos)
+    out = []
+    end = len(delta)
+    while pos < end:
+        op = ord(delta[pos])
+        pos += 1
+        if op & 0x80:               # copy from the base
+            start = length = 0
+            for i in range(4):
+                if op & (1 << i):
+                    start |= ord(delta[pos]) << (8 * i)
+                    pos += 1
+            for i in range(3):
+                if op & (0x10 << i):
+                    length |= ord(delta[pos]) << (8 * i)
+                    pos += 1
+            out.append(base[start:start + (length or 0x10000)])
+        elif op:                    # insert what follows
+            out.append(delta[pos:pos + op])
+            pos += op
+        else:
+            raise ValueError("invalid delta opcode")
+    result = "".join(out)
+    if len(result) != size:
+        raise ValueError("delta result size mismatch")
+    return result
+
+
+class ObjectCache:
+    """What ObjectReaders can share: up to 'size' bytes of the objects
+    they built lately, and the packs they have open, each opened once.
+    Safe to share between threads.
+    """
+
+    def __init__(self, size=CACHE_SIZE):
+        self.size = size
+        self.lock = threading.Lock()
+        self._objects = OrderedDict()   # (pack path, offset) -> found
+        self._cached = 0
+        self._packs = {}                # path -> [_Pack, readers]
+
+    def get(self, key):
+        self.lock.acquire()
+        try:
+            found = self._objects.pop(key, None)
+            if found is not None:
+                self._objects[key] = found
+            return found
+        finally:
+            self.lock.release()
+
+    def keep(self, key, found):
+        size = len(found[1])
+        if size > self.size // 4:
+            return
+        self.lock.acquire()
+        try:
+            old = self._objects.pop(key, None)
+            if old is not None:
+                self._cached -= len(old[1])
+            self._objects[key] = found
+            self._cached += size
+            while self._cached > self.size:
+                old, (type, data) = self._objects.popitem(last=False)
+                self._cached -= len(data)
+        finally:
+            self.lock.release()
+
+    def clear(self):
+        self.lock.acquire()
+        try:
+            self._objects.clear()
+            self._cached = 0
+        finally:
+            self.lock.release()
+
+    def open_pack(self, idx_path):
+        """The _Pack of 'idx_path', opened if no reader has it open.
+        Raises ValueError or EnvironmentError if it can't be read.
+        """
+        self.lock.acquire()
+        try:
+            entry = self._packs.get(idx_path)
+            if entry is None:
+                entry = self._packs[idx_path] = [_Pack(idx_path), 0]
+            entry[1] += 1
+            return entry[0]
+        finally:
+            self.lock.release()
+
+    def close_pack(self, pack):
+        """Note that a reader is done with 'pack'."""
+        self.lock.acquire()
+        try:
+            entry = self._packs.get(pack.path)
+            if entry is not None and entry[0] is pack:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._packs[pack.path]
+                    pack.close()
+        finally:
+            self.lock.release()
+
+
+def find_git_dir(path):
+    """The git directory of the repository 'path' is in (a bare one, or
+    a working tree or any directory in it), or None.
+    """
+    path = os.path.abspath(path)
+    while True:
+        if os.path.isfile(os.path.join(path, "HEAD")) and \
+               os.path.isdir(os.path.join(path, "objects")):
+            return path
+        found = git_dir(path)
+        if found is not None:
+            return found
+        parent = os.path.dirname(path)
+        if parent == path:
+            return None
+        path = parent
+
+
+class ObjectReader:
+    """The objects of the repository whose git directory is 'gitdir',
+    keeping what it builds in 'cache' (an ObjectCache; one of its own
+    if None).  'usable' is false if the repository keeps them in a way
+    we can't read exactly.
+    """
+
+    def __init__(self, gitdir, cache=None):
+        self.gitdir = gitdir
+        self._own_cache = cache is None
+        self.cache = cache or ObjectCache()
+        self._packs = []
+        self._seen = set()
+        common = common_dir(gitdir)
+        self.usable = common is not None and self._plain(common)
+        self.dirs = self.usable and _object_dirs(
+            os.path.join(common, "objects")) or []
+        self._scan()
+
+    def _plain(self, common):
+        config = parse_git_config(os.path.join(common, "config"))
+        if config.get("extensions.objectformat", "sha1").lower() != "sha1":
+            return False
+        return not list_refs(self.gitdir, "refs/replace/") and \
+            not os.path.exists(os.path.join(common, "info", "grafts"))
+
+    def close(self):
+        for pack in self._packs:
+            self.cache.close_pack(pack)
+        self._packs = []
+        self._seen.clear()
+        if self._own_cache:
+            self.cache.clear()
+
+    def _scan(self):
+        """Open the packs we haven't seen yet.  Returns whether any."""
+        new = False
+        for objects in self.dirs:
+            directory = os.path.join(objects, "pack")
+            try:
+                names = os.listdir(directory)
+            except OSError:
+                continue
+            for name in names:
+                path = os.path.join(directory, name)
+                if not name.endswith(".idx") or path in self._seen:
+                    continue
+                self._seen.add(path)
+                try:
+                    self._packs.append(self.cache.open_pack(path))
+                    new = True
+                except (ValueError, EnvironmentError, struct.error):
+                    pass
+        return new
+
+    def read(self, sha):
+        """(type, data) of the object with the (hex) 'sha', or None."""
+        return self._search(sha, self._unpack, self._read_loose)
+
+    def read_info(self, sha):
+        """(type, size) of the object with the (hex) 'sha', or None."""
+        return self._search(sha, self._unpack_info, self._loose_info)
+
+    def _search(self, sha, packed, loose):
+        if not self.usable:
+            return None
+        binsha = unhexlify(sha)
+        for attempt in range(2):
+            for pack in self._packs:
+                offset = pack.find(binsha)
+                if offset is not None:
+                    return packed(pack, offset)
+            found = loose(sha)
+            if found is not None or not self._scan():
+                return found
+        return None
+
+    def _open_loose(self, sha):
+        for objects in self.dirs:
+            path = os.path.join(objects, sha[:2], sha[2:])
+            try:
+                return open(path, "rb")
+            except IOError:
+                continue
+        return None
+
+    def _read_loose(self, sha):
+        f = self._open_loose(sha)
+        if f is None:
+            return None
+        try:
+            raw = zlib.decompress(f.read())
+        finally:
+            f.close()
+        header, _, data = raw.partition("\0")
+        type, _, size = header.partition(" ")
+        if type not in TYPES.values() or int(size) != len(data):
+            raise ValueError("corrupt loose object %s" % sha)
+        return type, data
+
+    def _loose_info(self, sha):
+        f = self._open_loose(sha)
+        if f is None:
+            return None
+        try:
+            # "<type> <size>\0" fits in the first few bytes inflated.
+            raw = zlib.decompressobj().decompress(f.read(4096), 64)
+        finally:
+            f.close()
+        header, nul, data = raw.partition("\0")
+        type, _, size = header.partition(" ")
+        if not nul or type not in TYPES.values() or not size.isdigit():
+            raise ValueError("corrupt loose object %s" % sha)
+        return type, int(size)
+
+    def _unpack(self, pack, offset):
+        # Follow the chain of deltas down to something we have whole,
+        # then build back up, keeping what we build.
+        chain = []
+        while True:
+            key = (pack.path, offset)
+            found = self.cache.get(key)
+            if found is not None:
+                break
+            type, size, pos, base = pack.header(offset)
+            if type in TYPES:
+                found = (TYPES[type], pack.inflate(pos, size))
+                self.cache.keep(key, found)
+                break
+            chain.append((key, pack.inflate(pos, size)))
+            if type == _OFS_DELTA:
+                offset = base
+            elif type == _REF_DELTA:
+                at = self._find_packed(base)
+                if at is not None:
+                    pack, offset = at
+                else:
+                    found = self._read_loose(hexlify(base))
+                    if found is None:
+                        return None
+                    break
+            else:
+                raise ValueError("unknown pack entry type %d" % type)
+        type, data = found
+        for key, delta in reversed(chain):
+            data = apply_delta(data, delta)
+            self.cache.keep(key, (type, data))
+        return type, data
+
+    def _unpack_info(self, pack, offset):
+        type, size, pos, base = pack.header(offset)
+        if type in TYPES:
+            return TYPES[type], size
+        # A delta begins with the sizes of its base and of its result.
+        delta = pack.inflate(pos, min(size, 20))
+        size = _varint(delta, _varint(delta, 0)[1])[0]
+        # Its type is that of the object at the bottom of the chain.
+        while type not in TYPES:
+            found = self.cache.get((pack.path, offset))
+            if found is not None:
+                return found[0], size
+            if type == _OFS_DELTA:
+                offset = base
+            elif type == _REF_DELTA:
+                at = self._find_packed(base)
+                if at is None:
+                    found = self._loose_info(hexlify(base))
+                    return found and (found[0], size)
+                pack, offset = at
+            else:
+                raise ValueError("unknown pack entry type %d" % type)
+            type, _, _, base = pack.header(offset)
+        return TYPES[type], size
+
+    def _find_packed(self, binsha):
+        """(pack, offset) of the object 'binsha' if packed, or None."""
+        for pack in self._packs:
+            offset = pack.find(binsha)
+            if offset is not None:
+                return pack, offset
+        return None
+
+    def resolve(self, name):
+        """The sha <name> stands for (a full sha, HEAD or a ref name as
+        git completes it), or None.
+        """
+        if _sha_re.match(name):
+            return name
+        if ".." in name or "@" in name or "~" in name or \
+               name.startswith("-") or name.endswith("/"):
+            return None
+        for rule in _DWIM:
+            ref = rule % name
+            if rule == "%s" and ref != "HEAD":
+                # Pseudo-refs (FETCH_HEAD...) and names git would only
+                # find through "refs/..." are left to git.
+                if not ref.startswith("refs/"):
+                    continue
+            sha = read_ref(self.gitdir, ref)
+            if sha is not None:
+                return sha
+        return None
+
+    def lookup(self, rev):
+        """(sha, type, data) for 'rev', or None: see the module's
+        docstring for the revisions understood.
+        """
+        return self._lookup(rev, True)
+
+    def info(self, rev):
+        """(sha, type, size) for 'rev', or None, like lookup() but
+        without reading the data of the object itself.
+        """
+        return self._lookup(rev, False)
+
+    def _lookup(self, rev, whole):
+        if not self.usable:
+            return None
+        m = _rev_re.match(rev)
+        if m is None:
+            return None
+        name, peel, want, colon, path = m.groups()
+        sha = self.resolve(name)
+        if sha is None:
+            return None
+        if colon:
+            want = "tree"
+        if peel or colon:
+            # Tags, commits and trees to get through: small, read whole.
+            found = self.read(sha)
+            found = found and self._peel(sha, found, want)
+            if found is None:
+                return None
+            sha, type, data = found
+            if colon and path:
+                if path.startswith("./") or path.startswith("../"):
+                    return None     # relative to the working directory
+                parts = path.rstrip("/").split("/")
+                for i, part in enumerate(parts):
+                    if type != "tree" or not part:
+                        return None
+                    entry = _tree_entry(data, part)
+                    if entry is None:
+                        return None
+                    mode, sha = entry
+                    if mode == "160000":
+                        return None # a submodule's commit
+                    if i < len(parts) - 1:
+                        found = self.read(sha)
+                        if found is None:
+                            return None
+                        type, data = found
+            elif whole:
+                return found
+            else:
+                return sha, type, len(data)
+        if whole:
+            found = self.read(sha)
+        else:
+            found = self.read_info(sha)
+        if found is None:
+            return None
+        return (sha,) + tuple(found)
+
+    def _peel(self, sha, found, want):
+        """Peel tags (and commits, for a tree) until the object is of
+        type 'want' (until it isn't a tag, if 'want' is "").  Returns
+        (sha, type, data) or None.
+        """
+        while found[0] != want:
+            if found[0] == "tag":
+                sha = _header_field(found[1], "object")
+            elif found[0] == "commit" and want == "tree":
+                sha = _header_field(found[1], "tree")
+            elif not want:
+                break
+            else:
+                return None
+            found = sha and self.read(sha)
+            if not found:
+                return None
+        return (sha,) + tuple(found)
+
+
+def _object_dirs(objects, depth=0):
+    """'objects' and the object directories it borrows from."""
+    found = [objects]
+    path = os.path.join(objects, "info", "alternates")
+    if depth < 5 and os.path.isfile(path):
+        f = open(path)
+        try:
+            lines = f.read().splitlines()
+        finally:
+            f.close()
+        for line in lines:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                found += _object_dirs(os.path.join(objects, line),
+                                      depth + 1)
+    return found
+
+
+def _header_field(data, field):
+    """The value of the first 'field' line in a commit or tag header."""
+    prefix = field + " "
+    pos = 0
+    while True:
+        end = data.find("\n", pos)
+        if end <= pos:              # the blank line ending the header
+            return None
+        if data.startswith(prefix, pos):
+            return data[pos + len(prefix):end]
+        pos = end + 1
+
+
+def _tree_entry(data, name):
+    """(mode, sha) of the entry 'name' in the raw tree 'data', or None."""
+    pos = 0
+    end = len(data)
+    while pos < end:
+        space = data.find(" ", pos)
+        nul = data.find("\0", space)
+        if data[space + 1:nul] == name:
+            return data[pos:space], hexlify(data[nul + 1:nul + 21])
+        pos = nul + 21
+    return None
@@ -0,0 +1,343 @@
+"""ryppl.query
+
+Git's answers as data rather than text.  Each query asks git for a
+machine format (NUL-separated, so paths never come back quoted) and
+picks the fields out of git's output by position as it streams in,
+without splitting it into lines and words first; only what goes into
+the result is ever copied.
+
+  status(git)               a Status: HEAD, branch, upstream, how far
+                            ahead and behind, and a StatusEntry per path
+  rev_list(git, revs)       commit shas, as "git rev-list" orders them
+  for_each_ref(git, pats)   Refs: name, sha, type and peeled sha
+  ls_tree(git, rev)         (mode, type, sha, path) tuples
+
+The parse_* functions do the parsing alone, for output obtained some
+other way (as through ryppl.asyncgit); records they don't recognize
+(a warning git printed among them, say) are skipped.  The queries
+raise RuntimeError, with git's message, when git fails.
+"""
+
+import re
+
+# How much of git's output to parse at a time.
+BLOCK_SIZE = 64 * 1024
+
+_sha_re = re.compile(r'^[0-9a-f]{40}([0-9a-f]{24})?$')
+
+
+class StatusEntry(object):
+    """One path "git status" reports: 'xy', the two letters of its index
+    and working tree states ("??" if untracked, "!!" if ignored), its
+    'path', the 'orig' path it was renamed or copied from (else None),
+    and for a submodule the four letters of its 'submodule' state
+    ("S<c><m><u>"; None if not known).
+    """
+
+    __slots__ = ('xy', 'path', 'orig', 'submodule')
+
+    def __init__(self, xy, path, orig=None, submodule=None):
+        self.xy = xy
+        self.path = path
+        self.orig = orig
+        self.submodule = submodule
+
+    def __repr__(self):
+        return "StatusEntry(%r, %r)" % (self.xy, self.path)
+
+
+class Status(object):
+    """A working tree's state: the 'commit' HEAD is at (None if there are
+    none yet), the 'branch' (None if detached), its 'upstream' and how
+    many commits it is 'ahead' of it and 'behind' (None if unknown), and
+    the StatusEntries of the paths with changes.
+    """
+
+    __slots__ = ('commit', 'branch', 'upstream', 'ahead', 'behind',
+                 'entries')
+
+    def __init__(self):
+        self.commit = self.branch = self.upstream = None
+        self.ahead = self.behind = None
+        self.entries = []
+
+    def clean(self):
+        """Whether nothing but ignored files differs from HEAD."""
+        for entry in self.entries:
+            if entry.xy != "!!":
+                return False
+        return True
+
+
+class Ref(object):
+    """A ref: its full 'name', the 'sha' and 'type' of the object it
+    names and, for an annotated tag, the sha of the object the tag
+    'peeled' to (else None).
+    """
+
+    __slots__ = ('name', 'sha', 'type', 'peeled')
+
+    def __init__(self, name, sha, type, peeled=None):
+        self.name = name
+        self.sha = sha
+        self.type = type
+        self.peeled = peeled
+
+    def target(self):
+        """The sha of what the ref ultimately points to."""
+        return self.peeled or self.sha
+
+    def __repr__(self):
+        return "Ref(%r, %r)" % (self.name, self.sha)
+
+
+def _scan_status_v2(data, status):
+    """Parse the complete records of "git status --porcelain=v2 -z
+    --branch" output in 'data' into 'status'.  Returns where the
+    incomplete rest begins.
+    """
+    find = data.find
+    entries = status.entries
+    pos = 0
+    end = find("\0")
+    while end >= 0:
+        kind = data[pos:pos + 1]
+        if kind == "1" or kind == "2":
+            # 1 XY sub mH mI mW hH hI [Xscore] path
+            hashes = pos + 31
+            path = find(" ", hashes, end)
+            path = find(" ", path + 1, end) + 1
+            if kind == "2" and path > 0:
+                path = find(" ", path, end) + 1
+                orig_end = find("\0", end + 1)
+                if orig_end < 0:
+                    return pos      # the original path isn't in yet
+                entries.append(StatusEntry(data[pos + 2:pos + 4],
+                                           data[path:end],
+                                           data[end + 1:orig_end],
+                                           data[pos + 5:pos + 9]))
+                end = orig_end
+            elif path > 0:
+                entries.append(StatusEntry(data[pos + 2:pos + 4],
+                                           data[path:end], None,
+                                           data[pos + 5:pos + 9]))
+        elif kind == "u":
+            # u XY sub m1 m2 m3 mW h1 h2 h3 path
+            path = pos + 38
+            for i in range(3):
+                path = find(" ", path, end) + 1
+            if path > 0:
+                entries.append(StatusEntry(data[pos + 2:pos + 4],
+                                           data[path:end], None,
+                                           data[pos + 5:pos + 9]))
+        elif kind == "?" or kind == "!":
+            entries.append(StatusEntry(kind + kind, data[pos + 2:end]))
+        elif kind == "#":
+            _branch_header(data[pos + 2:end], status)
+        pos = end + 1
+        end = find("\0", pos)
+    return pos
+
+
+def _branch_header(header, status):
+    key, _, value = header.partition(" ")
+    if key == "branch.oid":
+        status.commit = _sha_re.match(value) and value or None
+    elif key == "branch.head":
+        status.branch = value != "(detached)" and value or None
+    elif key == "branch.upstream":
+        status.upstream = value
+    elif key == "branch.ab":
+        ahead, behind = value.split()
+        status.ahead, status.behind = int(ahead), -int(behind)
+
+
+_v1_branch_re = re.compile(
+    r'^## (?:No commits yet on |Initial commit on )?(.+?)'
+    r'(?:\.\.\.(\S+))?(?: \[(.*)\])?$')
+_v1_count_re = re.compile(r'(ahead|behind) (\d+)')
+
+
+def _scan_status_v1(data, status):
+    """_scan_status_v2 for "git status --porcelain -z --branch", which
+    doesn't tell the commit.
+    """
+    find = data.find
+    entries = status.entries
+    pos = 0
+    end = find("\0")
+    while end >= 0:
+        if data.startswith("## ", pos):
+            m = _v1_branch_re.match(data[pos:end])
+            if m:
+                branch, status.upstream, counts = m.groups()
+                status.branch = branch != "HEAD (no branch)" and branch \
+                    or None
+                if status.upstream and counts != "gone":
+                    status.ahead = status.behind = 0
+                    for which, n in _v1_count_re.findall(counts or ""):
+                        setattr(status, which, int(n))
+        elif end - pos > 3 and data[pos + 2] == " ":
+            xy = data[pos:pos + 2]
+            if "R" in xy or "C" in xy:
+                orig_end = find("\0", end + 1)
+                if orig_end < 0:
+                    return pos
+                entries.append(StatusEntry(xy, data[pos + 3:end],
+                                           data[end + 1:orig_end]))
+                end = orig_end
+            else:
+                entries.append(StatusEntry(xy, data[pos + 3:end]))
+        pos = end + 1
+        end = find("\0", pos)
+    return pos
+
+
+def _scan_commits(data, shas):
+    find = data.find
+    pos = 0
+    end = find("\n")
+    while end >= 0:
+        shas.append(data[pos:end])
+        pos = end + 1
+        end = find("\n", pos)
+    return pos
+
+
+def _scan_parents(data, commits):
+    find = data.find
+    pos = 0
+    end = find("\n")
+    while end >= 0:
+        line = data[pos:end].split(" ")
+        commits.append((line[0], tuple(line[1:])))
+        pos = end + 1
+        end = find("\n", pos)
+    return pos
+
+
+# Fields are NUL-separated; for-each-ref ends each ref with a newline,
+# which no ref name can contain.
+_REF_FORMAT = "--format=%(refname)%00%(objectname)%00%(objecttype)" \
+              "%00%(*objectname)"
+
+
+def _scan_refs(data, refs):
+    find = data.find
+    pos = 0
+    end = find("\n")
+    while end >= 0:
+        fields = data[pos:end].split("\0")
+        if len(fields) == 4:
+            refs.append(Ref(fields[0], fields[1], fields[2],
+                            fields[3] or None))
+        pos = end + 1
+        end = find("\n", pos)
+    return pos
+
+
+def _scan_tree(data, entries):
+    find = data.find
+    pos = 0
+    end = find("\0")
+    while end >= 0:
+        # <mode> SP <type> SP <sha> TAB <path>, the mode six digits
+        tab = find("\t", pos, end)
+        space = find(" ", pos + 7, tab)
+        if tab > 0 and space > 0:
+            entries.append((data[pos:pos + 6], data[pos + 7:space],
+                            data[space + 1:tab], data[tab + 1:end]))
+        pos = end + 1
+        end = find("\0", pos)
+    return pos
+
+
+def _parse(scan, data, into):
+    scan(data, into)
+    return into
+
+
+def _run(git, args, scan, into, cwd=None):
+    """Run "git <args>", feeding its output to scan(data, into) a block
+    at a time.  Returns 'into'.
+    """
+    stream = git.stream(*args, cwd=cwd)
+    pending = ""
+    for chunk in stream.chunks(BLOCK_SIZE):
+        data = pending and pending + chunk or chunk
+        pending = data[scan(data, into):]
+    if stream.close() != 0:
+        raise RuntimeError("git %s failed: %s"
+                           % (args[0], stream.stderr.strip()))
+    return into
+
+
+def parse_status(output, v2=True):
+    """The Status in 'output' from "git status -z --branch" with
+    --porcelain=v2 (or, if not 'v2', --porcelain).
+    """
+    return _parse(v2 and _scan_status_v2 or _scan_status_v1, output,
+                  Status())
+
+
+def parse_ls_tree(output):
+    """The (mode, type, sha, path) tuples in the output of "git ls-tree
+    -z".
+    """
+    return _parse(_scan_tree, output, [])
+
+
+def status(git, cwd=None, untracked="normal", ignored=False):
+    """The Status of the working tree at 'cwd'.  'untracked' is "no",
+    "normal" (untracked directories listed as such) or "all" (every
+    file in them); 'ignored' files are listed if asked for.  Git too
+    old for porcelain v2 gets asked for HEAD separately.
+    """
+    v2 = git.supports("porcelain-v2")
+    args = ["status", "-z", "--branch",
+            v2 and "--porcelain=v2" or "--porcelain",
+            "--untracked-files=" + untracked]
+    if ignored:
+        args.append("--ignored")
+    found = _run(git, args, v2 and _scan_status_v2 or _scan_status_v1,
+                 Status(), cwd)
+    if not v2:
+        head = git.git("rev-parse", "--verify", "HEAD", cwd=cwd).strip()
+        found.commit = _sha_re.match(head) and head or None
+    return found
+
+
+def rev_list(git, revs, paths=(), parents=False, max_count=None,
+             cwd=None):
+    """The commits reachable from 'revs' (which may exclude some with
+    "^rev" or "a..b"), touching 'paths' if any are given, in rev-list's
+    order.  With 'parents', each is a (sha, (parent shas)) pair.
+    """
+    args = ["rev-list"]
+    if parents:
+        args.append("--parents")
+    if max_count is not None:
+        args.append("--max-count=%d" % max_count)
+    args += list(revs) + ["--"] + list(paths)
+    return _run(git, args, parents and _scan_parents or _scan_commits, [],
+                cwd)
+
+
+def for_each_ref(git, patterns=(), cwd=None):
+    """The Refs matching 'patterns' ("refs/tags", say; all if none),
+    sorted by name.
+    """
+    return _run(git, ["for-each-ref", _REF_FORMAT] + list(patterns),
+                _scan_refs, [], cwd)
+
+
+def ls_tree(git, rev, paths=(), recursive=False, cwd=None):
+    """The (mode, type, sha, path) of each entry of the tree of 'rev'
+    (limited to 'paths', if given), and with 'recursive' of the trees
+    below it instead of those trees themselves.
+    """
+    args = ["ls-tree", "-z", "--full-tree"]
+    if recursive:
+        args.append("-r")
+    args += [rev, "--"] + list(paths)
+    return _run(git, args, _scan_tree, [], cwd)
@@ -0,0 +1,223 @@
+"""ryppl.refs
+
+Reads refs straight from a clone's git directory, so that listing the
+tags of hundreds of clones (to resolve their versions, or to pick the
+next release) costs no git process at all.
+
+A ref is either a file of its own under refs/ ("loose") or a line of
+packed-refs; the loose one wins if both exist.  packed-refs is
+memory-mapped and, when git's header says it is sorted (as every git
+since 2.15 writes it), binary-searched, so that finding one ref or
+the refs under a prefix reads a few pages of it however many refs it
+holds.
+
+Ref storage this doesn't understand (reftable) is left to "git
+for-each-ref": list_refs() returns None for it and tag_names() asks git.
+"""
+
+import os
+import re
+import mmap
+
+PACKED_REFS = "packed-refs"
+
+_sha_re = re.compile(r'^[0-9a-f]{40}([0-9a-f]{24})?$')
+
+# A ref in packed-refs; the peeled line after an annotated tag, which
+# starts with "^", doesn't match.
+_record_re = re.compile(r'^([0-9a-f]+) (.+)$', re.M)
+
+
+def git_dir(project):
+    """The git directory of the clone at 'project', or None."""
+    path = os.path.join(project, ".git")
+    if os.path.isdir(path):
+        return path
+    if os.path.isfile(path):            # "gitdir: <path>", as submodules
+        f = open(path)
+        try:
+            line = f.readline().strip()
+        finally:
+            f.close()
+        if line.startswith("gitdir:"):
+            return os.path.join(project, line[len("gitdir:"):].strip())
+    return None
+
+
+def common_dir(gitdir):
+    """Where the refs of 'gitdir' live (the main repository's git
+    directory, for a linked worktree), or None if they aren't kept
+    as loose and packed refs.
+    """
+    path = os.path.join(gitdir, "commondir")
+    if os.path.isfile(path):
+        f = open(path)
+        try:
+            gitdir = os.path.join(gitdir, f.readline().strip())
+        finally:
+            f.close()
+    if os.path.isdir(os.path.join(gitdir, "reftable")):
+        return None
+    return gitdir
+
+
+def _read_line(path):
+    try:
+        f = open(path)
+    except IOError:
+        return None
+    try:
+        return f.readline().strip()
+    finally:
+        f.close()
+
+
+class PackedRefs:
+    """The packed-refs file at 'path', memory-mapped (empty if there is
+    none).  Call close() when done.
+    """
+
+    def __init__(self, path):
+        self.map = None
+        self.start = self.size = 0
+        self.sorted = False
+        try:
+            f = open(path, "rb")
+        except IOError:
+            return
+        try:
+            size = os.fstat(f.fileno()).st_size
+            if size:
+                self.map = mmap.mmap(f.fileno(), size,
+                                     access=mmap.ACCESS_READ)
+        finally:
+            f.close()
+        self.size = size
+        if self.map is not None and self.map[:1] == "#":
+            end = self.map.find("\n")
+            header = self.map[:end].split()
+            self.sorted = "sorted" in header
+            self.start = end + 1
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+
+    def _next(self, pos):
+        """Where the record after the one at 'pos' begins."""
+        m = self.map
+        pos = m.find("\n", pos) + 1
+        while pos and m[pos:pos + 1] == "^":     # its peeled line
+            pos = m.find("\n", pos) + 1
+        return pos or self.size
+
+    def _seek(self, name):
+        """Where the first record whose name isn't less than 'name'
+        begins (the start, if the file isn't sorted).
+        """
+        m = self.map
+        lo, hi = self.start, self.size
+        if not self.sorted:
+            return lo
+        while lo < hi:
+            # The record holding the middle byte (the tag, if that's
+            # on a peeled line).
+            mid = m.rfind("\n", lo, (lo + hi) // 2) + 1 or lo
+            while mid > lo and m[mid:mid + 1] == "^":
+                mid = m.rfind("\n", lo, mid - 1) + 1 or lo
+            end = m.find("\n", mid)
+            if end < 0:
+                end = self.size
+            if m[m.find(" ", mid, end) + 1:end] < name:
+                lo = self._next(mid)
+            else:
+                hi = mid
+        return lo
+
+    def refs(self, prefix=""):
+        """(name, sha) for each ref whose name starts with 'prefix', in
+        the file's order.
+        """
+        if self.map is None:
+            return []
+        start = self._seek(prefix)
+        end = self.size
+        if self.sorted and prefix and prefix[-1] != "\xff":
+            # Everything from the first name past all of ours on.
+            end = self._seek(prefix[:-1] + chr(ord(prefix[-1]) + 1))
+        found = _record_re.findall(self.map[start:end])
+        if self.sorted:
+            return [(name, sha) for sha, name in found]
+        return [(name, sha) for sha, name in found if name.startswith(prefix)]
+
+    def get(self, ref):
+        """The sha of 'ref', or None."""
+        for name, sha in self.refs(ref):
+            if name == ref:
+                return sha
+        return None
+
+
+def read_ref(gitdir, ref):
+    """The sha 'ref' (e.g. "refs/heads/master", or a symbolic ref such as
+    "HEAD") points to, from its loose file or packed-refs, or None.
+    """
+    common = common_dir(gitdir)
+    if common is None:
+        return None
+    for i in range(5):              # symbolic refs to symbolic refs
+        line = _read_line(os.path.join(ref == "HEAD" and gitdir or common,
+                                       ref))
+        if line is None:
+            packed = PackedRefs(os.path.join(common, PACKED_REFS))
+            try:
+                return packed.get(ref)
+            finally:
+                packed.close()
+        if not line.startswith("ref: "):
+            return _sha_re.match(line) and line or None
+        ref = line[5:].strip()
+    return None
+
+
+def list_refs(gitdir, prefix="refs/"):
+    """{name: sha} for the refs under 'prefix', a directory of refs
+    ("refs/tags/", say), or None if 'gitdir' keeps its refs in a way
+    we can't read.
+    """
+    common = common_dir(gitdir)
+    if common is None:
+        return None
+    packed = PackedRefs(os.path.join(common, PACKED_REFS))
+    try:
+        found = dict(packed.refs(prefix))
+    finally:
+        packed.close()
+    top = os.path.join(common, prefix)
+    for dirpath, dirnames, filenames in os.walk(top):
+        base = prefix + os.path.relpath(dirpath, top).replace(os.sep, "/")
+        base = base.endswith("/.") and base[:-1] or base + "/"
+        for filename in filenames:
+            if filename.endswith(".lock"):
+                continue
+            name = base + filename
+            sha = _read_line(os.path.join(dirpath, filename)) or ""
+            if sha.startswith("ref: "):
+                sha = read_ref(gitdir, name)
+            if sha and _sha_re.match(sha):
+                found[name] = sha
+    return found
+
+
+def tag_names(git, project):
+    """The names of the tags of the clone at 'project', sorted."""
+    gitdir = git_dir(project)
+    if gitdir is None:
+        return []
+    found = list_refs(gitdir, "refs/tags/")
+    if found is None:
+        from ryppl.query import for_each_ref
+        found = [ref.name for ref in for_each_ref(git, ["refs/tags/"],
+                                                  cwd=project)]
+    return sorted(name[len("refs/tags/"):] for name in found)
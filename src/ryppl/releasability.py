@@ -0,0 +1,374 @@
+"""ryppl.releasability
+
+Decides whether a project is releasable, given the outcomes of its
+tests on the test slaves and its .ryppl/releasability.xml, whose format
+follows Boost's explicit-failures markup with slaves (keys or aliases)
+in place of toolsets::
+
+  <explicit-failures-markup>
+    <mark-toolset name="linux" status="required"/>
+    <library name="libX">
+      <mark-unusable>
+        <toolset name="old-mac*"/>
+        <note>needs a newer compiler</note>
+      </mark-unusable>
+      <mark-expected-failures>
+        <test name="unicode_*"/>
+        <toolset name="win*"/>
+      </mark-expected-failures>
+      <test name="threads">
+        <mark-failure><toolset name="*"/></mark-failure>
+      </test>
+    </library>
+  </explicit-failures-markup>
+
+<slave> may be written for <toolset>; markup outside any <library>
+applies to the project itself, and names may contain * wildcards.  A
+project is releasable when every required slave reported on it and
+each failure is either expected or on a slave it's unusable on.
+
+Outcomes are kept in a ResultMatrix, one cell per (project, test,
+slave), stored by column: which cells belong to each project, test and
+slave, and which passed, are each a bit set held in one Python long.
+The markup compiles to a handful of ANDs and ORs over those, so that
+judging thousands of tests on hundreds of slaves takes milliseconds.
+"""
+
+import os
+import re
+import time
+import fnmatch
+from binascii import hexlify
+
+from ryppl.resolver import read_ryppl
+from ryppl.scheduler import expand
+from ryppl.util import user_dir
+
+MARKUP_FILE = "releasability.xml"
+RESULTS_FILE = "test-matrix"
+
+_SLAVE_TAGS = ("toolset", "slave")
+
+
+def _bits(indices, size):
+    """A long with the bits at 'indices' set."""
+    bits = bytearray((size + 7) // 8)
+    for i in indices:
+        bits[i >> 3] |= 1 << (i & 7)
+    bits.reverse()
+    return bits and long(hexlify(str(bits)), 16) or 0L
+
+
+_nonzero_re = re.compile(r'[^0]')
+
+def _indices(mask):
+    """The positions of the set bits in 'mask', lowest first."""
+    digits = "%x" % mask
+    top = len(digits) - 1
+    found = []
+    for m in _nonzero_re.finditer(digits):
+        value, base = int(m.group(), 16), (top - m.start()) * 4
+        found.extend(base + j for j in range(4) if value >> j & 1)
+    found.sort()
+    return found
+
+
+class _Column:
+    """The distinct values of one column and the cells having each."""
+
+    def __init__(self):
+        self.names = []
+        self.index = {}
+        self.cells = []             # per name: list of cell numbers
+        self.masks = None           # per name: bit set of those cells
+
+    def add(self, name, cell):
+        i = self.index.get(name)
+        if i is None:
+            i = self.index[name] = len(self.names)
+            self.names.append(name)
+            self.cells.append([])
+        self.cells[i].append(cell)
+        return i
+
+    def freeze(self, size):
+        self.masks = [_bits(cells, size) for cells in self.cells]
+
+    def matching(self, match):
+        """The cells whose value satisfies match(name), as a bit set."""
+        mask = 0L
+        for name, bits in zip(self.names, self.masks):
+            if match(name):
+                mask |= bits
+        return mask
+
+
+class ResultMatrix:
+    """Test outcomes by project, test and slave.  add() them all, then
+    call freeze() before asking anything.
+    """
+
+    def __init__(self):
+        self.projects = _Column()
+        self.tests = _Column()
+        self.slaves = _Column()
+        self._cells = {}            # (project, test, slave) -> cell
+        self._keys = []             # per cell: (project, test, slave)
+        self._passed = []           # per cell
+        self.passed = 0L
+
+    def __len__(self):
+        return len(self._passed)
+
+    def add(self, project, test, slave, passed):
+        """Record an outcome; a later one for the same cell wins."""
+        key = (project, test, slave)
+        cell = self._cells.get(key)
+        if cell is None:
+            cell = self._cells[key] = len(self._passed)
+            self._keys.append(key)
+            self._passed.append(passed)
+            self.projects.add(project, cell)
+            self.tests.add(test, cell)
+            self.slaves.add(slave, cell)
+        else:
+            self._passed[cell] = passed
+        return cell
+
+    def freeze(self):
+        size = len(self._passed)
+        for column in (self.projects, self.tests, self.slaves):
+            column.freeze(size)
+        self.passed = _bits([cell for cell in range(size)
+                             if self._passed[cell]], size)
+
+    def cell(self, n):
+        """(project, test, slave) of cell 'n'."""
+        return self._keys[n]
+
+
+class _Mark:
+    """One markup entry: cells of 'tests' on 'slaves' (lists of name
+    patterns, empty meaning all), with an explanatory 'note'."""
+
+    def __init__(self, tests=(), slaves=(), note=""):
+        self.tests = list(tests)
+        self.slaves = list(slaves)
+        self.note = note
+
+
+class _Library:
+    def __init__(self, pattern):
+        self.pattern = pattern
+        self.unusable = []
+        self.expected = []
+
+
+class Markup:
+    """A parsed releasability.xml: 'required' slave patterns and, per
+    library pattern, the _Marks of unusable slaves and expected
+    failures.  "*" stands for the project itself.
+    """
+
+    def __init__(self):
+        self.required = []
+        self.libraries = []
+
+    def library(self, pattern):
+        for library in self.libraries:
+            if library.pattern == pattern:
+                return library
+        library = _Library(pattern)
+        self.libraries.append(library)
+        return library
+
+
+def parse_markup(source):
+    """A Markup from 'source', a file name or file object, read
+    incrementally so large markup files never exist as a tree.
+    """
+    from xml.etree.cElementTree import iterparse
+    markup = Markup()
+    library = test = mark = None
+    for event, element in iterparse(source, ("start", "end")):
+        tag = element.tag
+        if event == "start":
+            if tag == "library":
+                library = markup.library(element.get("name", "*"))
+            elif tag == "test" and mark is None:
+                test = element.get("name")
+            elif tag in ("mark-unusable", "mark-expected-failures",
+                         "mark-failure"):
+                mark = _Mark()
+                if tag == "mark-failure" and test is not None:
+                    mark.tests.append(test)
+            continue
+        # "end": the element and its text are complete.
+        if tag in _SLAVE_TAGS:
+            if mark is not None:
+                mark.slaves.append(element.get("name", "*"))
+        elif tag == "mark-toolset" or tag == "mark-slave":
+            if element.get("status") == "required":
+                markup.required.append(element.get("name"))
+        elif tag == "test":
+            if mark is not None:
+                mark.tests.append(element.get("name", "*"))
+            else:
+                test = None
+        elif tag == "note" and mark is not None:
+            mark.note = " ".join((element.text or "").split())
+        elif tag in ("mark-unusable", "mark-expected-failures",
+                     "mark-failure"):
+            target = library or markup.library("*")
+            if tag == "mark-unusable":
+                target.unusable.append(mark)
+            else:
+                target.expected.append(mark)
+            mark = None
+        elif tag == "library":
+            library = None
+        element.clear()
+    return markup
+
+
+def read_markup(project_dir):
+    """The Markup of the project checked out in 'project_dir' (empty if
+    it has no releasability.xml).
+    """
+    from cStringIO import StringIO
+    text = read_ryppl(project_dir, MARKUP_FILE)
+    if not text.strip():
+        return Markup()
+    return parse_markup(StringIO(text))
+
+
+class Verdict:
+    """Whether 'project' is releasable, and why not: the unexpected
+    'failures' as (test, slave) pairs, and the required slave patterns
+    'missing' results.  'expected' and 'unusable' count the failures
+    the markup excused.
+    """
+
+    def __init__(self, project):
+        self.project = project
+        self.cells = 0
+        self.failures = []
+        self.missing = []
+        self.expected = 0
+        self.unusable = 0
+
+    def releasable(self):
+        return self.cells > 0 and not self.failures and not self.missing
+
+
+def _matcher(patterns, aliases):
+    """A function telling whether a name matches any of 'patterns' (a
+    slave alias matches the slaves it stands for); None for "all".
+    """
+    if not patterns or "*" in patterns:
+        return None
+    names = set()
+    regexps = []
+    for pattern in patterns:
+        if aliases and pattern in aliases:
+            names.update(expand([pattern], aliases))
+        elif "*" in pattern or "?" in pattern or "[" in pattern:
+            regexps.append(fnmatch.translate(pattern))
+        else:
+            names.add(pattern)
+    regexp = regexps and re.compile("|".join(regexps))
+    return lambda name: name in names or bool(regexp and regexp.match(name))
+
+
+def _select(column, patterns, aliases, universe):
+    match = _matcher(patterns, aliases)
+    if match is None:
+        return universe
+    return universe & column.matching(match)
+
+
+def evaluate(matrix, project, markup, aliases=None):
+    """Judge 'project' on the outcomes in 'matrix' (frozen) against
+    'markup'; 'aliases' are the slave aliases the markup may use.
+    Returns a Verdict.
+    """
+    verdict = Verdict(project)
+    i = matrix.projects.index.get(project)
+    cells = i is not None and matrix.projects.masks[i] or 0L
+    verdict.cells = bin(cells).count("1")
+    excused = unusable = 0L
+    for library in markup.libraries:
+        if not fnmatch.fnmatchcase(project, library.pattern):
+            continue
+        for mark in library.unusable:
+            unusable |= _select(matrix.slaves, mark.slaves, aliases, cells)
+        for mark in library.expected:
+            excused |= _select(matrix.tests, mark.tests, aliases,
+                               _select(matrix.slaves, mark.slaves, aliases,
+                                       cells))
+    failing = cells & ~matrix.passed
+    verdict.unusable = bin(failing & unusable).count("1")
+    verdict.expected = bin(failing & excused & ~unusable).count("1")
+    for cell in _indices(failing & ~excused & ~unusable):
+        project_name, test, slave = matrix.cell(cell)
+        verdict.failures.append((test, slave))
+    for pattern in markup.required:
+        if not _select(matrix.slaves, [pattern], aliases, cells):
+            verdict.missing.append(pattern)
+    return verdict
+
+
+class ResultLog:
+    """The outcomes recorded so far, one line each in 'path'
+    (~/.ryppl/test-matrix by default)::
+
+      <time> <project> <test> <slave> pass|fail
+    """
+
+    def __init__(self, path=None):
+        self.path = path or user_dir(RESULTS_FILE)
+
+    def record(self, project, test, slave, passed):
+        f = open(self.path, "a")
+        try:
+            f.write("%d %s %s %s %s\n" % (time.time(), project, test, slave,
+                                          passed and "pass" or "fail"))
+        finally:
+            f.close()
+
+    def load(self, matrix=None):
+        """A frozen ResultMatrix of the outcomes (filling 'matrix', if
+        given), the latest outcome of each cell winning.
+        """
+        if matrix is None:
+            matrix = ResultMatrix()
+        if os.path.isfile(self.path):
+            f = open(self.path)
+            try:
+                for line in f:
+                    fields = line.split()
+                    if len(fields) == 5:
+                        matrix.add(fields[1], fields[2], fields[3],
+                                   fields[4] == "pass")
+            finally:
+                f.close()
+        matrix.freeze()
+        return matrix
+
+
+def describe(markup):
+    """Lines summarizing 'markup', for "ryppl show release-criteria"."""
+    def names(patterns):
+        return patterns and ", ".join(patterns) or "all"
+    lines = ["required slaves: %s" % (", ".join(markup.required) or "none")]
+    for library in markup.libraries:
+        prefix = library.pattern != "*" and "%s: " % library.pattern or ""
+        for mark in library.unusable:
+            lines.append("%sunusable on %s%s" % (
+                prefix, names(mark.slaves), mark.note and " (%s)" % mark.note
+                or ""))
+        for mark in library.expected:
+            lines.append("%s%s expected to fail on %s%s" % (
+                prefix, names(mark.tests), names(mark.slaves),
+                mark.note and " (%s)" % mark.note or ""))
+    return lines
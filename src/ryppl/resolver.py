@@ -0,0 +1,573 @@
+"""ryppl.resolver
+
+Finds the newest mutually compatible set of package versions, given
+the dependencies declared in each project's .ryppl file (see
+doc/dependency-management.rst)::
+
+  depends libX:1.0-2.2,3.1
+  depends libC
+
+A constraint is a comma-separated list of versions ("3.1") and
+inclusive ranges ("1.0-2.2"; either end may be left open, as in
+"2.0-"); a bare name accepts any version.
+
+The available versions of each package are kept sorted, so every
+constraint turns into a few index ranges found by bisection.  The
+search tries the newest versions first, checks each choice against
+the dependencies it brings in, and on failure jumps straight back to
+the most recent choice actually involved in the conflict, remembering
+the conflicting combination so it is never tried again.
+"""
+
+import os
+from bisect import bisect_left, bisect_right
+
+from ryppl.refs import tag_names
+from ryppl.util import read_git_config
+from ryppl.version import Version, parse_many, version_key
+
+DEPENDS_FILE = ".ryppl"
+
+
+class ResolutionError(Exception):
+    """No set of versions satisfies all of the dependencies."""
+
+
+class Constraint(tuple):
+    """A tuple of inclusive (low, high) version key intervals, None
+    standing for an open end, which remembers the text it came from.
+    """
+
+    def __new__(cls, intervals, text):
+        self = tuple.__new__(cls, intervals)
+        self.text = text
+        return self
+
+    def __str__(self):
+        return self.text
+
+
+def parse_constraint(text):
+    """Parse a constraint such as "1.0-2.2,3.1" into a Constraint.  An
+    empty 'text' gives None, meaning any version.
+    """
+    if not text:
+        return None
+    intervals = []
+    for part in text.split(','):
+        part = part.strip()
+        if '-' in part:
+            low, high = [v.strip() for v in part.split('-', 1)]
+            intervals.append((low and version_key(low) or None,
+                              high and version_key(high) or None))
+        else:
+            key = version_key(part)
+            intervals.append((key, key))
+    return Constraint(intervals, text)
+
+
+def allows(constraint, version):
+    """Whether 'constraint' (None meaning any version) admits the
+    version string 'version'.
+    """
+    if constraint is None:
+        return True
+    key = version_key(version)
+    for low, high in constraint:
+        if (low is None or low <= key) and (high is None or key <= high):
+            return True
+    return False
+
+
+def parse_requirements(words):
+    """Parse words of the form "name" or "name:constraint" into a list
+    of (name, constraint) pairs.
+    """
+    requirements = []
+    for word in words:
+        name, sep, constraint = word.partition(':')
+        requirements.append((name, parse_constraint(constraint)))
+    return requirements
+
+
+def parse_depends(text):
+    """Return the (name, constraint) pairs of the "depends" lines in
+    the contents of a .ryppl file.
+    """
+    requirements = []
+    for line in text.splitlines():
+        words = line.split('#', 1)[0].split()
+        if words[:1] == ['depends']:
+            requirements.extend(parse_requirements(words[1:]))
+    return requirements
+
+
+def read_ryppl(project_dir, part="depends"):
+    """Return the text of the .ryppl file of the project checked out in
+    'project_dir', or "" if it has none.  The .ryppl file may also be a
+    directory, in which case 'part' names the file inside it to read.
+    """
+    path = os.path.join(project_dir, DEPENDS_FILE)
+    if os.path.isdir(path):
+        path = os.path.join(path, part)
+    if not os.path.isfile(path):
+        return ""
+    f = open(path)
+    try:
+        return f.read()
+    finally:
+        f.close()
+
+
+def read_depends(project_dir):
+    """Return the dependencies declared by the project checked out in
+    'project_dir' (see read_ryppl).
+    """
+    return parse_depends(read_ryppl(project_dir, "depends"))
+
+
+class PackageIndex:
+    """The versions available for each package and the dependencies of
+    each of those versions.
+
+    Packages are filled in with add(); subclasses may instead override
+    load() and load_dependencies() to fetch them on demand.
+    """
+
+    def __init__(self):
+        self._versions = {}         # name -> version strings, ascending
+        self._keys = {}             # name -> version keys, ascending
+        self._depends = {}          # (name, index) -> [(dep, constraint)]
+        self._ranges = {}           # (name, constraint) -> index ranges
+
+    def add(self, name, versions):
+        """Make 'versions', a dict mapping each version string to its
+        list of (name, constraint) dependencies, available for 'name'.
+        Strings that aren't valid versions are ignored.
+        """
+        entries = []
+        for version, depends in versions.items():
+            try:
+                entries.append((Version(version).key, version, depends))
+            except ValueError:
+                pass
+        entries.sort()
+        self._keys[name] = [e[0] for e in entries]
+        self._versions[name] = [e[1] for e in entries]
+        for i, e in enumerate(entries):
+            if e[2] is not None:
+                self._depends[(name, i)] = e[2]
+
+    def load(self, name):
+        """Called for a package not yet in the index."""
+        self.add(name, {})
+
+    def load_dependencies(self, name, version):
+        """Called for a version whose dependencies aren't known yet."""
+        return []
+
+    def versions(self, name):
+        if name not in self._versions:
+            self.load(name)
+        return self._versions[name]
+
+    def dependencies(self, name, i):
+        """The (name, constraint) list of the i-th oldest version."""
+        key = (name, i)
+        depends = self._depends.get(key)
+        if depends is None:
+            depends = self._depends[key] = \
+                self.load_dependencies(name, self.versions(name)[i])
+        return depends
+
+    def ranges(self, name, constraint):
+        """The index ranges [start, end) of the versions of 'name' that
+        satisfy 'constraint'.
+        """
+        memo = (name, constraint)
+        ranges = self._ranges.get(memo)
+        if ranges is None:
+            self.versions(name)
+            keys = self._keys[name]
+            if constraint is None:
+                ranges = [(0, len(keys))]
+            else:
+                ranges = []
+                for low, high in constraint:
+                    start, end = 0, len(keys)
+                    if low is not None:
+                        start = bisect_left(keys, low)
+                    if high is not None:
+                        end = bisect_right(keys, high)
+                    if start < end:
+                        ranges.append((start, end))
+                ranges = _union(ranges)
+            self._ranges[memo] = ranges
+        return ranges
+
+    def allows(self, name, constraint, i):
+        for start, end in self.ranges(name, constraint):
+            if start <= i < end:
+                return True
+        return False
+
+    def candidates(self, name, constraints):
+        """Indices of the versions of 'name' satisfying every one of
+        'constraints', newest first.
+        """
+        ranges = [(0, len(self.versions(name)))]
+        for constraint in constraints:
+            if constraint is not None:
+                ranges = _intersect(ranges, self.ranges(name, constraint))
+                if not ranges:
+                    return []
+        found = []
+        for start, end in reversed(ranges):
+            found.extend(range(end - 1, start - 1, -1))
+        return found
+
+
+class GitPackageIndex(PackageIndex):
+    """A PackageIndex reading the clones in a ryppl workspace: each
+    package lives in the directory of the same name, its versions are
+    its tags, and each version's dependencies come from the .ryppl file
+    in the tagged tree.
+
+    Given a TagCache (see ryppl.tagcache), the tags are those of each
+    clone's origin remote and both they and the dependencies are
+    looked up in the cache first.  Packages not cloned yet are found
+    at the URLs in 'sources' ({name: URL}); their dependencies are read
+    from 'store' (a ryppl.workspace.ObjectStore), fetching into it as
+    needed.
+    """
+
+    def __init__(self, git, workspace=os.curdir, cache=None, sources={},
+                 store=None):
+        PackageIndex.__init__(self)
+        self.git = git
+        self.workspace = workspace
+        self.cache = cache
+        self.sources = sources
+        self.store = store
+        self._shas = {}             # name -> {tag: commit sha}
+
+    def load(self, name):
+        path = os.path.join(self.workspace, name)
+        url = read_git_config(path).get("remote.origin.url") \
+            or self.sources.get(name)
+        versions = {}
+        if self.cache is not None and url:
+            tags = self._shas[name] = self.cache.tags(self.git, url)
+            for version in parse_many(list(tags)):
+                versions[version.string] = None
+        elif os.path.isdir(os.path.join(path, ".git")):
+            for version in parse_many(tag_names(self.git, path)):
+                versions[version.string] = None
+        self.add(name, versions)
+
+    def load_dependencies(self, name, version):
+        sha = self._shas.get(name, {}).get(version)
+        if sha is None:
+            text = self._read_depends(name, version)
+        else:
+            text = self.cache.depends(sha)
+            if text is None:
+                text = self._read_depends(name, sha, version)
+                if text is not None:
+                    self.cache.store_depends(sha, text)
+        return parse_depends(text or "")
+
+    def _read_depends(self, name, commit, tag=None):
+        """The .ryppl dependency text at 'commit' of package 'name', ""
+        if it has none, or None if the commit isn't in its clone.  A
+        clone lacking the commit of 'tag' fetches it first (just that
+        commit, if the clone is shallow).
+        """
+        path = os.path.join(self.workspace, name)
+        if not os.path.isdir(os.path.join(path, ".git")):
+            if self.store is None or name not in self.sources:
+                return None
+            self.store.fetch(self.sources[name])
+            path = self.store.path
+        elif tag is not None and not self._has_commit(path, commit):
+            if os.path.exists(os.path.join(path, ".git", "shallow")):
+                self.git.git("fetch", "--quiet", "--depth", "1", "origin",
+                             "tag", tag, cwd=path)
+            else:
+                self.git.git("fetch", "--quiet", "--tags", "origin",
+                             cwd=path)
+        if not self._has_commit(path, commit):
+            return None
+        rev = "%s:%s" % (commit, DEPENDS_FILE)
+        type = self.git.git("cat-file", "-t", rev, cwd=path).strip()
+        if type == "tree":
+            rev += "/depends"
+            type = self.git.git("cat-file", "-t", rev, cwd=path).strip()
+        if type != "blob":
+            return ""
+        return self.git.git("cat-file", "blob", rev, cwd=path)
+
+
+    def _has_commit(self, path, commit):
+        return self.git.git("cat-file", "-t", commit,
+                            cwd=path).strip() in ("commit", "tag")
+
+
+def _union(ranges):
+    ranges.sort()
+    merged = []
+    for start, end in ranges:
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(end, merged[-1][1]))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def _intersect(a, b):
+    result = []
+    i = j = 0
+    while i < len(a) and j < len(b):
+        start = max(a[i][0], b[j][0])
+        end = min(a[i][1], b[j][1])
+        if start < end:
+            result.append((start, end))
+        if a[i][1] < b[j][1]:
+            i += 1
+        else:
+            j += 1
+    return result
+
+
+class _Choice:
+    """The resolver's bookkeeping for one package it has picked."""
+
+    def __init__(self, name, candidates, agenda):
+        self.name = name
+        self.candidates = candidates
+        self.next = 0
+        self.agenda = agenda        # what was left to decide before us
+        self.depends = []
+        self.conflict = set()       # choices our failed candidates clash with
+        self.failures = []          # why candidates were rejected, for users
+        self.blame = {}             # name -> constraints it didn't satisfy
+        self.tainted = set()        # names involved in any other failure
+        self.limits = []            # learned (constraints, because-of) pairs
+
+
+class Resolver:
+    """Picks one version of each package reachable from a list of
+    requirements such that every dependency is satisfied, preferring
+    newer versions of packages decided earlier.
+    """
+
+    def __init__(self, index):
+        self.index = index
+
+    def resolve(self, requirements):
+        """Return a dict mapping package names to version strings for
+        the (name, constraint) pairs in 'requirements' and everything
+        they depend on.  Raises ResolutionError if that is impossible.
+        """
+        index = self.index
+        self.assigned = {}          # name -> version index
+        self.level = {}             # name -> position in self.stack
+        self.constraints = {}       # name -> [(constraint, source)]
+        self.nogoods = {}           # (name, index) -> [frozenset]
+        self.stack = []
+
+        agenda = None
+        for name, constraint in reversed(requirements):
+            self.constraints.setdefault(name, []).append((constraint, None))
+            agenda = (name, agenda)
+
+        while True:
+            while agenda is not None and agenda[0] in self.assigned:
+                agenda = agenda[1]
+            if agenda is None:
+                break
+            name, agenda = agenda
+            choice = _Choice(name, index.candidates(
+                name, [c for c, s in self.constraints[name]]), agenda)
+            self.stack.append(choice)
+            agenda = self._choose(choice)
+
+        return dict((name, index.versions(name)[i])
+                    for name, i in self.assigned.items())
+
+    def _choose(self, choice):
+        """Assign the next workable candidate of 'choice', backjumping
+        as long as there is none.  Returns the new agenda.
+        """
+        while True:
+            while choice.next < len(choice.candidates):
+                i = choice.candidates[choice.next]
+                choice.next += 1
+                reason = self._check(choice, i)
+                if reason is None:
+                    return self._assign(choice, i)
+                choice.conflict.update(reason)
+            choice = self._backjump(choice)
+
+    def _check(self, choice, i):
+        """Return None if version 'i' of the package of 'choice' fits the
+        current assignment, or the set of packages it conflicts with.
+        """
+        name = choice.name
+        index = self.index
+        for constraints, because in choice.limits:
+            if not [c for c in constraints if index.allows(name, c, i)]:
+                choice.tainted.update(because)
+                return because
+        for nogood in self.nogoods.get((name, i), ()):
+            others = [(n, v) for n, v in nogood if n != name]
+            if all(self.assigned.get(n) == v for n, v in others):
+                reason = set(n for n, v in others)
+                choice.tainted.update(reason)
+                return reason
+        for dep, constraint in index.dependencies(name, i):
+            if dep == name or constraint is None:
+                continue
+            if dep in self.assigned:
+                if not index.allows(dep, constraint, self.assigned[dep]):
+                    choice.failures.append(
+                        "%s %s needs %s %s, but %s %s was chosen"
+                        % (name, index.versions(name)[i], dep, constraint,
+                           dep, index.versions(dep)[self.assigned[dep]]))
+                    choice.blame.setdefault(dep, []).append(constraint)
+                    return set([dep])
+            else:
+                existing = self.constraints.get(dep, [])
+                if not index.candidates(
+                        dep, [constraint] + [c for c, s in existing]):
+                    choice.failures.append(
+                        "%s %s needs %s %s, which %s"
+                        % (name, index.versions(name)[i], dep, constraint,
+                           self._describe(dep, existing)))
+                    reason = self._excluders(
+                        dep, index.candidates(dep, [constraint]), existing)
+                    choice.tainted.update(reason)
+                    return reason
+        return None
+
+    def _excluders(self, name, versions, constraints):
+        """Return a small set of the packages behind 'constraints' (a
+        list of (constraint, source) pairs on 'name') that between them
+        rule out every one of 'versions'.  Keeping conflict sets small
+        is what makes backjumps long and learned conflicts reusable.
+        """
+        index = self.index
+        # Unconditional requirements cost nothing; otherwise prefer the
+        # earliest choices, so that we jump back as far as possible.
+        ordered = [(source is not None and self.level[source] + 1 or 0,
+                    c, source)
+                   for c, source in constraints if c is not None]
+        ordered.sort()
+        chosen = []
+        sources = set()
+        for i in versions:
+            if [c for c in chosen if not index.allows(name, c, i)]:
+                continue
+            for n, c, source in ordered:
+                if not index.allows(name, c, i):
+                    chosen.append(c)
+                    if source is not None:
+                        sources.add(source)
+                    break
+        return sources
+
+    def _requirer(self, name):
+        """The earliest choice that needs 'name', or None if it was
+        asked for directly.
+        """
+        sources = [s for c, s in self.constraints[name]]
+        if None in sources:
+            return None
+        return min(sources, key=self.level.get)
+
+    def _assign(self, choice, i):
+        name = choice.name
+        self.assigned[name] = i
+        self.level[name] = len(self.stack) - 1
+        agenda = choice.agenda
+        depends = self.index.dependencies(name, i)
+        choice.depends = [dep for dep, c in depends if dep != name]
+        for dep, constraint in depends:
+            if dep != name:
+                self.constraints.setdefault(dep, []).append((constraint, name))
+        for dep in reversed(choice.depends):
+            if dep not in self.assigned:
+                agenda = (dep, agenda)
+        return agenda
+
+    def _unassign(self, choice):
+        if choice.name in self.assigned:
+            del self.assigned[choice.name]
+            del self.level[choice.name]
+            for dep in choice.depends:
+                self.constraints[dep].pop()
+            choice.depends = []
+
+    def _backjump(self, choice):
+        """'choice' has run out of candidates: learn why, and return the
+        most recent earlier choice that can do something about it.
+        """
+        name = choice.name
+        tried = set(choice.candidates)
+        excluders = self._excluders(
+            name, [i for i in range(len(self.index.versions(name)))
+                   if i not in tried],
+            self.constraints[name])
+        requirer = self._requirer(name)
+        conflict = choice.conflict | excluders
+        if requirer is not None:
+            conflict.add(requirer)
+        conflict.discard(name)
+        if not conflict:
+            raise ResolutionError(self._explain(choice))
+
+        nogood = frozenset((n, self.assigned[n]) for n in conflict)
+        for member in nogood:
+            self.nogoods.setdefault(member, []).append(nogood)
+
+        target = max(self.level[n] for n in conflict)
+        while len(self.stack) > target + 1:
+            self._unassign(self.stack.pop())
+        previous = self.stack[target]
+        self._unassign(previous)
+        culprit = previous.name
+        rest = conflict - set([culprit])
+
+        # If the only way the culprit's version mattered was that some of
+        # our candidates needed a different one, then as long as 'rest'
+        # stands, only versions one of those candidates accepts can work.
+        if culprit in choice.blame and culprit not in choice.tainted \
+               and culprit not in excluders and culprit != requirer:
+            previous.limits.append((choice.blame[culprit], rest))
+        previous.conflict.update(rest)
+        previous.tainted.update(rest)
+        return previous
+
+    def _describe(self, name, constraints):
+        versions = self.index.versions(name)
+        if not versions:
+            return "has no versions available"
+        wanted = ["%s (required by %s)" % (c, source or "you")
+                  for c, source in constraints if c is not None]
+        if not wanted:
+            return "has versions %s" % ', '.join(versions)
+        return "has versions %s and must also match %s" \
+               % (', '.join(versions), ' and '.join(wanted))
+
+    def _explain(self, choice):
+        name = choice.name
+        if choice.failures:
+            return "cannot use any version of %s: %s" \
+                   % (name, '; '.join(choice.failures))
+        return "no usable version of %s: it %s" \
+               % (name, self._describe(name, self.constraints[name]))
+
+
+def resolve(requirements, index):
+    """Convenience wrapper: Resolver(index).resolve(requirements)."""
+    return Resolver(index).resolve(requirements)
@@ -0,0 +1,341 @@
+"""ryppl.scheduler
+
+Spreads a remote test run over a pool of test slaves.
+
+Slaves are named by key or by alias (see "Test Slave Aliases" in
+doc/workflows.rst); aliases come from ~/.ryppl/slave-aliases and the
+project's .ryppl/slave-aliases and may name other aliases::
+
+  troymac:  19fa345c9732d5
+  mac:      troymac, 9a1f3c7923dc
+  default:  mac
+
+A run is a list of Shards, each with an expected cost (seconds on a
+slave of speed 1, from earlier runs).  Every slave has a throughput
+(cost per second, from earlier runs) and a backlog (seconds of work it
+already has queued, as it reports).  Shards are dealt out largest
+first, each to the slave that would finish it earliest; while the run
+goes on, a slave that runs out of work takes the last unstarted shard
+of whichever slave has the most left to do.  A slave that fails is
+dropped and its shards go to the others.
+"""
+
+import os
+import time
+import threading
+
+from ryppl.resolver import read_ryppl
+from ryppl.util import user_dir, load_cache, save_cache
+
+ALIASES_FILE = "slave-aliases"
+HISTORY_FILE = "slave-history"
+
+_FORMAT = 1
+
+# How much one observation moves a slave's throughput estimate.
+_SMOOTHING = 0.3
+
+# The cost of a shard never run before.
+DEFAULT_COST = 60.0
+
+
+def parse_aliases(text):
+    """Return {alias: [slave keys or aliases]} from the text of a
+    slave-aliases file.
+    """
+    aliases = {}
+    for line in text.splitlines():
+        line = line.split('#', 1)[0]
+        if ':' not in line:
+            continue
+        name, members = line.split(':', 1)
+        aliases[name.strip()] = [m.strip() for m in members.split(',')
+                                 if m.strip()]
+    return aliases
+
+
+def read_aliases(project_dir=os.curdir):
+    """The aliases defined in the user's ~/.ryppl/slave-aliases, updated
+    with those of the project checked out in 'project_dir'.
+    """
+    aliases = {}
+    path = user_dir(ALIASES_FILE)
+    if os.path.isfile(path):
+        f = open(path)
+        try:
+            aliases.update(parse_aliases(f.read()))
+        finally:
+            f.close()
+    aliases.update(parse_aliases(read_ryppl(project_dir, ALIASES_FILE)))
+    return aliases
+
+
+def expand(names, aliases):
+    """Turn slave keys and aliases into a list of distinct slave keys, in
+    the order first mentioned.  No names means the "default" alias.
+    Raises ValueError for an alias defined in terms of itself.
+    """
+    if not names:
+        names = ["default"]
+    keys = []
+    def visit(name, path):
+        if name in path:
+            raise ValueError("slave alias '%s' refers to itself (%s)"
+                             % (name, " -> ".join(path + [name])))
+        if name in aliases:
+            for member in aliases[name]:
+                visit(member, path + [name])
+        elif name not in keys:
+            keys.append(name)
+    for name in names:
+        visit(name, [])
+    return keys
+
+
+class Shard:
+    """One unit of work: 'name' identifies it across runs (its cost is
+    remembered by name), 'payload' is whatever the slaves need.
+    """
+
+    def __init__(self, name, payload=None):
+        self.name = name
+        self.payload = payload
+        self.cost = DEFAULT_COST
+
+
+class Slave:
+    """Base class of test slaves.  'key' is the slave's unique key and
+    'capacity' how many shards it runs at once.  'platform' identifies
+    the kind of machine it is (see ryppl.testselect.platform_key), if
+    known.
+    """
+
+    platform = None
+
+    def __init__(self, key, capacity=1):
+        self.key = key
+        self.capacity = capacity
+
+    def backlog(self):
+        """Seconds of work the slave already has queued (for others)."""
+        return 0.0
+
+    def run(self, shard):
+        """Run 'shard' and return its outcome.  Raising means the slave
+        can't be used anymore."""
+        raise NotImplementedError
+
+
+class LocalSlave(Slave):
+    """A stand-in slave that calls action(shard) in this process.  With
+    'slowdown', it also sleeps that many times the shard's running
+    time, to mimic a slower machine.
+    """
+
+    def __init__(self, key, action, capacity=1, slowdown=0):
+        Slave.__init__(self, key, capacity)
+        self.action = action
+        self.slowdown = slowdown
+
+    def run(self, shard):
+        start = time.time()
+        outcome = self.action(shard)
+        if self.slowdown:
+            time.sleep((time.time() - start) * self.slowdown)
+        return outcome
+
+
+class Outcome:
+    """How a shard went: the 'slave' key it ran on, what run() returned
+    ('value') or raised ('error', if no slave could run it), and how
+    long it took."""
+
+    def __init__(self, shard):
+        self.shard = shard
+        self.slave = None
+        self.value = None
+        self.error = None
+        self.duration = None
+
+
+class _SlaveState:
+    def __init__(self, slave, throughput, backlog):
+        self.slave = slave
+        self.throughput = throughput    # cost per second, per slot
+        self.backlog = backlog          # seconds, from before we came
+        self.queue = []                 # shards not yet started
+        self.running = 0                # cost of shards being run
+        self.alive = True
+        self.workers = 0                # threads still taking shards
+
+    def remaining(self, extra=0.0):
+        """Seconds until everything queued here (plus 'extra' cost) is
+        expected to be done."""
+        work = sum(s.cost for s in self.queue) + self.running + extra
+        return self.backlog + work / (self.throughput * self.slave.capacity)
+
+
+class Scheduler:
+    """Runs Shards on 'slaves'.  Costs and throughputs learned are kept
+    in 'history' (~/.ryppl/slave-history by default; False for none).
+    """
+
+    def __init__(self, slaves, history=None):
+        if history is None:
+            history = user_dir(HISTORY_FILE)
+        self.history = history
+        saved = history and load_cache(history, _FORMAT) or {}
+        self.costs = saved.get('costs', {})
+        self.throughputs = saved.get('throughputs', {})
+        self.lock = threading.Lock()
+        # Signalled whenever a shard is settled or handed to a slave.
+        self.changed = threading.Condition(self.lock)
+        self.unsettled = 0              # shards neither done nor given up
+        self.states = [_SlaveState(slave, self.throughputs.get(slave.key, 1.0),
+                                   slave.backlog())
+                       for slave in slaves]
+
+    def plan(self, shards):
+        """Deal 'shards' out to the slaves: largest first, each to the
+        slave expected to finish it soonest.  Returns {key: [shards]}.
+        """
+        for shard in shards:
+            shard.cost = self.costs.get(shard.name, DEFAULT_COST)
+        for shard in sorted(shards, key=lambda s: s.cost, reverse=True):
+            self._place(shard)
+        return dict((state.slave.key, list(state.queue))
+                    for state in self.states)
+
+    def _place(self, shard, running=False):
+        alive = [state for state in self.states
+                 if state.alive and (state.workers or not running)]
+        if not alive:
+            return False
+        best = min(alive, key=lambda state: state.remaining(shard.cost))
+        best.queue.append(shard)
+        return True
+
+    def _next(self, state):
+        """The shard 'state' should run next: its own first, or else
+        one stolen from the slave with the most left to do."""
+        if state.queue:
+            return state.queue.pop(0)
+        victims = [other for other in self.states
+                   if other is not state and other.queue]
+        if not victims:
+            return None
+        victim = max(victims, key=lambda other: other.remaining())
+        # Only worth it if we'd be done with it before the victim.
+        shard = victim.queue[-1]
+        if state.remaining(shard.cost) >= victim.remaining():
+            return None
+        return victim.queue.pop()
+
+    def run(self, shards, report=None):
+        """Run every shard, calling report(outcome) as each finishes.
+        Returns the Outcomes in the order of 'shards'.
+        """
+        self.plan(shards)
+        outcomes = dict((id(shard), Outcome(shard)) for shard in shards)
+        self.unsettled = len(shards)
+        threads = []
+        for state in self.states:
+            state.workers = state.slave.capacity
+            for slot in range(state.slave.capacity):
+                threads.append(threading.Thread(target=self._work,
+                                                args=(state, outcomes, report)))
+        for thread in threads:
+            thread.setDaemon(True)
+            thread.start()
+        for thread in threads:
+            while thread.isAlive():
+                thread.join(0.5)        # stays interruptible by ^C
+        for state in self.states:
+            for shard in state.queue:   # every slave died
+                outcome = outcomes[id(shard)]
+                outcome.error = RuntimeError("no slave left to run %s"
+                                             % shard.name)
+                if report: report(outcome)
+            state.queue = []
+        self._save()
+        return [outcomes[id(shard)] for shard in shards]
+
+    def _take(self, state):
+        """Wait for the next shard for 'state' to run.  Returns None once
+        the slave has failed or every shard is settled; until then an
+        idle worker stays, to take over the shards of a slave that
+        fails later on.  Call with the lock held.
+        """
+        while state.alive:
+            shard = self._next(state)
+            if shard:
+                state.running += shard.cost
+                return shard
+            if not self.unsettled:
+                break
+            self.changed.wait()
+        state.workers -= 1
+        return None
+
+    def _work(self, state, outcomes, report):
+        while True:
+            self.lock.acquire()
+            try:
+                shard = self._take(state)
+                if shard is None:
+                    return
+            finally:
+                self.lock.release()
+            outcome = outcomes[id(shard)]
+            start = time.time()
+            try:
+                value = state.slave.run(shard)
+            except Exception, e:
+                self.lock.acquire()
+                try:
+                    state.running -= shard.cost
+                    state.alive = False
+                    state.workers -= 1
+                    orphans = [shard] + state.queue
+                    state.queue = []
+                    lost = [s for s in orphans if not self._place(s, True)]
+                    self.unsettled -= len(lost)
+                    self.changed.notifyAll()
+                finally:
+                    self.lock.release()
+                for s in lost:
+                    outcomes[id(s)].error = e
+                    if report: report(outcomes[id(s)])
+                return
+            elapsed = max(time.time() - start, 1e-3)
+            self.lock.acquire()
+            try:
+                state.running -= shard.cost
+                state.backlog = 0.0     # whatever was ahead of us is done
+                self._learn(state, shard, elapsed)
+                outcome.slave = state.slave.key
+                outcome.value = value
+                outcome.duration = elapsed
+                self.unsettled -= 1
+                self.changed.notifyAll()
+            finally:
+                self.lock.release()
+            if report: report(outcome)
+
+    def _learn(self, state, shard, elapsed):
+        known = shard.name in self.costs
+        if known:
+            rate = shard.cost / elapsed
+            state.throughput += _SMOOTHING * (rate - state.throughput)
+            self.throughputs[state.slave.key] = state.throughput
+        # Costs are kept in seconds on a slave of throughput 1.
+        cost = elapsed * state.throughput
+        if known:
+            cost = self.costs[shard.name] + \
+                _SMOOTHING * (cost - self.costs[shard.name])
+        self.costs[shard.name] = cost
+
+    def _save(self):
+        if self.history:
+            save_cache(self.history, _FORMAT,
+                       {'costs': self.costs, 'throughputs': self.throughputs})
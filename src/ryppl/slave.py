@@ -0,0 +1,389 @@
+"""ryppl.slave
+
+A test slave: a daemon working through a queue of test jobs.
+
+Each slave has a spool directory, ~/.ryppl/slaves/<key> by default::
+
+  queue/<job>.job       submitted, waiting (JSON: url, commit, name)
+  running/<job>.job     claimed by a daemon
+  results/<job>/output  what the tests print, appended as they run
+  results/<job>/status  written last (JSON: ok, returncode, ...)
+  clones/<name>         warm clones, fetched into before each job
+  daemons/<pid>         one per daemon serving the queue: its concurrency
+                        (a daemon that died without removing its file is
+                        forgotten the next time anyone looks)
+  platform              the kind of machine the daemons run on
+  subscriptions         optional; the only URLs jobs may name
+
+Jobs are claimed by renaming them from queue/ to running/, so any
+number of daemons may serve one queue.  Each job fetches what's new
+into the warm clone of its repository, checks the commit out into a
+scratch clone sharing the warm clone's objects, and runs the suite
+named in its .ryppl file.  SpoolSlave is the other end: the Slave (see
+ryppl.scheduler) that remote-test submits to, which copies the output
+to stdout as the job produces it, and which gives up on the job (so
+the scheduler hands it to another slave) once no daemon is left
+serving the queue or the job runs past its deadline.
+"""
+
+import os
+import re
+import errno
+import sys
+import json
+import time
+import shutil
+import hashlib
+import threading
+import subprocess as sub
+
+from ryppl.scheduler import Slave
+from ryppl.util import user_dir
+
+POLL_INTERVAL = 0.2
+
+# How long SpoolSlave waits for a job before giving up on it.
+JOB_TIMEOUT = 2 * 60 * 60
+
+PLATFORM_FILE = "platform"
+
+# Average job length assumed when reporting backlog to the scheduler.
+_JOB_SECONDS = 60.0
+
+
+def slave_dir(key):
+    return user_dir("slaves", key)
+
+
+def new_key():
+    """A fresh unique slave key."""
+    return hashlib.sha1("%s %s %s" % (os.uname()[1], os.getpid(),
+                                      time.time())).hexdigest()[:14]
+
+
+def _write_json(path, data):
+    temp = path + ".tmp"
+    f = open(temp, "w")
+    try:
+        json.dump(data, f)
+    finally:
+        f.close()
+    os.rename(temp, path)
+
+
+def _read_json(path):
+    f = open(path)
+    try:
+        return json.load(f)
+    finally:
+        f.close()
+
+
+def _makedirs(*paths):
+    for path in paths:
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+
+def submit(spool, url, commit, name):
+    """Queue a test of 'commit' of the repository at 'url' (called
+    'name') at the slave whose spool directory is 'spool'.  Returns the
+    job id.
+    """
+    queue = os.path.join(spool, "queue")
+    _makedirs(queue)
+    job = "%d-%s" % (time.time() * 1000, hashlib.sha1(
+        "%s %s %s" % (url, commit, os.getpid())).hexdigest()[:8])
+    _write_json(os.path.join(queue, job + ".job"),
+                {"url": url, "commit": commit, "name": name})
+    return job
+
+
+def _running(pid):
+    """Whether process 'pid' exists on this machine."""
+    try:
+        os.kill(pid, 0)
+    except OSError, e:
+        return e.errno != errno.ESRCH
+    return True
+
+
+def daemons(spool):
+    """Return {pid: concurrency} for the daemons serving 'spool',
+    removing the registrations of those no longer running.
+    """
+    found = {}
+    path = os.path.join(spool, "daemons")
+    if not os.path.isdir(path):
+        return found
+    for name in os.listdir(path):
+        registration = os.path.join(path, name)
+        try:
+            pid = int(name)
+        except ValueError:
+            continue
+        if not _running(pid):
+            try:
+                os.remove(registration)
+            except OSError:
+                pass                    # someone else pruned it
+            continue
+        try:
+            f = open(registration)
+            try:
+                found[pid] = int(f.read().strip() or 0)
+            finally:
+                f.close()
+        except (IOError, ValueError):
+            pass
+    return found
+
+
+def capacity(spool):
+    """How many jobs the daemons serving 'spool' run at once in all."""
+    return sum(daemons(spool).values())
+
+
+def pending(spool):
+    """How many jobs are queued or running at 'spool'."""
+    count = 0
+    for sub_dir in ("queue", "running"):
+        path = os.path.join(spool, sub_dir)
+        if os.path.isdir(path):
+            count += len([f for f in os.listdir(path) if f.endswith(".job")])
+    return count
+
+
+class SlaveDaemon:
+    """Runs the jobs queued at 'spool', at most 'concurrency' at once."""
+
+    def __init__(self, git, spool, concurrency=2):
+        self.git = git
+        self.spool = spool
+        self.concurrency = concurrency
+        self.queue = os.path.join(spool, "queue")
+        self.running = os.path.join(spool, "running")
+        self.results = os.path.join(spool, "results")
+        self.clones = os.path.join(spool, "clones")
+        self.daemons = os.path.join(spool, "daemons")
+        _makedirs(self.queue, self.running, self.results, self.clones,
+                  self.daemons)
+        self.lock = threading.Lock()
+        self.clone_locks = {}
+        self.active = []
+
+    def subscriptions(self):
+        """The URLs this slave accepts jobs for, or None for any."""
+        path = os.path.join(self.spool, "subscriptions")
+        if not os.path.isfile(path):
+            return None
+        f = open(path)
+        try:
+            return [line.strip() for line in f
+                    if line.strip() and not line.startswith("#")]
+        finally:
+            f.close()
+
+    def claim(self):
+        """Take the oldest queued job, or return None."""
+        for name in sorted(os.listdir(self.queue)):
+            if not name.endswith(".job"):
+                continue
+            claimed = os.path.join(self.running, name)
+            try:
+                os.rename(os.path.join(self.queue, name), claimed)
+            except OSError:
+                continue                # another daemon got it
+            return name[:-4], _read_json(claimed)
+        return None
+
+    def serve(self, once=False):
+        """Run jobs until interrupted or, if 'once', until the queue is
+        empty.
+        """
+        from ryppl.testselect import platform_key
+        for url in self.subscriptions() or ():
+            self.warm_clone(url)
+        f = open(os.path.join(self.spool, PLATFORM_FILE), "w")
+        try:
+            f.write(platform_key() + "\n")
+        finally:
+            f.close()
+        registration = os.path.join(self.daemons, str(os.getpid()))
+        f = open(registration, "w")
+        try:
+            f.write("%d\n" % self.concurrency)
+        finally:
+            f.close()
+        try:
+            while True:
+                self.active = [t for t in self.active if t.isAlive()]
+                claimed = None
+                if len(self.active) < self.concurrency:
+                    claimed = self.claim()
+                if claimed is None:
+                    if once and not self.active:
+                        return
+                    time.sleep(POLL_INTERVAL)
+                    continue
+                thread = threading.Thread(target=self.run_job, args=claimed)
+                thread.setDaemon(True)
+                thread.start()
+                self.active.append(thread)
+        finally:
+            os.remove(registration)
+            for thread in self.active:
+                while thread.isAlive():
+                    thread.join(0.5)
+
+    def _clone_lock(self, path):
+        self.lock.acquire()
+        try:
+            return self.clone_locks.setdefault(path, threading.Lock())
+        finally:
+            self.lock.release()
+
+    def warm_clone(self, url):
+        """The path of our clone of 'url', brought up to date."""
+        name = re.sub(r'[^\w.-]', '_', url.rstrip("/"))
+        path = os.path.join(self.clones, name)
+        lock = self._clone_lock(path)
+        lock.acquire()
+        try:
+            if not os.path.isdir(path):
+                output = self.git.git("clone", "--bare", "--quiet", url, path)
+                if not os.path.isdir(path):
+                    raise RuntimeError("can't clone %s: %s"
+                                       % (url, output.strip()))
+            else:
+                # Only what's new comes over the wire.
+                self.git.git("fetch", "--quiet", url,
+                             "+refs/heads/*:refs/heads/*",
+                             "+refs/tags/*:refs/tags/*", cwd=path)
+        finally:
+            lock.release()
+        return path
+
+    def run_job(self, job, spec):
+        results = os.path.join(self.results, job)
+        _makedirs(results)
+        output = open(os.path.join(results, "output"), "a", 0)
+        status = {"ok": False, "returncode": None, "started": time.time()}
+        work = os.path.join(self.spool, "work", job)
+        try:
+            try:
+                status.update(self._test(spec, work, output))
+            except Exception, e:
+                output.write("ryppl slave: %s\n" % e)
+        finally:
+            output.close()
+            status["finished"] = time.time()
+            _write_json(os.path.join(results, "status"), status)
+            os.remove(os.path.join(self.running, job + ".job"))
+            shutil.rmtree(work, ignore_errors=True)
+
+    def _test(self, spec, work, output):
+        from ryppl.testselect import test_command, suite_env
+        subscribed = self.subscriptions()
+        if subscribed is not None and spec["url"] not in subscribed:
+            output.write("not subscribed to %s\n" % spec["url"])
+            return {}
+        clone = self.warm_clone(spec["url"])
+        # A scratch clone borrowing the warm clone's objects.
+        self.git.git("clone", "--shared", "--no-checkout", "--quiet",
+                     clone, work)
+        checkout = self.git.git("checkout", "--quiet", spec["commit"],
+                                cwd=work)
+        if checkout.strip():
+            output.write(checkout)
+            return {}
+        command = test_command(work)
+        if command is None:
+            output.write("no test command in %s\n" % spec["name"])
+            return {"ok": True, "returncode": 0}
+        output.write("$ %s\n" % " ".join(command))
+        devnull = open(os.devnull)
+        try:
+            p = sub.Popen(command, cwd=work, stdin=devnull,
+                          stdout=output, stderr=sub.STDOUT, env=suite_env())
+            rv = p.wait()
+        finally:
+            devnull.close()
+        return {"ok": rv == 0, "returncode": rv}
+
+
+class SpoolSlave(Slave):
+    """The slave whose daemons serve the spool directory 'spool'.  A job
+    not finished within 'timeout' seconds is given up on.  Raises
+    ValueError if no daemon is serving 'spool'.
+    """
+
+    def __init__(self, key, git, spool=None, timeout=JOB_TIMEOUT):
+        spool = spool or slave_dir(key)
+        slots = capacity(spool)
+        if not slots:
+            raise ValueError("no daemon is serving slave %s" % key)
+        Slave.__init__(self, key, slots)
+        self.git = git
+        self.spool = spool
+        self.timeout = timeout
+        path = os.path.join(spool, PLATFORM_FILE)
+        if os.path.isfile(path):
+            f = open(path)
+            try:
+                self.platform = f.read().strip() or None
+            finally:
+                f.close()
+
+    def backlog(self):
+        return pending(self.spool) * _JOB_SECONDS / self.capacity
+
+    def run(self, shard):
+        """Test the project checked out at shard.payload, at its HEAD,
+        printing the output as it comes.  Returns the job's status (see
+        above), with what the tests printed as "output".  Raises
+        RuntimeError if the daemons die or the deadline passes first.
+        """
+        project = os.path.abspath(shard.payload)
+        commit = self.git.git("rev-parse", "--verify", "HEAD",
+                              cwd=project).strip()
+        job = submit(self.spool, project, commit,
+                     os.path.basename(project))
+        results = os.path.join(self.spool, "results", job)
+        status_path = os.path.join(results, "status")
+        output_path = os.path.join(results, "output")
+        deadline = time.time() + self.timeout
+        offset = 0
+        printed = []
+        while True:
+            finished = os.path.exists(status_path)
+            if not finished:
+                problem = None
+                if not daemons(self.spool):
+                    problem = "no daemon is serving slave %s" % self.key
+                elif time.time() > deadline:
+                    problem = "slave %s took over %d seconds on %s" % (
+                        self.key, self.timeout, shard.name)
+                if problem and not os.path.exists(status_path):
+                    # Don't leave it for a daemon started later.
+                    try:
+                        os.remove(os.path.join(self.spool, "queue",
+                                               job + ".job"))
+                    except OSError:
+                        pass
+                    raise RuntimeError(problem)
+            if os.path.exists(output_path):
+                f = open(output_path)
+                try:
+                    f.seek(offset)
+                    data = f.read()
+                finally:
+                    f.close()
+                offset += len(data)
+                printed.append(data)
+                sys.stdout.write(data)
+            if finished:
+                status = _read_json(status_path)
+                status["output"] = "".join(printed)
+                return status
+            time.sleep(POLL_INTERVAL)
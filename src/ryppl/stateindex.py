@@ -0,0 +1,173 @@
+"""ryppl.stateindex
+
+Remembers where each project of a workspace stands, so workspace-wide
+commands need not ask git about every project every time.
+
+For each project (subdirectory with a .git) the index in
+.ryppl-workspace/state records its HEAD commit and tree, its branch,
+its origin URL and a digest of its .ryppl dependencies, together with
+the size and modification time of the files they were derived from:
+.git/HEAD, the branch's ref (loose or packed), .git/index, .git/config
+and the .ryppl file.  While none of those has changed the entry is
+trusted as it is; HEAD and the branch are read from the files
+directly, so git only runs (once) for the tree of a moved HEAD.
+"""
+
+import os
+import re
+import hashlib
+
+from ryppl.refs import git_dir, read_ref
+from ryppl.resolver import DEPENDS_FILE, read_ryppl
+from ryppl.util import load_cache, save_cache, parse_git_config
+from ryppl.workspace import STATE_DIR
+
+STATE_FILE = "state"
+
+_FORMAT = 1
+
+_sha_re = re.compile(r'^[0-9a-f]{40}$')
+
+
+def _stat(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_size, st.st_mtime)
+
+
+def _read_line(path):
+    try:
+        f = open(path)
+    except IOError:
+        return None
+    try:
+        return f.readline().strip()
+    finally:
+        f.close()
+
+
+def _depends_path(project):
+    path = os.path.join(project, DEPENDS_FILE)
+    if os.path.isdir(path):
+        path = os.path.join(path, "depends")
+    return path
+
+
+def stamps(project, gitdir):
+    """What changes whenever HEAD, the branch it is on, the index, the
+    configuration or the dependencies of 'project' change.
+    """
+    head = _read_line(os.path.join(gitdir, "HEAD")) or ""
+    found = [head]
+    if head.startswith("ref: "):
+        ref = head[5:]
+        found += [_stat(os.path.join(gitdir, ref)),
+                  _stat(os.path.join(gitdir, "packed-refs"))]
+    for name in ("HEAD", "index", "config"):
+        found.append(_stat(os.path.join(gitdir, name)))
+    found.append(_stat(_depends_path(project)))
+    return tuple(found)
+
+
+class ProjectInfo:
+    """What the index knows about one project: 'commit' and 'tree' of
+    HEAD (None if there are no commits), 'branch' (None if detached),
+    'remote' (the origin URL, or None) and 'depends' (a digest of its
+    dependency declarations).
+    """
+
+    fields = ("commit", "tree", "branch", "remote", "depends")
+
+    def __init__(self, name, **values):
+        self.name = name
+        for field in self.fields:
+            setattr(self, field, values.get(field))
+
+    def values(self):
+        return dict((field, getattr(self, field)) for field in self.fields)
+
+
+class StateIndex:
+    """The state index of the workspace at 'root' ('path' being where it
+    is kept; .ryppl-workspace/state by default).
+    """
+
+    def __init__(self, git, root=os.curdir, path=None):
+        self.git = git
+        self.root = root
+        self.path = path or os.path.join(root, STATE_DIR, STATE_FILE)
+        self.entries = {}           # name -> (stamps, values)
+        saved = load_cache(self.path, _FORMAT)
+        if saved:
+            self.entries = saved
+        self.projects = {}          # name -> ProjectInfo, once refreshed
+
+    def refresh(self):
+        """Bring every entry up to date.  Returns the names of the
+        projects that changed (or appeared, or disappeared) since the
+        last refresh.
+        """
+        changed = []
+        entries = {}
+        for name in sorted(os.listdir(self.root)):
+            project = os.path.join(self.root, name)
+            gitdir = not name.startswith(".") and git_dir(project)
+            if not gitdir:
+                continue
+            stamp = stamps(project, gitdir)
+            entry = self.entries.get(name)
+            if entry is None or entry[0] != stamp:
+                previous = entry and entry[1] or {}
+                entry = (stamp, self._examine(project, gitdir, previous))
+                if entry[1] != previous:
+                    changed.append(name)
+            entries[name] = entry
+            self.projects[name] = ProjectInfo(name, **entry[1])
+        changed += [name for name in self.entries if name not in entries]
+        for name in list(self.projects):
+            if name not in entries:
+                del self.projects[name]
+        if changed or entries != self.entries:
+            self.entries = entries
+            parent = os.path.dirname(self.path)
+            if not os.path.isdir(parent):
+                os.makedirs(parent)
+            save_cache(self.path, _FORMAT, entries)
+        return sorted(changed)
+
+    def get(self, project):
+        """The ProjectInfo of the project at path 'project', or None if
+        it isn't one of ours (call refresh() first).
+        """
+        return self.projects.get(os.path.basename(os.path.abspath(project)))
+
+    def _examine(self, project, gitdir, previous):
+        head = _read_line(os.path.join(gitdir, "HEAD")) or ""
+        branch = None
+        if head.startswith("ref: "):
+            branch = head[5:]
+            commit = read_ref(gitdir, branch)
+            if branch.startswith("refs/heads/"):
+                branch = branch[len("refs/heads/"):]
+        else:
+            commit = head or None
+        if commit == previous.get("commit"):
+            tree = previous.get("tree")
+        elif commit is not None:
+            tree = self.git.git("rev-parse", commit + "^{tree}",
+                                cwd=project).strip()
+            if not _sha_re.match(tree):
+                tree = None
+        else:
+            tree = None
+        return {
+            "commit": commit,
+            "tree": tree,
+            "branch": branch,
+            "remote": parse_git_config(os.path.join(gitdir, "config"))
+                          .get("remote.origin.url"),
+            "depends": hashlib.sha1(read_ryppl(project, "depends"))
+                                    .hexdigest(),
+            }
@@ -0,0 +1,97 @@
+"""ryppl.status
+
+Tells whether a project's working tree has uncommitted changes without
+git examining every file each time.
+
+Projects opt in by setting ryppl.fastStatus to true, in their own
+config or in ~/.gitconfig.  In such a project it turns on what git has
+to make "git status" cheap there: the untracked cache, the split index
+and a file system monitor (git's own where it has one, else the inotify
+watcher of ryppl.fsmonitor through git's fsmonitor hook, which starts
+a daemon watching the tree until it goes unasked for a while).  Only
+settings the user hasn't made are changed.  Other projects are left
+alone and git status runs every time.
+
+is_dirty() then remembers its answer in the project's git directory,
+along with the watcher's token and the stamps of HEAD and the index
+(see ryppl.stateindex.stamps).  If the watcher has seen nothing change
+in the tree since and the stamps are the same, the answer stands and
+git isn't run at all.
+"""
+
+import os
+
+from ryppl import fsmonitor
+from ryppl.query import status
+from ryppl.refs import git_dir
+from ryppl.stateindex import stamps
+from ryppl.util import load_cache, save_cache, parse_git_config
+
+STATUS_FILE = "ryppl-status"
+
+_FORMAT = 1
+
+
+def settings(git):
+    """The config settings that speed up "git status" with 'git'."""
+    supports = getattr(git, 'supports', lambda feature: False)
+    wanted = {}
+    if supports("untracked-cache"):
+        wanted["core.untrackedcache"] = "true"
+    if supports("split-index"):
+        wanted["core.splitindex"] = "true"
+    if supports("builtin-fsmonitor"):
+        wanted["core.fsmonitor"] = "true"
+    elif supports("fsmonitor-hook") and fsmonitor.available():
+        wanted["core.fsmonitor"] = fsmonitor.hook_command()
+    return wanted
+
+
+def _ours(hook):
+    """Whether core.fsmonitor = 'hook' is ryppl's (from any install)."""
+    return hook.endswith('fsmonitor.py" hook')
+
+
+def configure(git, project, gitdir=None):
+    """Turn on those of settings(git) that 'project' has no value for,
+    if it has opted in (see above).  Returns whether the project uses
+    ryppl's watcher.
+    """
+    gitdir = gitdir or git_dir(project)
+    config = parse_git_config(os.path.expanduser("~/.gitconfig"))
+    config.update(parse_git_config(os.path.join(gitdir, "config")))
+    if config.get("ryppl.faststatus", "false").lower() not in (
+            "true", "yes", "on", "1"):
+        return False
+    for key, value in sorted(settings(git).items()):
+        if key not in config or key == "core.fsmonitor" \
+               and _ours(config[key]) and config[key] != value:
+            git.git("config", key, value, cwd=project)
+            config[key] = value
+    return _ours(config.get("core.fsmonitor", ""))
+
+
+def is_dirty(git, project):
+    """Whether the working tree of 'project' has changes, staged or not,
+    or untracked files that aren't ignored.
+    """
+    gitdir = git_dir(project)
+    if gitdir is None:
+        return False
+    watched = configure(git, project, gitdir)
+    path = os.path.join(gitdir, STATUS_FILE)
+    saved = load_cache(path, _FORMAT)
+    token = None
+    if watched:
+        reply = fsmonitor.query(project, saved and saved[0])
+        if reply is None:
+            fsmonitor.start(project)
+        else:
+            token, paths = reply
+            if saved is not None and not paths \
+                   and saved[1] == stamps(project, gitdir):
+                return saved[2]
+    dirty = not status(git, project).clean()
+    # Stamped after git status, which may itself rewrite the index.
+    save_cache(path, _FORMAT, (token, stamps(project, gitdir), dirty))
+    return dirty
@@ -0,0 +1,272 @@
+"""ryppl.superproject
+
+Works on all the submodules of a superproject (see
+doc/superprojects.rst) at once.
+
+What the submodules are is read without a git process per submodule:
+their names, paths and URLs come from .gitmodules, the commits the
+superproject points them at from a single "git ls-tree" of its HEAD.
+Each operation is then a small pipeline per submodule (clone or fetch
+only if the commit is missing, check it out, look at the result)
+driven by one AsyncGit, so every submodule makes progress at once.
+Commands that talk to a remote are additionally limited to a shared
+number of connections, so as not to hammer the server; local ones
+run as fast as the process budget allows.  The outcome is one row
+per submodule, printed as a table by print_table().
+"""
+
+import os
+import sys
+
+from ryppl.asyncgit import AsyncGit
+from ryppl.query import parse_ls_tree, parse_status
+from ryppl.util import parse_git_config, read_git_config
+
+GITMODULES = ".gitmodules"
+
+# Commands that open a connection to a remote.
+_NETWORK = ("clone", "fetch")
+
+
+def resolve_url(base, url):
+    """'url' of a submodule, made absolute relative to 'base' (the
+    superproject's own URL) if it starts with ./ or ../, as git does.
+    """
+    if not (url.startswith("./") or url.startswith("../")):
+        return url
+    base = base.rstrip("/")
+    for part in url.split("/"):
+        if part == "..":
+            cut = base.rstrip("/").rfind("/")
+            base = cut > base.find("://") + 2 and base[:cut] or base
+        elif part != ".":
+            base = base + "/" + part
+    return base
+
+
+def parse_gitlinks(output):
+    """{path: commit} for the submodule entries in the output of "git
+    ls-tree -r -z".
+    """
+    links = {}
+    for mode, type, sha, path in parse_ls_tree(output):
+        if type == "commit":
+            links[path] = sha
+    return links
+
+
+class Submodule:
+    """One submodule: its 'name', 'path' (relative to the superproject),
+    'url' and the 'commit' the superproject records for it.  After an
+    operation, 'state' and 'detail' say how it went.
+    """
+
+    def __init__(self, name, path, url, commit):
+        self.name = name
+        self.path = path
+        self.url = url
+        self.commit = commit
+        self.state = None
+        self.detail = ""
+
+
+class Superproject:
+    """The superproject checked out at 'path'.  At most 'jobs' git
+    processes run at once, at most 'connections' of them talking to a
+    remote.  'info', the ryppl.gitinfo.GitInfo of git_executable if
+    known, lets newer gits answer in fewer commands.
+    """
+
+    def __init__(self, path, git_executable="git", jobs=16, connections=4,
+                 info=None):
+        self.path = path
+        self.runner = AsyncGit(git_executable, jobs)
+        self.porcelain_v2 = info is not None and \
+            info.supports("porcelain-v2")
+        self.connections = connections
+        self._online = 0
+        self._waiting = []          # network commands not started yet
+
+    def submodules(self):
+        """The Submodules of HEAD, in path order."""
+        modules = parse_git_config(os.path.join(self.path, GITMODULES))
+        base = read_git_config(self.path).get("remote.origin.url") \
+            or os.path.abspath(self.path)
+        links = parse_gitlinks(self.runner.git(
+            "ls-tree", "-r", "-z", "--full-tree", "HEAD",
+            cwd=self.path).result())
+        submodules = []
+        for key, path in modules.items():
+            if not (key.startswith("submodule.") and key.endswith(".path")):
+                continue
+            name = key[len("submodule."):-len(".path")]
+            if path in links:
+                url = modules.get("submodule.%s.url" % name, "")
+                submodules.append(Submodule(name, path,
+                                            resolve_url(base, url),
+                                            links.pop(path)))
+        # Gitlinks .gitmodules doesn't mention can't be cloned.
+        for path in links:
+            submodule = Submodule(path, path, None, links[path])
+            submodules.append(submodule)
+        submodules.sort(key=lambda s: s.path)
+        return submodules
+
+    def _git(self, submodule, then, *args, **kwargs):
+        """Queue 'git <args>' for 'submodule' (in its directory unless a
+        cwd is given) and call then(call) when it is done.  Network
+        commands wait for a free connection.
+        """
+        kwargs.setdefault('cwd', os.path.join(self.path, submodule.path))
+        if args[0] not in _NETWORK:
+            self.runner.git(*args, **kwargs).add_done_callback(then)
+        elif self._online >= self.connections:
+            self._waiting.append((submodule, then, args, kwargs))
+        else:
+            self._online += 1
+            def release(call):
+                self._online -= 1
+                if self._waiting:
+                    submodule, next, args, kwargs = self._waiting.pop(0)
+                    self._git(submodule, next, *args, **kwargs)
+                then(call)
+            self.runner.git(*args, **kwargs).add_done_callback(release)
+
+    def _cloned(self, submodule):
+        return os.path.exists(os.path.join(self.path, submodule.path, ".git"))
+
+    def _fail(self, submodule, call):
+        submodule.state = "failed"
+        submodule.detail = (call.stderr or call.output
+                            or str(call.error)).strip()
+
+    def _run(self, submodules, start):
+        for submodule in submodules:
+            if submodule.url is None:
+                submodule.state = "unknown"
+                submodule.detail = "not in %s" % GITMODULES
+            else:
+                start(submodule)
+        self.runner.run()
+        return submodules
+
+    def checkout(self, fetch=True):
+        """Check out the recorded commit of every submodule (detached, as
+        "git submodule update" does), cloning the missing ones and, if
+        'fetch', fetching into those lacking their commit.  Returns the
+        Submodules.
+        """
+        def start(submodule):
+            if not self._cloned(submodule):
+                self._git(submodule, cloned(submodule), "clone", "--quiet",
+                          "--no-checkout", submodule.url, submodule.path,
+                          cwd=self.path)
+            else:
+                self._git(submodule, looked(submodule), "cat-file", "-e",
+                          submodule.commit + "^{commit}")
+        def cloned(submodule):
+            def then(call):
+                if call.returncode != 0 or not self._cloned(submodule):
+                    return self._fail(submodule, call)
+                # The index of a fresh clone is empty: nothing to lose.
+                check_out(submodule, "--force")
+            return then
+        def looked(submodule):
+            def then(call):
+                if call.returncode == 0 or not fetch:
+                    return check_out(submodule)
+                self._git(submodule, fetched(submodule),
+                          "fetch", "--quiet", "origin")
+            return then
+        def fetched(submodule):
+            def then(call):
+                if call.returncode != 0:
+                    return self._fail(submodule, call)
+                check_out(submodule)
+            return then
+        def check_out(submodule, *options):
+            def then(call):
+                if call.returncode != 0:
+                    return self._fail(submodule, call)
+                self._status(submodule)
+            self._git(submodule, then, "checkout", "--quiet",
+                      *(options + (submodule.commit,)))
+        return self._run(self.submodules(), start)
+
+    def status(self):
+        """Find out whether each submodule is cloned, at its recorded
+        commit and clean.  Returns the Submodules.
+        """
+        def start(submodule):
+            if not self._cloned(submodule):
+                submodule.state = "missing"
+                return
+            if self.porcelain_v2:
+                self._status(submodule)     # which tells HEAD too
+                return
+            def then(call):
+                head = call.output.strip()
+                if call.returncode != 0:
+                    return self._fail(submodule, call)
+                self._status(submodule, head)
+            self._git(submodule, then, "rev-parse", "HEAD")
+        return self._run(self.submodules(), start)
+
+    def _status(self, submodule, head=None):
+        """Set the state of 'submodule' from its working tree and HEAD
+        ('head' if known, else what git status says or, failing that,
+        the recorded commit).
+        """
+        def then(call):
+            if call.returncode != 0:
+                return self._fail(submodule, call)
+            found = parse_status(call.output, self.porcelain_v2)
+            at = head or found.commit or submodule.commit
+            moved = at != submodule.commit and at
+            changes = len(found.entries)
+            details = []
+            if moved:
+                details.append("at %s" % moved[:10])
+            if changes:
+                details.append("%d changed file%s"
+                               % (changes, changes != 1 and "s" or ""))
+            submodule.state = moved and "moved" or \
+                changes and "modified" or "ok"
+            submodule.detail = ", ".join(details)
+        if self.porcelain_v2:
+            self._git(submodule, then, "status", "--porcelain=v2", "-z",
+                      "--branch")
+        else:
+            self._git(submodule, then, "status", "--porcelain", "-z")
+
+    def fetch(self):
+        """Fetch from the origin of every cloned submodule.  Returns the
+        Submodules.
+        """
+        def start(submodule):
+            if not self._cloned(submodule):
+                submodule.state = "missing"
+                return
+            def then(call):
+                if call.returncode != 0:
+                    return self._fail(submodule, call)
+                submodule.state = "fetched"
+            self._git(submodule, then, "fetch", "--quiet", "origin")
+        return self._run(self.submodules(), start)
+
+
+def print_table(submodules, stream=None):
+    """Print one row per Submodule: path, commit, state and details."""
+    stream = stream or sys.stdout
+    rows = [(s.path, s.commit[:10], s.state or "", s.detail.split("\n")[0])
+            for s in submodules]
+    widths = [max([len(row[i]) for row in rows] + [0]) for i in range(3)]
+    for row in rows:
+        stream.write(("%-*s  %-*s  %-*s  %s" % (
+            widths[0], row[0], widths[1], row[1],
+            widths[2], row[2], row[3])).rstrip() + "\n")
+    counts = {}
+    for s in submodules:
+        counts[s.state] = counts.get(s.state, 0) + 1
+    stream.write("%d submodules: %s\n" % (len(submodules), ", ".join(
+        "%d %s" % (counts[state], state) for state in sorted(counts))))
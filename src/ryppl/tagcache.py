@@ -0,0 +1,187 @@
+"""ryppl.tagcache
+
+A small sqlite database under ~/.ryppl remembering what "git ls-remote
+--tags" said about each remote, and the dependency declarations found
+at each tagged commit.  Tag listings expire after a time-to-live (and
+when a fetch into a clone of the remote changed its tags); the
+dependencies of a commit never change, so they are kept for good.
+
+With everything cached, resolving dependencies needs no git process
+at all.  In offline mode expired listings are used as they are and
+the network is never consulted.
+"""
+
+import os
+import time
+import sqlite3
+
+from ryppl.objects import find_git_dir
+from ryppl.refs import common_dir, list_refs
+from ryppl.util import user_dir, parse_git_config
+
+CACHE_FILE = "tags.db"
+
+# Seconds to wait for other ryppl runs to be done with the cache.
+LOCK_TIMEOUT = 30
+
+_SCHEMA_VERSION = 1
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS listing (
+    url TEXT PRIMARY KEY,
+    fetched REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS tag (
+    url TEXT NOT NULL,
+    name TEXT NOT NULL,
+    sha TEXT NOT NULL,
+    PRIMARY KEY (url, name)
+);
+CREATE TABLE IF NOT EXISTS depends (
+    sha TEXT PRIMARY KEY,
+    text TEXT NOT NULL
+);
+"""
+
+
+def parse_ls_remote(output):
+    """Return a dict mapping tag names to the sha of the commit they
+    name, from the output of "git ls-remote --tags".  Annotated tags
+    are listed twice by git, the second time peeled ("name^{}"); the
+    peeled sha is the one kept.
+    """
+    tags = {}
+    for line in output.splitlines():
+        fields = line.split("\t")
+        if len(fields) != 2 or not fields[1].startswith("refs/tags/"):
+            continue
+        sha, name = fields[0].strip(), fields[1][len("refs/tags/"):]
+        if name.endswith("^{}"):
+            tags[name[:-3]] = sha
+        else:
+            tags.setdefault(name, sha)
+    return tags
+
+
+class TagCache:
+    """The cache in 'path' (by default ~/.ryppl/tags.db).  Listings older
+    than 'ttl' seconds are refetched unless 'offline' is true.
+    """
+
+    def __init__(self, path=None, ttl=3600, offline=False):
+        if path is None:
+            path = user_dir(CACHE_FILE)
+        self.path = path
+        self.ttl = ttl
+        self.offline = offline
+        self.db = self._open()
+
+    def _open(self):
+        try:
+            db = sqlite3.connect(self.path, timeout=LOCK_TIMEOUT)
+            if db.execute("PRAGMA user_version").fetchone()[0] \
+                   != _SCHEMA_VERSION:
+                db.executescript("DROP TABLE IF EXISTS listing;"
+                                 "DROP TABLE IF EXISTS tag;"
+                                 "DROP TABLE IF EXISTS depends;")
+                db.executescript(_SCHEMA)
+                db.execute("PRAGMA user_version = %d" % _SCHEMA_VERSION)
+                db.commit()
+            return db
+        except sqlite3.OperationalError:
+            raise                       # locked, say: not ours to remove
+        except sqlite3.DatabaseError:
+            # Not a database at all; it only holds what we can ask git
+            # again, so start over.
+            os.remove(self.path)
+            db = sqlite3.connect(self.path, timeout=LOCK_TIMEOUT)
+            db.executescript(_SCHEMA)
+            db.execute("PRAGMA user_version = %d" % _SCHEMA_VERSION)
+            db.commit()
+            return db
+
+    def close(self):
+        self.db.close()
+
+    def cached_tags(self, url, max_age=None):
+        """The cached {tag: sha} listing of 'url', or None if there is
+        none or it is more than 'max_age' seconds old.
+        """
+        row = self.db.execute("SELECT fetched FROM listing WHERE url = ?",
+                              (url,)).fetchone()
+        if row is None:
+            return None
+        if max_age is not None and time.time() - row[0] > max_age:
+            return None
+        return dict(self.db.execute("SELECT name, sha FROM tag WHERE url = ?",
+                                    (url,)))
+
+    def store_tags(self, url, tags):
+        """Record 'tags', a {tag: sha} dict, as the listing of 'url'."""
+        db = self.db
+        db.execute("DELETE FROM tag WHERE url = ?", (url,))
+        db.executemany("INSERT INTO tag (url, name, sha) VALUES (?, ?, ?)",
+                       [(url, name, sha) for name, sha in tags.items()])
+        db.execute("INSERT OR REPLACE INTO listing (url, fetched) "
+                   "VALUES (?, ?)", (url, time.time()))
+        db.commit()
+
+    def invalidate(self, url):
+        """Forget the listing of 'url', so that it is fetched again."""
+        self.db.execute("DELETE FROM tag WHERE url = ?", (url,))
+        self.db.execute("DELETE FROM listing WHERE url = ?", (url,))
+        self.db.commit()
+
+    def tags(self, git, url):
+        """The {tag: sha} listing of 'url', from the cache while it is
+        fresh (or always, when offline) and from "git ls-remote" when
+        not.  Offline, a remote never listed before has no tags.
+        """
+        if self.offline:
+            return self.cached_tags(url) or {}
+        tags = self.cached_tags(url, self.ttl)
+        if tags is None:
+            output = git.git("ls-remote", "--tags", url)
+            tags = parse_ls_remote(output)
+            if not tags and "fatal:" in output:
+                # Unreachable: make do with what we had, and ask again
+                # next time.
+                return self.cached_tags(url) or {}
+            self.store_tags(url, tags)
+        return tags
+
+    def local_tags(self, repository):
+        """The {ref: sha} tags of the clone at 'repository', to pass to
+        fetched() after fetching into it; None if they can't be read.
+        """
+        gitdir = find_git_dir(repository)
+        return gitdir and list_refs(gitdir, "refs/tags/")
+
+    def fetched(self, repository, before):
+        """Note that "git fetch" ran in the clone at 'repository', whose
+        tags were 'before' (as local_tags() found them) until then.
+        Listings of its remotes are dropped if the fetch added, moved or
+        deleted any tag, or if we can't tell.  This doesn't depend on
+        what the fetch printed, so it works with --quiet.
+        """
+        after = self.local_tags(repository)
+        if before is not None and after == before:
+            return
+        gitdir = find_git_dir(repository)
+        if gitdir is None:
+            return
+        config = os.path.join(common_dir(gitdir) or gitdir, "config")
+        for key, value in parse_git_config(config).items():
+            if key.startswith("remote.") and key.endswith(".url"):
+                self.invalidate(value)
+
+    def depends(self, sha):
+        """The cached .ryppl dependency text of commit 'sha', or None."""
+        row = self.db.execute("SELECT text FROM depends WHERE sha = ?",
+                              (sha,)).fetchone()
+        return row and row[0]
+
+    def store_depends(self, sha, text):
+        self.db.execute("INSERT OR REPLACE INTO depends (sha, text) "
+                        "VALUES (?, ?)", (sha, text))
+        self.db.commit()
@@ -0,0 +1,239 @@
+"""ryppl.testrunner
+
+Runs the test modules of a package in a pool of worker processes.
+
+Modules are handed out longest first, going by how long each took last
+time (remembered in ~/.ryppl/test-durations), so the slow ones don't
+end up last on one worker while the others sit idle.  Each module's
+outcome and output are sent back as soon as it finishes and printed as
+one block; at the end the counts are merged into a single summary, as
+unittest would print it.  Children left behind by the tests are reaped
+after every module, and once more when the pool is done.
+
+Used by src/runtests.py for ryppl's own tests, and by "ryppl test" for
+projects whose .ryppl file says::
+
+  test-modules mypackage.tests
+
+Run as "python -m ryppl.testrunner [-j JOBS] package" for the same.
+"""
+
+import os
+import sys
+import time
+import traceback
+import unittest
+import multiprocessing
+from cStringIO import StringIO
+from Queue import Empty
+
+from ryppl.util import user_dir, load_cache, save_cache
+
+DURATIONS_FILE = "test-durations"
+
+_FORMAT = 1
+
+# What we guess a module we have never timed takes.  Unknown modules
+# go first, which is right for new tests as often as not.
+_UNKNOWN = float(1 << 30)
+
+
+def test_modules(package):
+    """The names of the test modules of 'package' (those named test*.py
+    in its directory), sorted.
+    """
+    __import__(package)
+    here = os.path.dirname(sys.modules[package].__file__)
+    return sorted("%s.%s" % (package, fn[:-3]) for fn in os.listdir(here)
+                  if fn.startswith("test") and fn.endswith(".py"))
+
+
+def reap_children():
+    """Wait for any of our child processes that have exited, as
+    test.test_support.reap_children does."""
+    if not hasattr(os, 'waitpid'):
+        return
+    while True:
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except OSError:
+            return
+        if pid == 0:
+            return
+
+
+class ModuleResult:
+    """What running one test module produced, in a form that can be
+    sent between processes.
+    """
+
+    def __init__(self, module):
+        self.module = module
+        self.ran = 0
+        self.problems = []          # (kind, test id, traceback text)
+        self.skipped = 0
+        self.output = ""
+        self.duration = 0.0
+
+    def ok(self):
+        return not self.problems
+
+
+def _load(module):
+    __import__(module)
+    module = sys.modules[module]
+    if hasattr(module, 'test_suite'):
+        return module.test_suite()
+    return unittest.defaultTestLoader.loadTestsFromModule(module)
+
+
+def run_module(module):
+    """Import test module 'module' and run its test_suite() (or every
+    TestCase in it), returning a ModuleResult.
+    """
+    result = ModuleResult(module)
+    start = time.time()
+    saved = sys.stdout, sys.stderr
+    sys.stdout = sys.stderr = output = StringIO()
+    try:
+        try:
+            suite = _load(module)
+            # Use the TestResult of whichever unittest the suite is for
+            # (unittest2, for ryppl's own tests).
+            framework = sys.modules[suite.__class__.__module__]
+            outcome = getattr(framework, 'TestResult', unittest.TestResult)()
+            suite.run(outcome)
+            result.ran = outcome.testsRun
+            result.skipped = len(getattr(outcome, 'skipped', ()))
+            for kind, problems in (("ERROR", outcome.errors),
+                                   ("FAIL", outcome.failures)):
+                for test, text in problems:
+                    result.problems.append((kind, str(test), text))
+        except Exception:
+            result.problems.append(("ERROR", module, traceback.format_exc()))
+    finally:
+        sys.stdout, sys.stderr = saved
+        reap_children()
+    result.output = output.getvalue()
+    result.duration = time.time() - start
+    return result
+
+
+def _worker(tasks, results):
+    while True:
+        module = tasks.get()
+        if module is None:
+            return
+        results.put(run_module(module))
+
+
+def print_module(result, stream=None):
+    stream = stream or sys.stdout
+    stream.write("%s ... %s (%d tests, %.2fs)\n"
+                 % (result.module, result.ok() and "ok" or "FAILED",
+                    result.ran, result.duration))
+    stream.write(result.output)
+    for kind, test, text in result.problems:
+        stream.write("=" * 70 + "\n%s: %s\n" % (kind, test)
+                     + "-" * 70 + "\n" + text + "\n")
+    stream.flush()
+
+
+def run_modules(modules, jobs=None, report=print_module, durations=None):
+    """Run 'modules' (test module names) on 'jobs' worker processes (one
+    per CPU by default), calling report() with each ModuleResult as it
+    arrives.  Returns the ModuleResults in the order they finished.
+    'durations' is the path of the file of past durations (None for
+    the default, False to not use one).
+    """
+    if durations is None:
+        durations = user_dir(DURATIONS_FILE)
+    past = durations and load_cache(durations, _FORMAT) or {}
+    modules = sorted(modules, key=lambda m: past.get(m, _UNKNOWN),
+                     reverse=True)
+    if jobs is None:
+        jobs = multiprocessing.cpu_count()
+    jobs = max(1, min(jobs, len(modules)))
+
+    finished = []
+    if jobs == 1:
+        for module in modules:
+            finished.append(run_module(module))
+            report(finished[-1])
+    else:
+        tasks = multiprocessing.Queue()
+        results = multiprocessing.Queue()
+        for module in modules:
+            tasks.put(module)
+        for i in range(jobs):
+            tasks.put(None)
+        workers = [multiprocessing.Process(target=_worker,
+                                           args=(tasks, results))
+                   for i in range(jobs)]
+        try:
+            for worker in workers:
+                worker.start()
+            while len(finished) < len(modules):
+                try:
+                    result = results.get(timeout=0.5)
+                except Empty:
+                    if not [w for w in workers if w.is_alive()]:
+                        raise RuntimeError("test workers died")
+                    continue
+                finished.append(result)
+                report(result)
+            for worker in workers:
+                worker.join()
+        finally:
+            for worker in workers:
+                if worker.is_alive():
+                    worker.terminate()
+            reap_children()
+
+    if durations:
+        for result in finished:
+            past[result.module] = result.duration
+        save_cache(durations, _FORMAT, past)
+    return finished
+
+
+def summarize(finished, elapsed, stream=None):
+    """Print unittest's closing lines for all of 'finished'; returns
+    True if every test passed.
+    """
+    stream = stream or sys.stdout
+    ran = sum(r.ran for r in finished)
+    kinds = [kind for r in finished for kind, test, text in r.problems]
+    stream.write("-" * 70 + "\nRan %d test%s in %.3fs\n\n"
+                 % (ran, ran != 1 and "s" or "", elapsed))
+    if kinds:
+        stream.write("FAILED (failures=%d, errors=%d)\n"
+                     % (kinds.count("FAIL"), kinds.count("ERROR")))
+    else:
+        skipped = sum(r.skipped for r in finished)
+        stream.write(skipped and "OK (skipped=%d)\n" % skipped or "OK\n")
+    return not kinds
+
+
+def run_package(package, jobs=None):
+    """Run every test module of 'package'; True if they all passed."""
+    start = time.time()
+    finished = run_modules(test_modules(package), jobs)
+    return summarize(finished, time.time() - start)
+
+
+def main(args=None):
+    from optparse import OptionParser
+    parser = OptionParser(usage="%prog [-j JOBS] package")
+    parser.add_option("-j", "--jobs", type="int", default=None,
+                      help="run up to JOBS test modules at once "
+                           "(default: one per CPU)")
+    options, args = parser.parse_args(args)
+    if len(args) != 1:
+        parser.error("name one package of test modules")
+    sys.path.insert(0, os.getcwd())
+    return run_package(args[0], options.jobs)
+
+
+if __name__ == "__main__":
+    sys.exit(not main())
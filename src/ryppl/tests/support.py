@@ -0,0 +1,86 @@
+"""Helpers for the tests in ryppl.tests: scratch directories and git
+repositories made with the git on PATH.
+"""
+import os
+import shutil
+import tempfile
+import subprocess
+
+# So that commits come out the same whoever runs the tests, and no
+# user or system configuration gets in the way.
+GIT_ENVIRON = {
+    "GIT_AUTHOR_NAME": "Ryppl Tests",
+    "GIT_AUTHOR_EMAIL": "tests@ryppl.invalid",
+    "GIT_AUTHOR_DATE": "1300000000 +0000",
+    "GIT_COMMITTER_NAME": "Ryppl Tests",
+    "GIT_COMMITTER_EMAIL": "tests@ryppl.invalid",
+    "GIT_COMMITTER_DATE": "1300000000 +0000",
+    "GIT_CONFIG_NOSYSTEM": "1",
+}
+
+
+def git(cwd, *args, **kwargs):
+    """Run "git <args>" in 'cwd' and return its output; raises
+    RuntimeError if git fails.  'input' is fed to git's stdin.
+    """
+    env = dict(os.environ)
+    env.update(GIT_ENVIRON)
+    env["HOME"] = cwd
+    p = subprocess.Popen(("git",) + args, cwd=cwd, env=env,
+                         stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                         stderr=subprocess.PIPE)
+    out, err = p.communicate(kwargs.get("input"))
+    if p.returncode != 0:
+        raise RuntimeError("git %s failed: %s" % (" ".join(args), err))
+    return out
+
+
+def write_file(path, text):
+    parent = os.path.dirname(path)
+    if parent and not os.path.isdir(parent):
+        os.makedirs(parent)
+    f = open(path, "w")
+    try:
+        f.write(text)
+    finally:
+        f.close()
+
+
+class TempdirManager(object):
+    """A TestCase mix-in that removes the directories made with
+    mkdtemp() when the test is done.
+    """
+
+    def setUp(self):
+        super(TempdirManager, self).setUp()
+        self.tempdirs = []
+
+    def tearDown(self):
+        for path in self.tempdirs:
+            shutil.rmtree(path, ignore_errors=True)
+        super(TempdirManager, self).tearDown()
+
+    def mkdtemp(self):
+        path = os.path.realpath(tempfile.mkdtemp())
+        self.tempdirs.append(path)
+        return path
+
+    def make_repo(self, path=None, files={"README": "hello\n"}, tags=()):
+        """Make a repository with one commit of 'files' and the tags
+        named in 'tags' on it.  Returns its path.
+        """
+        if path is None:
+            path = os.path.join(self.mkdtemp(), "repo")
+        git(os.path.dirname(path), "init", "--quiet", path)
+        self.commit(path, files)
+        for tag in tags:
+            git(path, "tag", tag)
+        return path
+
+    def commit(self, repo, files, message="change"):
+        """Write 'files' ({path: text}) in 'repo' and commit them."""
+        for name, text in files.items():
+            write_file(os.path.join(repo, name), text)
+        git(repo, "add", "--all")
+        git(repo, "commit", "--quiet", "-m", message)
+        return git(repo, "rev-parse", "HEAD").strip()
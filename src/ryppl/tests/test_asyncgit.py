@@ -0,0 +1,70 @@
+"""Tests for ryppl.asyncgit.
+
+The commands run are Python one-liners rather than git, so that they
+can print where and what the tests need.
+"""
+import sys
+
+from ryppl.tests import unittest2
+from ryppl.asyncgit import AsyncGit, GitTimeout, GitCancelled
+
+
+class AsyncGitTestCase(unittest2.TestCase):
+
+    def setUp(self):
+        self.runner = AsyncGit(sys.executable, max_processes=2)
+
+    def python(self, code, **kwargs):
+        return self.runner.git("-c", code, **kwargs)
+
+    def test_output_and_stderr_are_apart(self):
+        call = self.python("import sys; sys.stdout.write('out'); "
+                           "sys.stderr.write('err'); sys.exit(3)")
+        self.assertEqual(call.result(), "out")
+        self.assertEqual(call.stderr, "err")
+        self.assertEqual(call.returncode, 3)
+
+    def test_req(self):
+        call = self.python("pass", req=1)
+        self.assertRaises(RuntimeError, call.result)
+
+    def test_runs_all_with_bounded_processes(self):
+        calls = [self.python("print %d" % i) for i in range(5)]
+        seen = []
+        for call in calls:
+            call.add_done_callback(lambda call: seen.append(call.output))
+        self.runner.run()
+        self.assertEqual(sorted(seen), ["%d\n" % i for i in range(5)])
+        self.assertFalse(self.runner.pending or self.runner.running)
+
+    def test_callback_queues_more(self):
+        first = self.python("print 1")
+        second = []
+        first.add_done_callback(
+            lambda call: second.append(self.python("print 2")))
+        self.runner.run()
+        self.assertEqual(second[0].output, "2\n")
+
+    def test_timeout(self):
+        call = self.python("import time; time.sleep(30)", timeout=0.2)
+        self.assertRaises(GitTimeout, call.result)
+
+    def test_cancel(self):
+        call = self.python("print 1")
+        self.assertTrue(call.cancel())
+        self.assertRaises(GitCancelled, call.result)
+        self.assertFalse(call.cancel())
+
+    def test_call_of_another_runner(self):
+        other = AsyncGit(sys.executable)
+        call = other.git("-c", "pass")
+        self.assertRaises(ValueError, self.runner.run, [call])
+        call.result()
+        self.assertEqual(call.returncode, 0)
+
+
+def test_suite():
+    return unittest2.makeSuite(AsyncGitTestCase)
+
+if __name__ == "__main__":
+    unittest2.main(defaultTest="test_suite")
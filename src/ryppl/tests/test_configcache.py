@@ -0,0 +1,117 @@
+"""Tests for ryppl.configcache."""
+import os
+
+from ryppl.tests import unittest2, support
+from ryppl import configcache
+from ryppl.configcache import ConfigCache, read_config_files
+from ryppl.util import load_cache
+
+
+class ConfigCacheTestCase(support.TempdirManager, unittest2.TestCase):
+
+    def setUp(self):
+        super(ConfigCacheTestCase, self).setUp()
+        self.dir = self.mkdtemp()
+        self.cache = ConfigCache(os.path.join(self.dir, "config.cache"))
+        self.system = self.write("system.cfg",
+                                 "[install]\nprefix = /usr\n"
+                                 "install-lib = /usr/lib\n")
+        self.user = self.write("user.cfg", "[install]\nprefix = /home\n"
+                               "[build]\nbuild-base = b\n")
+        self.parsed = []
+        self.saved = configcache.MAX_ENTRIES, configcache.read_config_files
+
+        def counting(filenames):
+            self.parsed.append(filenames)
+            return read_config_files(filenames)
+        configcache.read_config_files = counting
+
+    def tearDown(self):
+        configcache.MAX_ENTRIES, configcache.read_config_files = self.saved
+        super(ConfigCacheTestCase, self).tearDown()
+
+    def write(self, name, text):
+        path = os.path.join(self.dir, name)
+        support.write_file(path, text)
+        return path
+
+    def test_merged(self):
+        self.assertEqual(self.cache.read([self.system, self.user]), {
+            "install": {"prefix": (self.user, "/home"),
+                        "install_lib": (self.system, "/usr/lib")},
+            "build": {"build_base": (self.user, "b")}})
+
+    def test_unchanged_files_are_not_parsed(self):
+        files = [self.system, self.user]
+        merged = self.cache.read(files)
+        self.assertEqual(self.cache.read(files), merged)
+        self.assertEqual(ConfigCache(self.cache.path).read(files), merged)
+        self.assertEqual(self.parsed, [files])
+
+    def test_changed_size(self):
+        self.cache.read([self.user])
+        self.write("user.cfg", "[install]\nprefix = /opt\n")
+        self.assertEqual(self.cache.read([self.user]),
+                         {"install": {"prefix": (self.user, "/opt")}})
+        self.assertEqual(len(self.parsed), 2)
+
+    def test_changed_mtime(self):
+        self.cache.read([self.user])
+        st = os.stat(self.user)
+        self.write("user.cfg", "[install]\nprefix = /hom2\n"
+                   "[build]\nbuild-base = b\n")
+        os.utime(self.user, (st.st_atime, st.st_mtime + 1))
+        self.assertEqual(self.cache.read([self.user])["install"],
+                         {"prefix": (self.user, "/hom2")})
+        self.assertEqual(len(self.parsed), 2)
+
+    def test_order_matters(self):
+        self.cache.read([self.system, self.user])
+        self.assertEqual(
+            self.cache.read([self.user, self.system])["install"]["prefix"],
+            (self.system, "/usr"))
+        self.assertEqual(len(self.parsed), 2)
+
+    def test_vanished_file(self):
+        missing = os.path.join(self.dir, "missing.cfg")
+        self.assertEqual(self.cache.read([self.user, missing])["build"],
+                         {"build_base": (self.user, "b")})
+        self.assertEqual(load_cache(self.cache.path, configcache._FORMAT),
+                         None)
+
+    def test_entries_are_capped(self):
+        configcache.MAX_ENTRIES = 3
+        sets = [[self.write("%d.cfg" % i, "[x]\ny = %d\n" % i)]
+                for i in range(4)]
+        for files in sets:
+            self.cache.read(files)
+        entries = load_cache(self.cache.path, configcache._FORMAT)
+        self.assertEqual(len(entries), 3)
+        for files in sets[1:]:
+            self.cache.read(files)
+        self.assertEqual(len(self.parsed), 4)
+        self.cache.read(sets[0])        # the oldest was dropped
+        self.assertEqual(len(self.parsed), 5)
+
+    def test_corrupt_cache(self):
+        support.write_file(self.cache.path, "not marshal data")
+        files = [self.system, self.user]
+        self.assertEqual(self.cache.read(files), read_config_files(files))
+        # ...and replaced.
+        self.cache.read(files)
+        self.assertEqual(len(self.parsed), 1)
+
+    def test_unwritable_cache(self):
+        cache = ConfigCache(os.path.join(self.dir, "nowhere", "cache"))
+        files = [self.system, self.user]
+        self.assertEqual(cache.read(files), read_config_files(files))
+        self.assertEqual(cache.read(files), read_config_files(files))
+        self.assertEqual(len(self.parsed), 2)
+        self.assertFalse(os.path.exists(cache.path))
+
+
+def test_suite():
+    return unittest2.makeSuite(ConfigCacheTestCase)
+
+if __name__ == "__main__":
+    unittest2.main(defaultTest="test_suite")
@@ -0,0 +1,51 @@
+"""Tests for ryppl.depindex."""
+import os
+
+from ryppl.tests import unittest2, support
+from ryppl.depindex import DependencyIndex
+
+
+class DependencyIndexTestCase(support.TempdirManager, unittest2.TestCase):
+
+    def setUp(self):
+        super(DependencyIndexTestCase, self).setUp()
+        self.workspace = self.mkdtemp()
+        self.index = DependencyIndex(self.workspace)
+
+    def tearDown(self):
+        self.index.close()
+        super(DependencyIndexTestCase, self).tearDown()
+
+    def declare(self, project, text):
+        support.write_file(os.path.join(self.workspace, project, ".ryppl"),
+                           text)
+
+    def test_dependents(self):
+        self.declare("app", "depends libA:1.0 libB\n")
+        self.declare("libA", "depends libB:2.0\n")
+        self.declare("libB", "")
+        self.assertEqual(self.index.refresh(), ["app", "libA", "libB"])
+        self.assertEqual(self.index.dependents("libB"), ["app", "libA"])
+        self.assertEqual(self.index.dependents("libA", "1.0"), ["app"])
+        self.assertEqual(self.index.dependents("libB", "1.0"), ["app"])
+        self.assertEqual(self.index.refresh(), [])
+
+    def test_malformed_constraint(self):
+        self.declare("app", "depends libB\n")
+        self.declare("broken", "depends libB:>=1..0\n")
+        self.assertEqual(self.index.refresh(), ["app"])
+        self.assertEqual(sorted(self.index.problems), ["broken"])
+        self.assertEqual(self.index.dependents("libB"), ["app"])
+        self.assertEqual(self.index.refresh(), [])
+        self.assertEqual(sorted(self.index.problems), ["broken"])
+        self.declare("broken", "depends libB:1.0\n")
+        self.assertEqual(self.index.refresh(), ["broken"])
+        self.assertEqual(self.index.problems, {})
+        self.assertEqual(self.index.dependents("libB"), ["app", "broken"])
+
+
+def test_suite():
+    return unittest2.makeSuite(DependencyIndexTestCase)
+
+if __name__ == "__main__":
+    unittest2.main(defaultTest="test_suite")
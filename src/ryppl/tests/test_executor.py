@@ -0,0 +1,77 @@
+"""Tests for ryppl.executor."""
+import sys
+from cStringIO import StringIO
+
+from ryppl.tests import unittest2
+from ryppl.executor import run_projects, ProjectFailed
+
+
+class FakeGit:
+
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class RunProjectsTestCase(unittest2.TestCase):
+
+    def setUp(self):
+        self.gits = []
+        self.saved_stdout = sys.stdout
+        sys.stdout = StringIO()
+
+    def tearDown(self):
+        sys.stdout = self.saved_stdout
+
+    def make_git(self):
+        git = FakeGit()
+        self.gits.append(git)
+        return git
+
+    def run_projects(self, action, projects, jobs=2):
+        reported = []
+        results = run_projects(action, projects, self.make_git, jobs,
+                               reported.append)
+        return results, reported
+
+    def test_results_in_order(self):
+        def action(git, project):
+            print "running", project
+            if project == "b":
+                raise ProjectFailed("b is broken")
+            if project == "c":
+                raise ValueError("c")
+            return project.upper()
+        results, reported = self.run_projects(action, "abcd", jobs=3)
+        self.assertEqual([r.project for r in reported], list("abcd"))
+        self.assertEqual([r.ok() for r in results],
+                         [True, False, False, True])
+        self.assertEqual(results[0].value, "A")
+        self.assertEqual(results[0].output, "running a\n")
+        self.assertEqual(results[1].output, "running b\nb is broken\n")
+        self.assertTrue("ValueError" in results[2].output)
+        self.assertTrue(all(git.closed for git in self.gits))
+
+    def test_system_exit_is_raised_again(self):
+        def action(git, project):
+            if project == "b":
+                sys.exit(2)
+        stdout = sys.stdout
+        self.assertRaises(SystemExit, self.run_projects, action, "abcd")
+        self.assertTrue(sys.stdout is stdout)
+
+    def test_make_git_failure_is_raised(self):
+        def make_git():
+            raise KeyboardInterrupt
+        self.assertRaises(KeyboardInterrupt, run_projects,
+                          lambda git, project: None, "ab", make_git, 2,
+                          lambda result: None)
+
+
+def test_suite():
+    return unittest2.makeSuite(RunProjectsTestCase)
+
+if __name__ == "__main__":
+    unittest2.main(defaultTest="test_suite")
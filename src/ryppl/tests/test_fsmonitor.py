@@ -0,0 +1,54 @@
+"""Tests for ryppl.fsmonitor."""
+import os
+
+from ryppl.tests import unittest2, support
+from ryppl import fsmonitor
+
+
+class WatcherTestCase(support.TempdirManager, unittest2.TestCase):
+
+    def setUp(self):
+        super(WatcherTestCase, self).setUp()
+        if not fsmonitor.available():
+            self.skipTest("no inotify here")
+        self.tree = self.mkdtemp()
+        self.watcher = fsmonitor.Watcher(self.tree)
+
+    def tearDown(self):
+        os.close(self.watcher.fd)
+        super(WatcherTestCase, self).tearDown()
+
+    def touch(self, name):
+        support.write_file(os.path.join(self.tree, name), "x\n")
+        self.watcher.read()
+
+    def test_changed_since(self):
+        first = self.watcher.token()
+        self.touch("a")
+        second = self.watcher.token()
+        self.touch("b")
+        self.assertEqual(self.watcher.changed_since(first), ["a", "b"])
+        self.assertEqual(self.watcher.changed_since(second), ["b"])
+        self.assertEqual(self.watcher.changed_since("ryppl:x:1"), ["/"])
+
+    def test_compact(self):
+        old = self.watcher.token()
+        self.touch("a")
+        self.watcher.issued = [(t - 7200, seq)
+                               for t, seq in self.watcher.issued]
+        recent = self.watcher.token()
+        self.touch("b")
+        self.watcher.compact()
+        self.assertEqual(self.watcher.changes.keys(), ["b"])
+        self.assertEqual(self.watcher.changed_since(old), ["/"])
+        self.assertEqual(self.watcher.changed_since(recent), ["b"])
+        self.watcher.compact(lifetime=-1)
+        self.assertEqual(self.watcher.changes, {})
+        self.assertEqual(self.watcher.issued, [])
+
+
+def test_suite():
+    return unittest2.makeSuite(WatcherTestCase)
+
+if __name__ == "__main__":
+    unittest2.main(defaultTest="test_suite")
@@ -0,0 +1,48 @@
+"""Tests for ryppl.gitinfo."""
+import os
+
+from ryppl.tests import unittest2, support
+from ryppl.gitinfo import GitInfo, discover, parse_version
+
+# A stand-in for git that counts how often it was asked its version.
+FAKE_GIT = """#!/bin/sh
+echo run >> "$(dirname "$0")/runs"
+echo "git version 2.12.4.windows.1"
+"""
+
+
+class GitInfoTestCase(support.TempdirManager, unittest2.TestCase):
+
+    def test_parse_version(self):
+        self.assertEqual(parse_version("git version 2.39.5\n"), (2, 39, 5))
+        self.assertEqual(parse_version("git version 2.12.4.windows.1"),
+                         (2, 12, 4))
+        self.assertEqual(parse_version("command not found"), None)
+
+    def test_features(self):
+        info = GitInfo("/usr/bin/git", (2, 12, 4))
+        self.assertTrue(info.supports("porcelain-v2"))
+        self.assertFalse(info.supports("split-index"))
+        self.assertTrue(GitInfo("git", (2, 13)).supports("split-index"))
+        self.assertFalse(info.supports("no-such-feature"))
+
+    def test_discover_caches(self):
+        if os.name != "posix":
+            self.skipTest("the fake git is a shell script")
+        tmp = self.mkdtemp()
+        fake = os.path.join(tmp, "git")
+        support.write_file(fake, FAKE_GIT)
+        os.chmod(fake, 0755)
+        cache = os.path.join(tmp, "git.cache")
+        for i in range(2):
+            info = discover(fake, cache)
+            self.assertEqual((info.path, info.version), (fake, (2, 12, 4)))
+        self.assertEqual(open(os.path.join(tmp, "runs")).read(), "run\n")
+        self.assertEqual(discover(os.path.join(tmp, "nogit"), cache), None)
+
+
+def test_suite():
+    return unittest2.makeSuite(GitInfoTestCase)
+
+if __name__ == "__main__":
+    unittest2.main(defaultTest="test_suite")
@@ -0,0 +1,53 @@
+"""Tests for ryppl.gitpool."""
+import os
+
+from ryppl.tests import unittest2, support
+from ryppl.gitpool import GitPool
+
+
+class GitPoolTestCase(support.TempdirManager, unittest2.TestCase):
+
+    def setUp(self):
+        super(GitPoolTestCase, self).setUp()
+        self.repo = self.make_repo(files={"README": "hello\n" * 100})
+        support.git(self.repo, "repack", "-a", "-d", "-q")
+        self.pool = GitPool()
+
+    def tearDown(self):
+        self.pool.close()
+        super(GitPoolTestCase, self).tearDown()
+
+    def test_queries(self):
+        sha = support.git(self.repo, "rev-parse", "HEAD:README").strip()
+        self.assertEqual(self.pool.query(("rev-parse", "HEAD:README"),
+                                         self.repo), sha + "\n")
+        self.assertEqual(self.pool.query(("cat-file", "-s", sha),
+                                         self.repo), "600\n")
+        self.assertEqual(self.pool.query(("show", "HEAD:README"),
+                                         self.repo), "hello\n" * 100)
+
+    def test_workers_share_a_cache(self):
+        other = self.make_repo()
+        self.assertTrue(self.pool.worker(self.repo).cache is
+                        self.pool.worker(other).cache)
+
+    def test_truncated_pack(self):
+        sha = support.git(self.repo, "rev-parse", "HEAD:README").strip()
+        directory = os.path.join(self.repo, ".git", "objects", "pack")
+        for name in os.listdir(directory):
+            if name.endswith(".pack"):
+                f = open(os.path.join(directory, name), "r+b")
+                try:
+                    f.truncate(12)
+                finally:
+                    f.close()
+        worker = self.pool.worker(self.repo)
+        self.assertEqual(worker._local(sha), None)
+        self.assertEqual(worker._local(sha, whole=False), None)
+
+
+def test_suite():
+    return unittest2.makeSuite(GitPoolTestCase)
+
+if __name__ == "__main__":
+    unittest2.main(defaultTest="test_suite")
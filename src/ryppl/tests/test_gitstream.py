@@ -0,0 +1,79 @@
+"""Tests for Git.stream and GitStream, in ryppl.py."""
+import os
+import imp
+import time
+
+from ryppl.tests import unittest2, support
+
+SCRIPT = os.path.join(os.path.dirname(__file__), os.pardir, os.pardir,
+                      "ryppl.py")
+
+
+def alias(command):
+    """Arguments running the shell 'command' as a git alias."""
+    return ("-c", "alias.t=!" + command, "t")
+
+
+class GitStreamTestCase(support.TempdirManager, unittest2.TestCase):
+
+    def setUp(self):
+        super(GitStreamTestCase, self).setUp()
+        if not os.path.isfile(SCRIPT):
+            self.skipTest("ryppl.py isn't next to the ryppl package")
+        script = imp.load_source("ryppl_script", os.path.abspath(SCRIPT))
+        self.git = script.Git(pooled=False)
+        self.repo = self.make_repo()
+
+    def stream(self, *args, **kwargs):
+        kwargs.setdefault("cwd", self.repo)
+        return self.git.stream(*args, **kwargs)
+
+    def test_lines_as_they_come(self):
+        stream = self.stream(*alias("echo first; sleep 30; echo second"))
+        start = time.time()
+        lines = iter(stream)
+        self.assertEqual(lines.next(), "first\n")
+        self.assertTrue(time.time() - start < 10)
+
+        # Done with it early: git is stopped, not waited for.
+        stream.close()
+        self.assertTrue(time.time() - start < 10)
+        self.assertNotEqual(stream.returncode, 0)
+
+    def test_chunks(self):
+        for i in range(20):
+            self.commit(self.repo, {"README": "%d\n" % i})
+        expected = support.git(self.repo, "log", "--format=%H %s")
+        stream = self.stream("log", "--format=%H %s")
+        self.assertEqual("".join(stream.chunks(100)), expected)
+        self.assertEqual(stream.close(), 0)
+        self.assertEqual(stream.stderr, "")
+
+    def test_stderr_kept_apart(self):
+        stream = self.stream(*alias("echo out; echo err >&2; echo more"))
+        self.assertEqual(list(stream), ["out\n", "more\n"])
+        self.assertEqual(stream.returncode, 0)
+        self.assertEqual(stream.stderr, "err\n")
+
+    def test_req(self):
+        stream = self.stream("diff", "--quiet", req=1)
+        self.assertRaises(RuntimeError, list, stream)
+        self.assertEqual(stream.returncode, 0)
+
+        support.write_file(os.path.join(self.repo, "README"), "changed\n")
+        stream = self.stream("diff", "--quiet", req=1)
+        self.assertEqual(list(stream), [])
+        self.assertEqual(stream.close(), 1)
+
+    def test_failure_reported(self):
+        stream = self.stream("rev-parse", "--verify", "nowhere")
+        self.assertEqual(list(stream), [])
+        self.assertNotEqual(stream.returncode, 0)
+        self.assertTrue(stream.stderr.startswith("fatal:"), stream.stderr)
+
+
+def test_suite():
+    return unittest2.makeSuite(GitStreamTestCase)
+
+if __name__ == "__main__":
+    unittest2.main(defaultTest="test_suite")
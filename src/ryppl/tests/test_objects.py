@@ -0,0 +1,136 @@
+"""Tests for ryppl.objects, against what "git cat-file" says."""
+import os
+
+from ryppl.tests import unittest2, support
+from ryppl.objects import ObjectCache, ObjectReader, apply_delta
+
+
+class ObjectReaderTestCase(support.TempdirManager, unittest2.TestCase):
+
+    def setUp(self):
+        super(ObjectReaderTestCase, self).setUp()
+        self.repo = self.make_repo(files={"README": "hello\n",
+                                          "lib/a.txt": "a\n"})
+        # Revisions of one big file, so that packing deltifies it.
+        text = "".join("line %d\n" % i for i in range(2000))
+        for i in range(6):
+            text = text.replace("line %d\n" % (i * 300), "changed\n")
+            self.commit(self.repo, {"big.txt": text})
+        support.git(self.repo, "tag", "-a", "-m", "release", "v1")
+        self.reader = None
+
+    def tearDown(self):
+        if self.reader is not None:
+            self.reader.close()
+        super(ObjectReaderTestCase, self).tearDown()
+
+    def open_reader(self, cache=None):
+        self.reader = ObjectReader(os.path.join(self.repo, ".git"), cache)
+        return self.reader
+
+    def all_objects(self):
+        """{sha: (type, size)} according to git."""
+        found = {}
+        for line in support.git(self.repo, "cat-file", "--batch-check",
+                                "--batch-all-objects").splitlines():
+            sha, type, size = line.split()
+            found[sha] = (type, int(size))
+        return found
+
+    def check_all(self):
+        reader = self.open_reader()
+        objects = self.all_objects()
+        self.assertTrue(objects)
+        for sha, (type, size) in sorted(objects.items()):
+            self.assertEqual(reader.read_info(sha), (type, size))
+            data = support.git(self.repo, "cat-file", type, sha)
+            self.assertEqual(reader.read(sha), (type, data))
+        reader.close()
+
+    def deltas(self):
+        pack = [name for name in os.listdir(
+            os.path.join(self.repo, ".git", "objects", "pack"))
+                if name.endswith(".idx")][0]
+        verified = support.git(self.repo, "verify-pack", "-v", os.path.join(
+            self.repo, ".git", "objects", "pack", pack))
+        return [line for line in verified.splitlines()
+                if len(line.split()) == 7]  # "... depth base-sha"
+
+    def test_loose(self):
+        self.check_all()
+
+    def test_ofs_deltas(self):
+        support.git(self.repo, "repack", "-a", "-d", "-q")
+        self.assertTrue(self.deltas())
+        self.check_all()
+
+    def test_ref_deltas(self):
+        support.git(self.repo, "config", "repack.useDeltaBaseOffset",
+                    "false")
+        support.git(self.repo, "repack", "-a", "-d", "-q")
+        self.assertTrue(self.deltas())
+        self.check_all()
+
+    def test_lookup(self):
+        support.git(self.repo, "repack", "-a", "-d", "-q")
+        reader = self.open_reader()
+        for rev in ("HEAD", "v1", "v1^{}", "v1^{tree}", "HEAD:",
+                    "HEAD:big.txt", "v1:lib/a.txt", "master:lib"):
+            sha = support.git(self.repo, "rev-parse", rev).strip()
+            type = support.git(self.repo, "cat-file", "-t", sha).strip()
+            data = support.git(self.repo, "cat-file", type, sha)
+            self.assertEqual(reader.lookup(rev), (sha, type, data), rev)
+            self.assertEqual(reader.info(rev), (sha, type, len(data)), rev)
+        for rev in ("HEAD:nothing", "HEAD:README/x", "v1^{blob}",
+                    "HEAD~1", "nosuchref"):
+            self.assertEqual(reader.lookup(rev), None, rev)
+            self.assertEqual(reader.info(rev), None, rev)
+
+    def test_new_pack_noticed(self):
+        support.git(self.repo, "repack", "-a", "-d", "-q")
+        reader = self.open_reader()
+        self.commit(self.repo, {"new.txt": "new\n"})
+        support.git(self.repo, "repack", "-d", "-q")
+        sha = support.git(self.repo, "rev-parse", "HEAD:new.txt").strip()
+        self.assertEqual(reader.read(sha), ("blob", "new\n"))
+
+    def test_shared_cache(self):
+        support.git(self.repo, "repack", "-a", "-d", "-q")
+        clone = os.path.join(self.mkdtemp(), "clone")
+        support.git(os.path.dirname(clone), "clone", "-q", "--shared",
+                    self.repo, clone)
+        cache = ObjectCache(size=1024 * 1024)
+        first = self.open_reader(cache)
+        second = ObjectReader(os.path.join(clone, ".git"), cache)
+        try:
+            self.assertTrue(first._packs)
+            self.assertEqual([id(p) for p in second._packs],
+                             [id(p) for p in first._packs])
+            sha = support.git(self.repo, "rev-parse", "HEAD:big.txt").strip()
+            self.assertEqual(second.read(sha), first.read(sha))
+            self.assertTrue(cache._cached <= cache.size)
+        finally:
+            second.close()
+        # Still open for the other reader.
+        self.assertEqual(first.read(sha)[0], "blob")
+
+
+class DeltaTestCase(unittest2.TestCase):
+
+    def test_apply_delta(self):
+        base = "0123456789"
+        # Sizes 10 and 7; copy 4 bytes at 2, insert "xyz".
+        delta = "\x0a\x07" + "\x91\x02\x04" + "\x03xyz"
+        self.assertEqual(apply_delta(base, delta), "2345xyz")
+        self.assertRaises(ValueError, apply_delta, "short", delta)
+        self.assertRaises(ValueError, apply_delta, base, "\x0a\x07\x00")
+
+
+def test_suite():
+    suite = unittest2.TestSuite()
+    suite.addTest(unittest2.makeSuite(ObjectReaderTestCase))
+    suite.addTest(unittest2.makeSuite(DeltaTestCase))
+    return suite
+
+if __name__ == "__main__":
+    unittest2.main(defaultTest="test_suite")
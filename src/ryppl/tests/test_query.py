@@ -0,0 +1,245 @@
+"""Tests for ryppl.query."""
+import os
+
+from ryppl.tests import unittest2, support
+from ryppl import query
+
+
+class Stream:
+    """A finished command's output, handed out as ryppl.py's GitStream
+    does.
+    """
+
+    def __init__(self, output, returncode=0, stderr=""):
+        self.output = output
+        self.returncode = returncode
+        self.stderr = stderr
+
+    def chunks(self, size):
+        for i in range(0, len(self.output), size):
+            yield self.output[i:i + size]
+
+    def close(self):
+        return self.returncode
+
+
+class Git:
+    """Just enough of ryppl.py's Git for the queries; 'v2' is whether it
+    is new enough for porcelain v2.
+    """
+
+    def __init__(self, v2=True):
+        self.v2 = v2
+
+    def supports(self, feature):
+        return feature != "porcelain-v2" or self.v2
+
+    def git(self, *args, **kwargs):
+        try:
+            return support.git(kwargs.get("cwd") or os.curdir, *args)
+        except RuntimeError, e:
+            return str(e)
+
+    def stream(self, *args, **kwargs):
+        try:
+            return Stream(support.git(kwargs.get("cwd") or os.curdir,
+                                      *args))
+        except RuntimeError, e:
+            return Stream("", 128, str(e))
+
+
+class QueryTestCase(support.TempdirManager, unittest2.TestCase):
+
+    def setUp(self):
+        super(QueryTestCase, self).setUp()
+        # Records straddle blocks, as they do in long output.
+        self.block_size = query.BLOCK_SIZE
+        query.BLOCK_SIZE = 5
+        self.repo = self.make_repo(files={"a": "a\n" * 10, "b": "b\n"})
+
+    def tearDown(self):
+        query.BLOCK_SIZE = self.block_size
+        super(QueryTestCase, self).tearDown()
+
+    def head(self, repo=None):
+        return support.git(repo or self.repo, "rev-parse", "HEAD").strip()
+
+    def branch(self):
+        return support.git(self.repo, "symbolic-ref", "--short",
+                           "HEAD").strip()
+
+    def changed_clone(self):
+        """A clone of self.repo one commit ahead of it, with a rename,
+        a change, an untracked file and a submodule with a new commit.
+        """
+        clone = os.path.join(self.mkdtemp(), "clone")
+        support.git(self.repo, "clone", "--quiet", self.repo, clone)
+        support.git(clone, "clone", "--quiet", self.repo, "sub")
+        support.git(clone, "add", "sub")        # just the gitlink
+        support.git(clone, "commit", "--quiet", "-m", "sub")
+        self.commit(os.path.join(clone, "sub"), {"c": "c\n"})
+        support.git(clone, "mv", "a", "new name")
+        support.write_file(os.path.join(clone, "b"), "changed\n")
+        support.write_file(os.path.join(clone, "untracked"), "u\n")
+        return clone
+
+    def entries(self, status):
+        return dict((entry.path, (entry.xy, entry.orig, entry.submodule))
+                    for entry in status.entries)
+
+    def test_status_v2(self):
+        clone = self.changed_clone()
+        status = query.status(Git(), clone)
+        self.assertEqual(status.commit, self.head(clone))
+        self.assertEqual(status.branch, self.branch())
+        self.assertEqual(status.upstream, "origin/" + self.branch())
+        self.assertEqual((status.ahead, status.behind), (1, 0))
+        self.assertEqual(self.entries(status), {
+            "new name": ("R.", "a", "N..."),
+            "b": (".M", None, "N..."),
+            "sub": (".M", None, "SC.."),
+            "untracked": ("??", None, None)})
+        self.assertFalse(status.clean())
+
+        output = support.git(clone, "status", "-z", "--branch",
+                             "--porcelain=v2")
+        self.assertEqual(self.entries(query.parse_status(output)),
+                         self.entries(status))
+
+    def test_status_v1(self):
+        clone = self.changed_clone()
+        status = query.status(Git(v2=False), clone)
+        self.assertEqual(status.commit, self.head(clone))
+        self.assertEqual(status.branch, self.branch())
+        self.assertEqual(status.upstream, "origin/" + self.branch())
+        self.assertEqual((status.ahead, status.behind), (1, 0))
+        self.assertEqual(self.entries(status), {
+            "new name": ("R ", "a", None),
+            "b": (" M", None, None),
+            "sub": (" M", None, None),
+            "untracked": ("??", None, None)})
+
+    def test_behind(self):
+        clone = os.path.join(self.mkdtemp(), "clone")
+        support.git(self.repo, "clone", "--quiet", self.repo, clone)
+        self.commit(self.repo, {"b": "newer\n"})
+        self.commit(self.repo, {"b": "newest\n"})
+        support.git(clone, "fetch", "--quiet")
+        for git in (Git(), Git(v2=False)):
+            status = query.status(git, clone)
+            self.assertEqual((status.ahead, status.behind), (0, 2))
+            self.assertTrue(status.clean())
+
+    def test_unmerged(self):
+        branch = self.branch()
+        support.git(self.repo, "checkout", "--quiet", "-b", "other")
+        self.commit(self.repo, {"b": "theirs\n"})
+        support.git(self.repo, "checkout", "--quiet", branch)
+        self.commit(self.repo, {"b": "ours\n"})
+        self.assertRaises(RuntimeError, support.git, self.repo, "merge",
+                          "--quiet", "other")
+        self.assertEqual(self.entries(query.status(Git(), self.repo)),
+                         {"b": ("UU", None, "N...")})
+        self.assertEqual(
+            self.entries(query.status(Git(v2=False), self.repo)),
+            {"b": ("UU", None, None)})
+
+    def test_no_commits_and_detached(self):
+        empty = os.path.join(self.mkdtemp(), "empty")
+        support.git(os.path.dirname(empty), "init", "--quiet", empty)
+        support.write_file(os.path.join(empty, "new"), "new\n")
+        support.git(empty, "add", "new")
+        for git in (Git(), Git(v2=False)):
+            status = query.status(git, empty)
+            self.assertEqual(status.commit, None)
+            self.assertEqual(status.branch, self.branch())
+            self.assertEqual(status.upstream, None)
+            self.assertEqual(status.ahead, None)
+            self.assertEqual([e.xy for e in status.entries],
+                             [git.v2 and "A." or "A "])
+
+        support.git(self.repo, "checkout", "--quiet", "--detach")
+        for git in (Git(), Git(v2=False)):
+            status = query.status(git, self.repo)
+            self.assertEqual(status.commit, self.head())
+            self.assertEqual(status.branch, None)
+            self.assertTrue(status.clean())
+
+    def test_ignored(self):
+        support.write_file(os.path.join(self.repo, ".gitignore"), "*.o\n")
+        support.write_file(os.path.join(self.repo, "x.o"), "")
+        support.write_file(os.path.join(self.repo, "dir", "y"), "")
+        support.write_file(os.path.join(self.repo, "dir", "z"), "")
+        status = query.status(Git(), self.repo, ignored=True)
+        self.assertEqual(self.entries(status), {
+            ".gitignore": ("??", None, None),
+            "dir/": ("??", None, None),
+            "x.o": ("!!", None, None)})
+        status = query.status(Git(), self.repo, untracked="all")
+        self.assertEqual(sorted(self.entries(status)),
+                         [".gitignore", "dir/y", "dir/z"])
+
+    def test_rev_list(self):
+        first = self.head()
+        second = self.commit(self.repo, {"b": "2\n"})
+        third = self.commit(self.repo, {"a": "3\n"})
+        git = Git()
+        self.assertEqual(query.rev_list(git, ["HEAD"], cwd=self.repo),
+                         [third, second, first])
+        self.assertEqual(query.rev_list(git, ["HEAD"], paths=["b"],
+                                        cwd=self.repo),
+                         [second, first])
+        self.assertEqual(query.rev_list(git, [first + "..HEAD"],
+                                        max_count=1, cwd=self.repo),
+                         [third])
+        self.assertEqual(query.rev_list(git, ["HEAD", "^" + second],
+                                        parents=True, cwd=self.repo),
+                         [(third, (second,))])
+        self.assertEqual(query.rev_list(git, ["HEAD"], parents=True,
+                                        cwd=self.repo)[-1],
+                         (first, ()))
+        self.assertRaises(RuntimeError, query.rev_list, git, ["nowhere"],
+                          cwd=self.repo)
+
+    def test_for_each_ref(self):
+        head = self.head()
+        support.git(self.repo, "tag", "light")
+        support.git(self.repo, "tag", "-a", "-m", "x", "annotated")
+        support.git(self.repo, "branch", "topic")
+        annotated = support.git(self.repo, "rev-parse",
+                                "refs/tags/annotated").strip()
+        refs = query.for_each_ref(Git(), ["refs/tags"], cwd=self.repo)
+        self.assertEqual([(r.name, r.sha, r.type, r.peeled) for r in refs],
+                         [("refs/tags/annotated", annotated, "tag", head),
+                          ("refs/tags/light", head, "commit", None)])
+        self.assertEqual([r.target() for r in refs], [head, head])
+        names = [r.name for r in query.for_each_ref(Git(), cwd=self.repo)]
+        self.assertEqual(names, sorted(names))
+        self.assertTrue("refs/heads/topic" in names)
+
+    def test_ls_tree(self):
+        self.commit(self.repo, {"dir/with space": "x\n", "dir/sub/y": "y\n"})
+        git = Git()
+
+        def sha(path):
+            return support.git(self.repo, "rev-parse",
+                               "HEAD:" + path).strip()
+        self.assertEqual(query.ls_tree(git, "HEAD", cwd=self.repo), [
+            ("100644", "blob", sha("a"), "a"),
+            ("100644", "blob", sha("b"), "b"),
+            ("040000", "tree", sha("dir"), "dir")])
+        self.assertEqual(
+            query.ls_tree(git, "HEAD", ["dir"], recursive=True,
+                          cwd=self.repo),
+            [("100644", "blob", sha("dir/sub/y"), "dir/sub/y"),
+             ("100644", "blob", sha("dir/with space"), "dir/with space")])
+        output = support.git(self.repo, "ls-tree", "-z", "HEAD")
+        self.assertEqual(query.parse_ls_tree(output),
+                         query.ls_tree(git, "HEAD", cwd=self.repo))
+
+
+def test_suite():
+    return unittest2.makeSuite(QueryTestCase)
+
+if __name__ == "__main__":
+    unittest2.main(defaultTest="test_suite")
@@ -0,0 +1,84 @@
+"""Tests for ryppl.refs."""
+import os
+
+from ryppl.tests import unittest2, support
+from ryppl.refs import PackedRefs, list_refs, read_ref
+
+
+class PackedRefsTestCase(support.TempdirManager, unittest2.TestCase):
+
+    def setUp(self):
+        super(PackedRefsTestCase, self).setUp()
+        self.repo = self.make_repo()
+        self.gitdir = os.path.join(self.repo, ".git")
+        head = support.git(self.repo, "rev-parse", "HEAD").strip()
+        commands = ["create refs/tags/v1.%d %s\n" % (i, head)
+                    for i in range(150)]
+        commands += ["create refs/heads/topic/%d %s\n" % (i, head)
+                     for i in range(15)]
+        support.git(self.repo, "update-ref", "--stdin",
+                    input="".join(commands))
+        for i in range(3):              # with peeled lines
+            support.git(self.repo, "tag", "-a", "-m", "x", "annotated-%d" % i)
+        support.git(self.repo, "pack-refs", "--all")
+        self.path = os.path.join(self.gitdir, "packed-refs")
+
+    def git_refs(self, prefix):
+        output = support.git(self.repo, "for-each-ref",
+                             "--format=%(objectname) %(refname)", prefix)
+        return dict((name, sha) for sha, name in
+                    (line.split() for line in output.splitlines()))
+
+    def test_sorted(self):
+        packed = PackedRefs(self.path)
+        try:
+            self.assertTrue(packed.sorted)
+            for prefix in ("refs/", "refs/tags/", "refs/heads/",
+                           "refs/heads/topic/", "refs/nothing/"):
+                self.assertEqual(dict(packed.refs(prefix)),
+                                 self.git_refs(prefix), prefix)
+            tags = self.git_refs("refs/tags/")
+            # Any prefix, not just directories.
+            self.assertEqual(dict(packed.refs("refs/tags/v1.1")),
+                             dict((name, sha) for name, sha in tags.items()
+                                  if name.startswith("refs/tags/v1.1")))
+            self.assertEqual(packed.get("refs/tags/v1.1"),
+                             tags["refs/tags/v1.1"])
+            self.assertEqual(packed.get("refs/tags/v1"), None)
+            self.assertEqual(packed.get("refs/tags/zzz"), None)
+            self.assertEqual(packed.get("refs/aaa"), None)
+        finally:
+            packed.close()
+
+    def test_unsorted(self):
+        # As old gits wrote it: no header, so no binary search.
+        lines = open(self.path).read().splitlines()
+        records = [line for line in lines[1:] if not line.startswith("^")]
+        support.write_file(self.path, "\n".join(reversed(records)) + "\n")
+        packed = PackedRefs(self.path)
+        try:
+            self.assertFalse(packed.sorted)
+            self.assertEqual(dict(packed.refs("refs/tags/")),
+                             self.git_refs("refs/tags/"))
+        finally:
+            packed.close()
+
+    def test_loose_wins(self):
+        sha = self.commit(self.repo, {"README": "changed\n"})
+        support.git(self.repo, "update-ref", "refs/tags/v1.5", "HEAD")
+        self.assertEqual(read_ref(self.gitdir, "refs/tags/v1.5"), sha)
+        self.assertEqual(list_refs(self.gitdir, "refs/tags/"),
+                         self.git_refs("refs/tags/"))
+        self.assertEqual(read_ref(self.gitdir, "HEAD"), sha)
+
+    def test_no_packed_refs(self):
+        packed = PackedRefs(os.path.join(self.repo, "nothing"))
+        self.assertEqual(packed.refs("refs/"), [])
+        self.assertEqual(packed.get("refs/heads/master"), None)
+
+
+def test_suite():
+    return unittest2.makeSuite(PackedRefsTestCase)
+
+if __name__ == "__main__":
+    unittest2.main(defaultTest="test_suite")
@@ -0,0 +1,118 @@
+"""Tests for ryppl.releasability."""
+import os
+from cStringIO import StringIO
+
+from ryppl.tests import unittest2, support
+from ryppl.releasability import (ResultLog, ResultMatrix, _bits, _indices,
+                                 describe, evaluate, parse_markup)
+
+MARKUP = """<explicit-failures-markup>
+  <mark-toolset name="linux" status="required"/>
+  <library name="libX">
+    <mark-unusable>
+      <toolset name="old-mac*"/>
+      <note>needs a newer
+            compiler</note>
+    </mark-unusable>
+    <mark-expected-failures>
+      <test name="unicode_*"/>
+      <toolset name="win*"/>
+    </mark-expected-failures>
+    <test name="threads">
+      <mark-failure><toolset name="*"/></mark-failure>
+    </test>
+  </library>
+  <mark-expected-failures>
+    <slave name="macs"/>
+  </mark-expected-failures>
+</explicit-failures-markup>
+"""
+
+
+def matrix(*outcomes):
+    m = ResultMatrix()
+    for outcome in outcomes:
+        m.add(*outcome)
+    m.freeze()
+    return m
+
+
+class MarkupTestCase(unittest2.TestCase):
+
+    def setUp(self):
+        self.markup = parse_markup(StringIO(MARKUP))
+
+    def test_parse(self):
+        self.assertEqual(self.markup.required, ["linux"])
+        self.assertEqual([l.pattern for l in self.markup.libraries],
+                         ["libX", "*"])
+        self.assertEqual(describe(self.markup), [
+            "required slaves: linux",
+            "libX: unusable on old-mac* (needs a newer compiler)",
+            "libX: unicode_* expected to fail on win*",
+            "libX: threads expected to fail on *",
+            "all expected to fail on macs"])
+
+    def test_excused_failures(self):
+        verdict = evaluate(matrix(("libX", "basic", "linux", True),
+                                  ("libX", "threads", "linux", False),
+                                  ("libX", "unicode_a", "win7", False),
+                                  ("libX", "unicode_a", "linux", True),
+                                  ("libX", "basic", "old-mac1", False)),
+                           "libX", self.markup)
+        self.assertTrue(verdict.releasable())
+        self.assertEqual((verdict.cells, verdict.expected, verdict.unusable),
+                         (5, 2, 1))
+
+    def test_unexpected_failures(self):
+        verdict = evaluate(matrix(("libX", "basic", "linux", True),
+                                  ("libX", "unicode_a", "linux", False),
+                                  ("libX", "basic", "win7", False),
+                                  ("libY", "basic", "win7", False)),
+                           "libX", self.markup)
+        self.assertFalse(verdict.releasable())
+        self.assertEqual(sorted(verdict.failures),
+                         [("basic", "win7"), ("unicode_a", "linux")])
+
+    def test_required_slave_missing(self):
+        verdict = evaluate(matrix(("libX", "basic", "win7", True)),
+                           "libX", self.markup)
+        self.assertEqual(verdict.missing, ["linux"])
+        self.assertFalse(verdict.releasable())
+        self.assertFalse(evaluate(matrix(), "libX", self.markup).releasable())
+
+    def test_aliases(self):
+        outcomes = matrix(("libY", "basic", "linux", True),
+                          ("libY", "basic", "m1", False))
+        self.assertEqual(evaluate(outcomes, "libY", self.markup).failures,
+                         [("basic", "m1")])
+        verdict = evaluate(outcomes, "libY", self.markup,
+                           {"macs": ["m1", "m2"]})
+        self.assertTrue(verdict.releasable())
+
+    def test_bits(self):
+        for indices in ([], [0], [3, 7, 8, 64, 1000]):
+            self.assertEqual(_indices(_bits(indices, 1001)), indices)
+
+
+class ResultLogTestCase(support.TempdirManager, unittest2.TestCase):
+
+    def test_latest_wins(self):
+        log = ResultLog(os.path.join(self.mkdtemp(), "test-matrix"))
+        log.record("libX", "basic", "linux", False)
+        log.record("libX", "basic", "linux", True)
+        log.record("libX", "basic", "win7", False)
+        m = log.load()
+        self.assertEqual(len(m), 2)
+        self.assertEqual(_indices(m.passed), [0])
+        self.assertEqual(m.cell(1), ("libX", "basic", "win7"))
+
+
+def test_suite():
+    suite = unittest2.TestSuite()
+    suite.addTest(unittest2.makeSuite(MarkupTestCase))
+    suite.addTest(unittest2.makeSuite(ResultLogTestCase))
+    return suite
+
+if __name__ == "__main__":
+    unittest2.main(defaultTest="test_suite")
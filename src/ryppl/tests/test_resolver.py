@@ -0,0 +1,115 @@
+"""Tests for ryppl.resolver."""
+from ryppl.tests import unittest2
+from ryppl.resolver import (PackageIndex, ResolutionError, resolve, allows,
+                            parse_constraint, parse_depends,
+                            parse_requirements)
+
+
+def requirements(*words):
+    return parse_requirements(words)
+
+
+class CountingIndex(PackageIndex):
+    """A PackageIndex that remembers which versions' dependencies the
+    resolver looked at.
+    """
+
+    def __init__(self, packages):
+        PackageIndex.__init__(self)
+        self.looked_at = []
+        for name, versions in packages.items():
+            self.add(name, dict((version, requirements(*depends))
+                                for version, depends in versions.items()))
+
+    def dependencies(self, name, i):
+        self.looked_at.append((name, self.versions(name)[i]))
+        return PackageIndex.dependencies(self, name, i)
+
+
+class ConstraintTestCase(unittest2.TestCase):
+
+    def test_allows(self):
+        constraint = parse_constraint("1.0-2.2,3.1")
+        for version in ("1.0", "1.5", "2.2", "2.2.0", "3.1"):
+            self.assertTrue(allows(constraint, version), version)
+        for version in ("0.9", "2.3", "3.0", "3.1.1"):
+            self.assertFalse(allows(constraint, version), version)
+
+    def test_open_ends(self):
+        self.assertTrue(allows(parse_constraint("2.0-"), "17.0"))
+        self.assertFalse(allows(parse_constraint("-2.0"), "2.1"))
+        self.assertTrue(allows(parse_constraint(""), "0.1"))
+        self.assertTrue(parse_constraint("") is None)
+
+    def test_parse_depends(self):
+        found = parse_depends("# libraries\n"
+                              "depends libX:1.0-2.2,3.1 libY\n"
+                              "test-modules x.tests\n"
+                              "depends libC  # any\n")
+        self.assertEqual([(name, constraint and str(constraint))
+                          for name, constraint in found],
+                         [("libX", "1.0-2.2,3.1"), ("libY", None),
+                          ("libC", None)])
+
+
+class ResolveTestCase(unittest2.TestCase):
+
+    def test_newest(self):
+        index = CountingIndex({"a": {"1.0": [], "1.10": [], "1.9": []}})
+        self.assertEqual(resolve(requirements("a"), index), {"a": "1.10"})
+        self.assertEqual(resolve(requirements("a:-1.9"), index),
+                         {"a": "1.9"})
+
+    def test_dependencies(self):
+        index = CountingIndex({
+            "app": {"1.0": ["lib:2.0-"]},
+            "lib": {"1.0": [], "2.0": ["base:1.0"], "3.0": ["base:2.0"]},
+            "base": {"1.0": [], "2.0": []},
+        })
+        self.assertEqual(resolve(requirements("app", "base:1.0"), index),
+                         {"app": "1.0", "lib": "2.0", "base": "1.0"})
+
+    def test_backjump_skips_unrelated_choices(self):
+        # Every version of b conflicts with a 2.0, which was picked
+        # before the many versions of x; only a's choice can help.
+        x = dict(("1.%d" % i, []) for i in range(20))
+        index = CountingIndex({
+            "a": {"1.0": [], "2.0": []},
+            "x": x,
+            "b": {"1.0": ["a:1.0"], "1.1": ["a:1.0"]},
+        })
+        found = resolve(requirements("a", "x", "b"), index)
+        self.assertEqual(found, {"a": "1.0", "x": "1.19", "b": "1.1"})
+        tried = set(version for name, version in index.looked_at
+                    if name == "x")
+        self.assertEqual(tried, set(["1.19"]))
+
+    def test_learned_conflict(self):
+        index = CountingIndex({
+            "a": {"1.0": ["c:1.0"], "2.0": ["c:2.0"]},
+            "b": {"1.0": ["c:1.0"], "2.0": ["c:1.0"]},
+            "c": {"1.0": [], "2.0": []},
+        })
+        self.assertEqual(resolve(requirements("a", "b"), index),
+                         {"a": "1.0", "b": "2.0", "c": "1.0"})
+
+    def test_impossible(self):
+        index = CountingIndex({
+            "a": {"1.0": ["c:1.0"]},
+            "b": {"1.0": ["c:2.0"], "2.0": ["c:2.0-"]},
+            "c": {"1.0": [], "2.0": []},
+        })
+        self.assertRaises(ResolutionError, resolve,
+                          requirements("a", "b"), index)
+        self.assertRaises(ResolutionError, resolve,
+                          requirements("a:2.0-"), index)
+
+
+def test_suite():
+    suite = unittest2.TestSuite()
+    suite.addTest(unittest2.makeSuite(ConstraintTestCase))
+    suite.addTest(unittest2.makeSuite(ResolveTestCase))
+    return suite
+
+if __name__ == "__main__":
+    unittest2.main(defaultTest="test_suite")
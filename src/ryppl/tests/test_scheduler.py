@@ -0,0 +1,121 @@
+"""Tests for ryppl.scheduler."""
+import time
+import threading
+
+from ryppl.tests import unittest2
+from ryppl.scheduler import (LocalSlave, Scheduler, Shard, Slave, expand,
+                             parse_aliases)
+
+
+class FailingSlave(Slave):
+    """A slave that fails 'delay' seconds into its first shard."""
+
+    def __init__(self, key, delay=0.0, capacity=1):
+        Slave.__init__(self, key, capacity)
+        self.delay = delay
+        self.tried = []
+
+    def run(self, shard):
+        self.tried.append(shard.name)
+        time.sleep(self.delay)
+        raise RuntimeError("slave gone")
+
+
+def passing(shard):
+    return True
+
+
+class AliasTestCase(unittest2.TestCase):
+
+    def test_expand(self):
+        aliases = parse_aliases("troymac: 19fa345c9732d5  # Troy's\n"
+                                "mac: troymac, 9a1f3c7923dc\n"
+                                "default: mac, linux1\n")
+        self.assertEqual(expand([], aliases),
+                         ["19fa345c9732d5", "9a1f3c7923dc", "linux1"])
+        self.assertEqual(expand(["linux1", "mac", "troymac"], aliases),
+                         ["linux1", "19fa345c9732d5", "9a1f3c7923dc"])
+
+    def test_cycle(self):
+        aliases = parse_aliases("a: b\nb: c, a\n")
+        self.assertRaises(ValueError, expand, ["a"], aliases)
+
+
+class SchedulerTestCase(unittest2.TestCase):
+
+    def scheduler(self, slaves, costs={}):
+        scheduler = Scheduler(slaves, history=False)
+        scheduler.costs.update(costs)
+        return scheduler
+
+    def test_plan_largest_first_to_earliest_finish(self):
+        fast = LocalSlave("fast", passing)
+        slow = LocalSlave("slow", passing)
+        scheduler = self.scheduler([fast, slow],
+                                   {"a": 30.0, "b": 20.0, "c": 10.0})
+        scheduler.throughputs["fast"] = scheduler.states[0].throughput = 3.0
+        plan = scheduler.plan([Shard(n) for n in "abc"])
+        self.assertEqual(sorted(s.name for s in plan["fast"]), ["a", "b"])
+        self.assertEqual([s.name for s in plan["slow"]], ["c"])
+
+    def test_runs_everything(self):
+        slaves = [LocalSlave("a", passing, capacity=2),
+                  LocalSlave("b", passing)]
+        reported = []
+        outcomes = self.scheduler(slaves).run(
+            [Shard("s%d" % i) for i in range(7)], reported.append)
+        self.assertEqual(len(reported), 7)
+        self.assertEqual([o.shard.name for o in outcomes],
+                         ["s%d" % i for i in range(7)])
+        self.assertTrue(all(o.value is True and o.error is None
+                            for o in outcomes))
+
+    def test_failed_slave_after_others_went_idle(self):
+        # a finishes its shard at once; b fails later, and its shard
+        # must still go to a.
+        a = LocalSlave("a", passing)
+        b = FailingSlave("b", delay=0.2)
+        outcomes = self.scheduler([a, b]).run([Shard("s0"), Shard("s1")])
+        self.assertEqual(b.tried, ["s1"])
+        self.assertEqual([(o.slave, o.value, o.error) for o in outcomes],
+                         [("a", True, None), ("a", True, None)])
+
+    def test_every_slave_fails(self):
+        slaves = [FailingSlave("a"), FailingSlave("b", delay=0.1)]
+        outcomes = self.scheduler(slaves).run([Shard("s0"), Shard("s1"),
+                                               Shard("s2")])
+        self.assertTrue(all(o.error is not None and o.slave is None
+                            for o in outcomes))
+
+    def test_idle_slave_steals(self):
+        release = threading.Event()
+        def slow(shard):
+            if shard.name == "a":
+                release.wait(5)
+            return True
+        busy = LocalSlave("busy", slow)
+        idle = LocalSlave("idle", passing)
+        costs = {"a": 50.0, "b": 40.0, "c": 20.0, "d": 10.0}
+        plan = self.scheduler([busy, idle], costs).plan(
+            [Shard(n) for n in "abcd"])
+        self.assertEqual([s.name for s in plan["busy"]], ["a", "d"])
+        scheduler = self.scheduler([busy, idle], costs)
+        shards = [Shard(n) for n in "abcd"]
+        timer = threading.Timer(0.3, release.set)
+        timer.start()
+        try:
+            outcomes = scheduler.run(shards)
+        finally:
+            timer.cancel()
+        self.assertEqual([o.slave for o in outcomes],
+                         ["busy", "idle", "idle", "idle"])
+
+
+def test_suite():
+    suite = unittest2.TestSuite()
+    suite.addTest(unittest2.makeSuite(AliasTestCase))
+    suite.addTest(unittest2.makeSuite(SchedulerTestCase))
+    return suite
+
+if __name__ == "__main__":
+    unittest2.main(defaultTest="test_suite")
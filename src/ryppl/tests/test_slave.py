@@ -0,0 +1,71 @@
+"""Tests for ryppl.slave."""
+import os
+import sys
+import subprocess
+from cStringIO import StringIO
+
+from ryppl.tests import unittest2, support
+from ryppl.scheduler import Shard
+from ryppl.slave import SpoolSlave, capacity, daemons
+
+
+class FakeGit:
+
+    def git(self, *args, **kwargs):
+        return "c" * 40 + "\n"
+
+
+class SpoolSlaveTestCase(support.TempdirManager, unittest2.TestCase):
+
+    def setUp(self):
+        super(SpoolSlaveTestCase, self).setUp()
+        self.spool = self.mkdtemp()
+
+    def register(self, pid, concurrency):
+        support.write_file(os.path.join(self.spool, "daemons", str(pid)),
+                           "%d\n" % concurrency)
+
+    def dead_pid(self):
+        p = subprocess.Popen([sys.executable, "-c", "pass"])
+        p.wait()
+        return p.pid
+
+    def test_dead_daemons_are_pruned(self):
+        dead = self.dead_pid()
+        self.register(dead, 4)
+        self.register(os.getpid(), 2)
+        self.assertEqual(daemons(self.spool), {os.getpid(): 2})
+        self.assertEqual(capacity(self.spool), 2)
+        self.assertFalse(os.path.exists(
+            os.path.join(self.spool, "daemons", str(dead))))
+
+    def test_refused_without_daemon(self):
+        self.register(self.dead_pid(), 4)
+        self.assertRaises(ValueError, SpoolSlave, "k", FakeGit(), self.spool)
+
+    def run_shard(self, slave):
+        saved = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            return slave.run(Shard("p", self.mkdtemp()))
+        finally:
+            sys.stdout = saved
+
+    def test_gives_up_when_daemon_dies(self):
+        self.register(os.getpid(), 1)   # pretend we serve it, for now
+        slave = SpoolSlave("k", FakeGit(), self.spool)
+        os.remove(os.path.join(self.spool, "daemons", str(os.getpid())))
+        self.assertRaises(RuntimeError, self.run_shard, slave)
+        self.assertEqual(os.listdir(os.path.join(self.spool, "queue")), [])
+
+    def test_deadline(self):
+        self.register(os.getpid(), 1)
+        slave = SpoolSlave("k", FakeGit(), self.spool, timeout=0.3)
+        self.assertRaises(RuntimeError, self.run_shard, slave)
+
+
+def test_suite():
+    return unittest2.makeSuite(SpoolSlaveTestCase)
+
+if __name__ == "__main__":
+    unittest2.main(defaultTest="test_suite")
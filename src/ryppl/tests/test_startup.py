@@ -0,0 +1,87 @@
+"""Tests that 'ryppl help' and shell completion start quickly: they must
+not import the commands (or what those need) and must stay within a
+budget of time over bare interpreter startup.
+"""
+import os
+import sys
+import time
+import subprocess
+
+from ryppl.tests import unittest2
+
+SCRIPT = os.path.join(os.path.dirname(__file__), os.pardir, os.pardir,
+                      "ryppl.py")
+
+# How much longer than "python -c pass" starting up may take, in seconds.
+BUDGET = 0.05
+
+# Run ryppl.py's main() as the script would, then list what got imported.
+_PROBE = """
+import sys
+sys.argv = [%(script)r] + %(args)r
+sys.path.insert(0, %(dir)r)
+import imp
+imp.load_source("ryppl_script", %(script)r).main()
+sys.stderr.write(" ".join(sorted(sys.modules)))
+"""
+
+
+def _run(args):
+    p = subprocess.Popen([sys.executable] + args, stdout=subprocess.PIPE,
+                         stderr=subprocess.PIPE)
+    out, err = p.communicate()
+    return p.returncode, out, err
+
+
+def _best_time(args, runs=5):
+    best = None
+    for i in range(runs):
+        start = time.time()
+        _run(args)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+class StartupTestCase(unittest2.TestCase):
+
+    def setUp(self):
+        if not os.path.isfile(SCRIPT):
+            self.skipTest("ryppl.py isn't next to the ryppl package")
+
+    def imported(self, args):
+        code = _PROBE % {"script": os.path.abspath(SCRIPT), "args": args,
+                         "dir": os.path.dirname(os.path.abspath(SCRIPT))}
+        rv, out, err = _run(["-c", code])
+        self.assertEqual(rv, 0, err)
+        return out, set(err.split())
+
+    def test_complete_imports_nothing(self):
+        out, modules = self.imported(["--complete", "re"])
+        self.assertEqual(out.split(), ["release", "remote-test"])
+        for name in ("commands", "ryppl", "optparse", "tempfile"):
+            self.assertFalse(name in modules, name)
+
+    def test_help_doesnt_load_git(self):
+        out, modules = self.imported(["help"])
+        self.assertTrue("install" in out)
+        for name in ("ryppl", "ryppl.gitinfo", "optparse", "tempfile"):
+            self.assertFalse(name in modules, name)
+
+    def test_budget(self):
+        bare = _best_time(["-c", "pass"])
+        for args in (["--complete", "re"], ["help"]):
+            took = _best_time([SCRIPT] + args)
+            self.assertTrue(took - bare < BUDGET,
+                            "ryppl %s took %.0fms over interpreter startup "
+                            "(budget %.0fms)" % (" ".join(args),
+                                                  (took - bare) * 1000,
+                                                  BUDGET * 1000))
+
+
+def test_suite():
+    return unittest2.makeSuite(StartupTestCase)
+
+if __name__ == "__main__":
+    unittest2.main(defaultTest="test_suite")
@@ -0,0 +1,137 @@
+"""Tests for ryppl.stateindex."""
+import os
+import shutil
+
+from ryppl.tests import unittest2, support
+from ryppl.stateindex import StateIndex, stamps
+
+
+class Git:
+    """Just enough of ryppl.py's Git for a StateIndex, counting the
+    commands it runs.
+    """
+
+    def __init__(self):
+        self.calls = 0
+
+    def git(self, *args, **kwargs):
+        self.calls += 1
+        return support.git(kwargs.get("cwd") or os.curdir, *args)
+
+
+class StateIndexTestCase(support.TempdirManager, unittest2.TestCase):
+
+    def setUp(self):
+        super(StateIndexTestCase, self).setUp()
+        self.root = self.mkdtemp()
+        self.libX = self.make_repo(os.path.join(self.root, "libX"))
+        self.libY = self.make_repo(os.path.join(self.root, "libY"))
+        self.git = Git()
+        self.index = StateIndex(self.git, self.root)
+        self.assertEqual(self.index.refresh(), ["libX", "libY"])
+        self.examined = []
+        examine = self.index._examine
+
+        def counting(project, gitdir, previous):
+            self.examined.append(os.path.basename(project))
+            return examine(project, gitdir, previous)
+        self.index._examine = counting
+
+    def sha(self, repo, rev="HEAD"):
+        return support.git(repo, "rev-parse", rev).strip()
+
+    def test_examined(self):
+        info = self.index.get(self.libX)
+        self.assertEqual(info.commit, self.sha(self.libX))
+        self.assertEqual(info.tree, self.sha(self.libX, "HEAD^{tree}"))
+        self.assertEqual(info.branch,
+                         support.git(self.libX, "symbolic-ref", "--short",
+                                     "HEAD").strip())
+        self.assertEqual(info.remote, None)
+        self.assertEqual(self.index.get(os.path.join(self.root, "other")),
+                         None)
+
+    def test_unchanged_entries_are_reused(self):
+        calls = self.git.calls
+        self.assertEqual(self.index.refresh(), [])
+        self.assertEqual(self.examined, [])
+        self.assertEqual(self.git.calls, calls)
+        # ...by the next run too.
+        index = StateIndex(self.git, self.root)
+        self.assertEqual(index.refresh(), [])
+        self.assertEqual(self.git.calls, calls)
+        self.assertEqual(index.get(self.libY).values(),
+                         self.index.get(self.libY).values())
+
+    def test_stamps(self):
+        gitdir = os.path.join(self.libX, ".git")
+        before = stamps(self.libX, gitdir)
+        self.assertEqual(stamps(self.libX, gitdir), before)
+        support.git(self.libX, "pack-refs", "--all")
+        self.assertNotEqual(stamps(self.libX, gitdir), before)
+
+    def test_commit(self):
+        commit = self.commit(self.libX, {"README": "changed\n"})
+        self.assertEqual(self.index.refresh(), ["libX"])
+        self.assertEqual(self.examined, ["libX"])
+        info = self.index.get(self.libX)
+        self.assertEqual(info.commit, commit)
+        self.assertEqual(info.tree, self.sha(self.libX, "HEAD^{tree}"))
+
+    def test_new_branch(self):
+        support.git(self.libX, "checkout", "--quiet", "-b", "topic")
+        calls = self.git.calls
+        self.assertEqual(self.index.refresh(), ["libX"])
+        self.assertEqual(self.index.get(self.libX).branch, "topic")
+        # Same commit, so same tree: git wasn't asked for it again.
+        self.assertEqual(self.git.calls, calls)
+
+    def test_commit_packed_away(self):
+        commit = self.commit(self.libX, {"README": "changed\n"})
+        support.git(self.libX, "pack-refs", "--all")
+        self.assertEqual(self.index.refresh(), ["libX"])
+        self.assertEqual(self.index.get(self.libX).commit, commit)
+        # Packing alone changes nothing the index holds.
+        support.git(self.libY, "pack-refs", "--all")
+        self.assertEqual(self.index.refresh(), [])
+        self.assertEqual(self.examined, ["libX", "libY"])
+
+    def test_depends_edited(self):
+        info = self.index.get(self.libX)
+        support.write_file(os.path.join(self.libX, ".ryppl"),
+                           "depends libY\n")
+        calls = self.git.calls
+        self.assertEqual(self.index.refresh(), ["libX"])
+        self.assertNotEqual(self.index.get(self.libX).depends, info.depends)
+        self.assertEqual(self.git.calls, calls)
+
+    def test_detached(self):
+        support.git(self.libX, "checkout", "--quiet", "--detach")
+        self.assertEqual(self.index.refresh(), ["libX"])
+        info = self.index.get(self.libX)
+        self.assertEqual(info.branch, None)
+        self.assertEqual(info.commit, self.sha(self.libX))
+        self.assertEqual(info.tree, self.sha(self.libX, "HEAD^{tree}"))
+
+    def test_no_commits(self):
+        path = os.path.join(self.root, "libZ")
+        support.git(self.root, "init", "--quiet", path)
+        self.assertEqual(self.index.refresh(), ["libZ"])
+        info = self.index.get(path)
+        self.assertEqual((info.commit, info.tree), (None, None))
+        self.assertNotEqual(info.branch, None)
+
+    def test_removed(self):
+        shutil.rmtree(self.libY)
+        self.assertEqual(self.index.refresh(), ["libY"])
+        self.assertEqual(self.index.get(self.libY), None)
+        self.assertEqual(sorted(self.index.entries), ["libX"])
+        self.assertEqual(sorted(StateIndex(self.git, self.root).entries),
+                         ["libX"])
+
+
+def test_suite():
+    return unittest2.makeSuite(StateIndexTestCase)
+
+if __name__ == "__main__":
+    unittest2.main(defaultTest="test_suite")
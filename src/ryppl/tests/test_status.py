@@ -0,0 +1,61 @@
+"""Tests for ryppl.status."""
+import os
+
+from ryppl.tests import unittest2, support
+from ryppl.status import configure
+from ryppl.util import read_git_config
+
+
+class Git:
+    """A git that has the untracked cache and split index only."""
+
+    def supports(self, feature):
+        return feature in ("untracked-cache", "split-index")
+
+    def git(self, *args, **kwargs):
+        return support.git(kwargs.get("cwd") or os.curdir, *args)
+
+
+class ConfigureTestCase(support.TempdirManager, unittest2.TestCase):
+
+    def setUp(self):
+        super(ConfigureTestCase, self).setUp()
+        self.home = os.environ.get("HOME")
+        os.environ["HOME"] = self.mkdtemp()
+        self.repo = self.make_repo()
+
+    def tearDown(self):
+        if self.home is None:
+            del os.environ["HOME"]
+        else:
+            os.environ["HOME"] = self.home
+        super(ConfigureTestCase, self).tearDown()
+
+    def config(self):
+        return read_git_config(self.repo)
+
+    def test_left_alone_unless_asked(self):
+        before = self.config()
+        self.assertFalse(configure(Git(), self.repo))
+        self.assertEqual(self.config(), before)
+
+    def test_opted_in(self):
+        support.git(self.repo, "config", "ryppl.fastStatus", "true")
+        support.git(self.repo, "config", "core.untrackedCache", "false")
+        self.assertFalse(configure(Git(), self.repo))
+        config = self.config()
+        self.assertEqual(config["core.untrackedcache"], "false")
+        self.assertEqual(config["core.splitindex"], "true")
+
+    def test_opted_in_globally(self):
+        support.write_file(os.path.join(os.environ["HOME"], ".gitconfig"),
+                           "[ryppl]\n\tfastStatus = yes\n")
+        configure(Git(), self.repo)
+        self.assertEqual(self.config()["core.splitindex"], "true")
+
+
+def test_suite():
+    return unittest2.makeSuite(ConfigureTestCase)
+
+if __name__ == "__main__":
+    unittest2.main(defaultTest="test_suite")
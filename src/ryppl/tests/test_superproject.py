@@ -0,0 +1,165 @@
+"""Tests for ryppl.superproject."""
+import os
+from StringIO import StringIO
+
+from ryppl.tests import unittest2, support
+from ryppl.superproject import Superproject, print_table, resolve_url
+
+
+class Info:
+    """A ryppl.gitinfo.GitInfo of a git with or without porcelain v2."""
+
+    def __init__(self, v2):
+        self.v2 = v2
+
+    def supports(self, feature):
+        return feature == "porcelain-v2" and self.v2
+
+
+class ResolveURLTestCase(unittest2.TestCase):
+
+    def test_scheme(self):
+        base = "git://example.org/group/super.git"
+        self.assertEqual(resolve_url(base, "../lib.git"),
+                         "git://example.org/group/lib.git")
+        self.assertEqual(resolve_url(base, "./lib.git"),
+                         "git://example.org/group/super.git/lib.git")
+        self.assertEqual(resolve_url(base + "/", "../../lib.git"),
+                         "git://example.org/lib.git")
+        # Never above the host.
+        self.assertEqual(resolve_url(base, "../../../lib.git"),
+                         "git://example.org/lib.git")
+
+    def test_path(self):
+        base = "/srv/git/group/super"
+        self.assertEqual(resolve_url(base, "../lib"), "/srv/git/group/lib")
+        self.assertEqual(resolve_url(base, "./sub/lib"),
+                         "/srv/git/group/super/sub/lib")
+        self.assertEqual(resolve_url(base, "../../other/./lib"),
+                         "/srv/git/other/lib")
+
+    def test_absolute(self):
+        for url in ("git://example.org/lib.git", "/srv/git/lib", "lib"):
+            self.assertEqual(resolve_url("git://example.org/super", url),
+                             url)
+
+
+class SuperprojectTestCase(support.TempdirManager, unittest2.TestCase):
+
+    def setUp(self):
+        super(SuperprojectTestCase, self).setUp()
+        tmp = self.mkdtemp()
+        self.libs = {}
+        for name in ("libA", "libB"):
+            self.libs[name] = self.make_repo(os.path.join(tmp, name))
+        upstream = self.make_repo(os.path.join(tmp, "super"))
+        gitmodules = ""
+        for name in sorted(self.libs):
+            path = "libs/" + name
+            support.git(upstream, "update-index", "--add", "--cacheinfo",
+                        "160000,%s,%s" % (self.head(self.libs[name]), path))
+            gitmodules += ('[submodule "%s"]\n\tpath = %s\n\turl = ../%s\n'
+                           % (name, path, name))
+        support.git(upstream, "update-index", "--add", "--cacheinfo",
+                    "160000,%s,stray" % self.head(self.libs["libA"]))
+        # Not commit(): "add --all" would drop gitlinks without a clone.
+        support.write_file(os.path.join(upstream, ".gitmodules"), gitmodules)
+        support.git(upstream, "add", ".gitmodules")
+        support.git(upstream, "commit", "--quiet", "-m", "submodules")
+        self.path = os.path.join(tmp, "work")
+        support.git(tmp, "clone", "--quiet", upstream, self.path)
+
+    def head(self, repo):
+        return support.git(repo, "rev-parse", "HEAD").strip()
+
+    def states(self, submodules):
+        return [(s.path, s.state, s.detail) for s in submodules]
+
+    def test_submodules(self):
+        found = Superproject(self.path).submodules()
+        self.assertEqual([(s.name, s.path, s.url, s.commit) for s in found], [
+            ("libA", "libs/libA", self.libs["libA"],
+             self.head(self.libs["libA"])),
+            ("libB", "libs/libB", self.libs["libB"],
+             self.head(self.libs["libB"])),
+            ("stray", "stray", None, self.head(self.libs["libA"]))])
+
+    def check_transitions(self, v2):
+        superproject = Superproject(self.path, info=Info(v2))
+        self.assertEqual(self.states(superproject.status()), [
+            ("libs/libA", "missing", ""),
+            ("libs/libB", "missing", ""),
+            ("stray", "unknown", "not in .gitmodules")])
+
+        self.assertEqual(self.states(superproject.checkout()), [
+            ("libs/libA", "ok", ""),
+            ("libs/libB", "ok", ""),
+            ("stray", "unknown", "not in .gitmodules")])
+        libA = os.path.join(self.path, "libs", "libA")
+        self.assertEqual(self.head(libA), self.head(self.libs["libA"]))
+
+        support.write_file(os.path.join(libA, "README"), "changed\n")
+        support.write_file(os.path.join(libA, "new"), "new\n")
+        states = self.states(superproject.status())
+        self.assertEqual(states[0], ("libs/libA", "modified",
+                                     "2 changed files"))
+        self.assertEqual(states[1], ("libs/libB", "ok", ""))
+
+        moved = self.commit(libA, {})
+        states = self.states(superproject.status())
+        self.assertEqual(states[0], ("libs/libA", "moved",
+                                     "at %s" % moved[:10]))
+
+        # Back where the superproject wants it.
+        self.assertEqual(self.states(superproject.checkout())[0],
+                         ("libs/libA", "ok", ""))
+
+    def test_transitions(self):
+        self.check_transitions(v2=True)
+
+    def test_transitions_without_porcelain_v2(self):
+        self.check_transitions(v2=False)
+
+    def test_connections_are_shared(self):
+        superproject = Superproject(self.path, connections=1)
+        runner_git = superproject.runner.git
+        network = []
+
+        def git(*args, **kwargs):
+            call = runner_git(*args, **kwargs)
+            if args[0] in ("clone", "fetch"):
+                # Only once the one before is done.
+                self.assertEqual([c for c in network if not c.done()], [])
+                network.append(call)
+            return call
+        superproject.runner.git = git
+        states = self.states(superproject.checkout())
+        self.assertEqual([state for path, state, detail in states],
+                         ["ok", "ok", "unknown"])
+        self.assertEqual([c.args[0] for c in network], ["clone", "clone"])
+        self.assertEqual(superproject._online, 0)
+        self.assertEqual(superproject._waiting, [])
+
+    def test_print_table(self):
+        superproject = Superproject(self.path)
+        submodules = superproject.checkout()
+        submodules[1].state = "failed"
+        submodules[1].detail = "fatal: no\nmore"
+        stream = StringIO()
+        print_table(submodules, stream)
+        a, b = [s.commit[:10] for s in submodules[:2]]
+        self.assertEqual(stream.getvalue(),
+                         "libs/libA  %s  ok\n"
+                         "libs/libB  %s  failed   fatal: no\n"
+                         "stray      %s  unknown  not in .gitmodules\n"
+                         "3 submodules: 1 failed, 1 ok, 1 unknown\n"
+                         % (a, b, a))
+
+
+def test_suite():
+    suite = unittest2.makeSuite(ResolveURLTestCase)
+    suite.addTest(unittest2.makeSuite(SuperprojectTestCase))
+    return suite
+
+if __name__ == "__main__":
+    unittest2.main(defaultTest="test_suite")
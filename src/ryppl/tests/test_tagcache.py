@@ -0,0 +1,124 @@
+"""Tests for ryppl.tagcache."""
+import os
+import sqlite3
+import threading
+
+from ryppl.tests import unittest2, support
+from ryppl import tagcache
+from ryppl.tagcache import TagCache, parse_ls_remote
+
+LS_REMOTE = """\
+1111111111111111111111111111111111111111\trefs/tags/1.0
+2222222222222222222222222222222222222222\trefs/tags/1.1
+3333333333333333333333333333333333333333\trefs/tags/1.1^{}
+4444444444444444444444444444444444444444\trefs/heads/master
+"""
+
+
+class FakeGit:
+
+    def __init__(self, output):
+        self.output = output
+        self.calls = 0
+
+    def git(self, *args, **kwargs):
+        self.calls += 1
+        return self.output
+
+
+class TagCacheTestCase(support.TempdirManager, unittest2.TestCase):
+
+    def setUp(self):
+        super(TagCacheTestCase, self).setUp()
+        self.cache = TagCache(os.path.join(self.mkdtemp(), "tags.db"))
+
+    def tearDown(self):
+        self.cache.close()
+        super(TagCacheTestCase, self).tearDown()
+
+    def test_parse_ls_remote(self):
+        self.assertEqual(parse_ls_remote(LS_REMOTE),
+                         {"1.0": "1" * 40, "1.1": "3" * 40})
+
+    def test_listing_is_cached(self):
+        git = FakeGit(LS_REMOTE)
+        self.assertEqual(self.cache.tags(git, "url"),
+                         {"1.0": "1" * 40, "1.1": "3" * 40})
+        self.cache.tags(git, "url")
+        self.assertEqual(git.calls, 1)
+        self.cache.ttl = -1
+        self.cache.tags(git, "url")
+        self.assertEqual(git.calls, 2)
+
+    def test_offline(self):
+        self.cache.offline = True
+        git = FakeGit(LS_REMOTE)
+        self.assertEqual(self.cache.tags(git, "url"), {})
+        self.assertEqual(git.calls, 0)
+
+    def test_unreachable_keeps_listing(self):
+        self.cache.store_tags("url", {"1.0": "1" * 40})
+        self.cache.ttl = -1
+        git = FakeGit("fatal: unable to access 'url'\n")
+        self.assertEqual(self.cache.tags(git, "url"), {"1.0": "1" * 40})
+
+    def test_depends(self):
+        self.assertEqual(self.cache.depends("1" * 40), None)
+        self.cache.store_depends("1" * 40, "depends libX\n")
+        self.assertEqual(self.cache.depends("1" * 40), "depends libX\n")
+
+    def test_locked_cache_is_kept(self):
+        self.cache.store_tags("url", {"1.0": "1" * 40})
+        self.cache.close()
+        other = sqlite3.connect(self.cache.path, check_same_thread=False)
+        other.execute("BEGIN EXCLUSIVE")
+        saved = tagcache.LOCK_TIMEOUT
+        tagcache.LOCK_TIMEOUT = 0.1
+        try:
+            # Another run holding it past the timeout is an error...
+            self.assertRaises(sqlite3.OperationalError, TagCache,
+                              self.cache.path)
+            # ...and one letting go in time is waited for.
+            tagcache.LOCK_TIMEOUT = 5
+            timer = threading.Timer(0.3, other.commit)
+            timer.start()
+            try:
+                self.cache = TagCache(self.cache.path)
+            finally:
+                timer.cancel()
+        finally:
+            tagcache.LOCK_TIMEOUT = saved
+            other.close()
+        self.assertEqual(self.cache.cached_tags("url"), {"1.0": "1" * 40})
+
+    def test_corrupt_cache_is_replaced(self):
+        self.cache.close()
+        support.write_file(self.cache.path, "not a database" * 100)
+        self.cache = TagCache(self.cache.path)
+        self.assertEqual(self.cache.cached_tags("url"), None)
+        self.cache.store_tags("url", {})
+
+    def fetch(self, clone):
+        before = self.cache.local_tags(clone)
+        support.git(clone, "fetch", "--quiet", "--tags", "origin")
+        self.cache.fetched(clone, before)
+
+    def test_quiet_fetch_of_new_tag_invalidates(self):
+        origin = self.make_repo(tags=["1.0"])
+        clone = os.path.join(self.mkdtemp(), "clone")
+        support.git(origin, "clone", "--quiet", origin, clone)
+        self.cache.store_tags(origin, {"1.0": "1" * 40})
+
+        self.fetch(clone)
+        self.assertEqual(self.cache.cached_tags(origin), {"1.0": "1" * 40})
+
+        support.git(origin, "tag", "1.1")
+        self.fetch(clone)
+        self.assertEqual(self.cache.cached_tags(origin), None)
+
+
+def test_suite():
+    return unittest2.makeSuite(TagCacheTestCase)
+
+if __name__ == "__main__":
+    unittest2.main(defaultTest="test_suite")
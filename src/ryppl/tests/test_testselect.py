@@ -0,0 +1,112 @@
+"""Tests for ryppl.testselect."""
+import os
+import sys
+from cStringIO import StringIO
+
+from ryppl.tests import unittest2, support
+from ryppl.executor import ProjectFailed
+from ryppl.testselect import TestResults, closure_of, result_key, run_suite
+
+
+class FakeState:
+
+    def __init__(self, path, tree, commit="c" * 40, clean=True):
+        self.path = path
+        self.tree = tree
+        self.commit = commit
+        self.clean = clean
+
+
+class ResultKeyTestCase(unittest2.TestCase):
+
+    def test_dependency_order_doesnt_matter(self):
+        a, b, c = [FakeState(name, name * 40) for name in "abc"]
+        self.assertEqual(result_key([a, b, c], "linux"),
+                         result_key([a, c, b], "linux"))
+        self.assertNotEqual(result_key([a, b, c], "linux"),
+                            result_key([b, a, c], "linux"))
+        self.assertNotEqual(result_key([a, b], "linux"),
+                            result_key([a, b], "mac"))
+
+    def test_dirty_trees_have_no_key(self):
+        a = FakeState("a", "a" * 40)
+        b = FakeState("b", "b" * 40, clean=False)
+        self.assertEqual(result_key([a, b], "linux"), None)
+
+    def test_closure_of(self):
+        graph = {"a": ["b", "c"], "b": ["c"], "c": []}
+        self.assertEqual(closure_of("a", graph), ["a", "b", "c"])
+
+
+class TestResultsTestCase(support.TempdirManager, unittest2.TestCase):
+
+    def setUp(self):
+        super(TestResultsTestCase, self).setUp()
+        self.results = TestResults(os.path.join(self.mkdtemp(), "tests.db"))
+        self.states = [FakeState("a", "a" * 40), FakeState("b", "b" * 40)]
+
+    def tearDown(self):
+        self.results.close()
+        super(TestResultsTestCase, self).tearDown()
+
+    def test_record(self):
+        self.results.record("a", True, self.states, "passed\n", "linux")
+        self.assertEqual(self.results.lookup(result_key(self.states,
+                                                        "linux")),
+                         (True, "passed\n"))
+        self.assertEqual(self.results.lookup(result_key(self.states, "mac")),
+                         None)
+        self.assertEqual(self.results.baseline("a"),
+                         {os.path.abspath("a"): "c" * 40,
+                          os.path.abspath("b"): "c" * 40})
+
+    def test_store_sets_no_baseline(self):
+        key = result_key(self.states, "mac")
+        self.results.store(key, False, "failed\n")
+        self.assertEqual(self.results.lookup(key), (False, "failed\n"))
+        self.assertEqual(self.results.baseline("a"), {})
+
+    def test_evict(self):
+        self.results.store("old", True, "x" * 100)
+        self.results.store("new", True, "y" * 100)
+        self.results.lookup("new")
+        self.results.evict(max_bytes=150)
+        self.assertEqual(self.results.lookup("old"), None)
+        self.assertEqual(self.results.lookup("new"), (True, "y" * 100))
+
+
+class RunSuiteTestCase(support.TempdirManager, unittest2.TestCase):
+
+    def run_suite(self, test_line):
+        project = self.mkdtemp()
+        support.write_file(os.path.join(project, ".ryppl"),
+                           "depends libX\n%s\n" % test_line)
+        saved = sys.stdout
+        sys.stdout = output = StringIO()
+        try:
+            run_suite(project)
+        finally:
+            sys.stdout = saved
+        return output.getvalue()
+
+    def test_output(self):
+        output = self.run_suite("test %s -c 'print 42'" % sys.executable)
+        self.assertTrue(output.endswith("\n42\n"), output)
+
+    def test_failure(self):
+        self.assertRaises(ProjectFailed, self.run_suite,
+                          "test %s -c 'raise SystemExit(3)'" % sys.executable)
+
+    def test_no_test_command(self):
+        self.assertTrue("no test command" in self.run_suite(""))
+
+
+def test_suite():
+    suite = unittest2.TestSuite()
+    suite.addTest(unittest2.makeSuite(ResultKeyTestCase))
+    suite.addTest(unittest2.makeSuite(TestResultsTestCase))
+    suite.addTest(unittest2.makeSuite(RunSuiteTestCase))
+    return suite
+
+if __name__ == "__main__":
+    unittest2.main(defaultTest="test_suite")
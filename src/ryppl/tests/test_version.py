@@ -0,0 +1,60 @@
+"""Tests for ryppl.version."""
+import pickle
+
+from ryppl.tests import unittest2
+from ryppl.version import Version, latest, parse_many, version_key
+
+# In ascending order, as PEP 386 has them.
+ORDERED = ["0.9", "1.0.dev456", "1.0a1", "1.0a2.dev456", "1.0a12.dev456",
+           "1.0a12", "1.0b1.dev456", "1.0b2", "1.0b2.post345.dev456",
+           "1.0b2.post345", "1.0c1.dev456", "1.0c1", "1.0",
+           "1.0.post456.dev34", "1.0.post456", "1.1", "1.2.3", "1.10"]
+
+
+class VersionTestCase(unittest2.TestCase):
+
+    def test_order(self):
+        versions = [Version(v) for v in ORDERED]
+        for older, newer in zip(versions, versions[1:]):
+            self.assertTrue(older < newer, "%s < %s" % (older, newer))
+            self.assertTrue(older.key < newer.key)
+        shuffled = ORDERED[1::2] + ORDERED[::2]
+        self.assertEqual([str(v) for v in parse_many(shuffled)], ORDERED)
+
+    def test_trailing_zeros(self):
+        self.assertEqual(Version("1.0"), Version("1.0.0"))
+        self.assertEqual(version_key("2.1"), version_key("2.1.0.0"))
+        self.assertEqual(str(Version("1.0.0")), "1.0.0")
+        self.assertNotEqual(Version("1.0"), Version("1.0.1"))
+
+    def test_interned(self):
+        self.assertTrue(Version("3.2") is Version("3.2"))
+        self.assertTrue(pickle.loads(pickle.dumps(Version("3.2")))
+                        is Version("3.2"))
+        self.assertTrue(parse_many(["3.2"])[0] is Version("3.2"))
+
+    def test_immutable(self):
+        self.assertRaises(AttributeError, setattr, Version("1.0"), "key", ())
+
+    def test_invalid(self):
+        for bad in ("1", "v1.0", "1.0-beta", "1.0.", ""):
+            self.assertRaises(ValueError, Version, bad)
+
+    def test_parse_many_text(self):
+        tags = "v0.1\n1.1\n  1.0rc1 \nrelease\n1.0\n"
+        self.assertEqual([str(v) for v in parse_many(tags)],
+                         ["1.0rc1", "1.0", "1.1"])
+
+    def test_latest(self):
+        self.assertEqual(str(latest(["1.0", "1.1a1", "0.9"])), "1.0")
+        self.assertEqual(str(latest(["1.0", "1.1a1"], final=False)), "1.1a1")
+        self.assertTrue(latest(["master"]) is None)
+        self.assertFalse(Version("1.0.dev3").is_final())
+        self.assertTrue(Version("1.0.post3").is_final())
+
+
+def test_suite():
+    return unittest2.makeSuite(VersionTestCase)
+
+if __name__ == "__main__":
+    unittest2.main(defaultTest="test_suite")
@@ -0,0 +1,96 @@
+"""Tests for ryppl.workspace."""
+import os
+
+from ryppl.tests import unittest2, support
+from ryppl.workspace import ObjectStore, Workspace
+
+
+class Git:
+    """Just enough of ryppl.py's Git for a Workspace, which returns
+    what git printed, failing or not.
+    """
+
+    def git(self, *args, **kwargs):
+        try:
+            return support.git(kwargs.get("cwd") or os.curdir, *args)
+        except RuntimeError, e:
+            return str(e)
+
+
+class WorkspaceTestCase(support.TempdirManager, unittest2.TestCase):
+
+    def setUp(self):
+        super(WorkspaceTestCase, self).setUp()
+        self.upstream = self.make_repo(tags=["1.0"])
+        tmp = self.mkdtemp()
+        self.root = os.path.join(tmp, "ws")
+        os.mkdir(self.root)
+        self.store = ObjectStore(Git(), os.path.join(tmp, "objects.git"))
+
+    def test_clones_borrow_from_the_store(self):
+        workspace = Workspace(Git(), self.root, self.store)
+        workspace.checkout("libX", self.upstream, "1.0")
+        self.assertTrue(workspace.borrows("libX"))
+        self.assertTrue(workspace.dissociate("libX"))
+        self.assertFalse(workspace.borrows("libX"))
+        self.assertFalse(workspace.dissociate("libX"))
+        support.git(workspace.path("libX"), "fsck")
+
+    def test_dissociated_clones(self):
+        workspace = Workspace(Git(), self.root, self.store, dissociate=True)
+        workspace.checkout("libX", self.upstream, "1.0")
+        self.assertFalse(workspace.borrows("libX"))
+        support.git(workspace.path("libX"), "fsck")
+
+    def partial_clone(self, workspace):
+        # History the checkout doesn't need: earlier versions of README.
+        for i in range(2):
+            self.commit(self.upstream, {"README": "version %d\n" % i})
+        workspace.set_mode("libX", "partial")
+        url = "file://" + self.upstream
+        support.git(self.upstream, "config", "uploadpack.allowfilter", "true")
+        support.git(self.root, "clone", "--quiet", "--filter=blob:none",
+                    url, "libX")
+        return workspace.path("libX")
+
+    def test_deepen_needs_refetch(self):
+        workspace = Workspace(Git(), self.root, self.store)
+        path = self.partial_clone(workspace)
+        self.assertRaises(RuntimeError, workspace.deepen, "libX")
+        self.assertEqual(workspace.mode("libX"), "partial")
+        self.assertEqual(support.git(path, "config",
+                                     "remote.origin.promisor").strip(),
+                         "true")
+
+    def test_deepen_refetches(self):
+        git = Git()
+        git.supports = lambda feature: feature == "refetch"
+        workspace = Workspace(git, self.root, self.store)
+        path = self.partial_clone(workspace)
+        missing = support.git(path, "rev-list", "--objects", "--all",
+                              "--missing=print")
+        self.assertTrue("\n?" in "\n" + missing)
+        self.assertTrue(workspace.deepen("libX"))
+        self.assertEqual(workspace.mode("libX"), "full")
+        missing = support.git(path, "rev-list", "--objects", "--all",
+                              "--missing=print")
+        self.assertFalse("\n?" in "\n" + missing)
+        config = support.git(path, "config", "--list").lower()
+        self.assertFalse("promisor" in config or "partialclone" in config)
+        support.git(path, "fsck")
+
+    def test_maintain_prunes_nothing(self):
+        self.store.fetch(self.upstream)
+        head = support.git(self.upstream, "rev-parse", "HEAD").strip()
+        for ref in support.git(self.store.path, "for-each-ref",
+                               "--format=%(refname)").split():
+            support.git(self.store.path, "update-ref", "-d", ref)
+        self.store.maintain()
+        self.assertTrue(self.store.has(head))
+
+
+def test_suite():
+    return unittest2.makeSuite(WorkspaceTestCase)
+
+if __name__ == "__main__":
+    unittest2.main(defaultTest="test_suite")
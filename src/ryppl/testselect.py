@@ -0,0 +1,326 @@
+"""ryppl.testselect
+
+Incremental testing: work out which projects need their tests run.
+
+A project's suite is the command on the "test" line of its .ryppl
+file (or .ryppl/test)::
+
+  depends libX:1.0-2.2
+  test python -m unittest discover
+
+Every passing run is recorded in ~/.ryppl/tests.db: the commit of the
+project and of each of its dependencies at the time, and the outcome
+for the project's tree.  A project needs testing again when "git diff"
+against the recorded commit of the project or any of its (direct or
+indirect) dependencies shows a change, or when it or one of them has
+untracked files or was never part of a passing run.
+
+Outcomes are also stored by content: the key of a run is a hash of
+the project's tree, the trees of everything it depends on and the
+platform it ran on, so an identical source state is never tested twice
+on the same kind of machine, whichever workspace it is checked out in.
+Old and excess entries are evicted by age and by total output size.
+"""
+
+import os
+import re
+import sys
+import time
+import shlex
+import hashlib
+import platform
+import sqlite3
+import subprocess as sub
+
+from ryppl.executor import ProjectFailed
+from ryppl.resolver import read_depends, read_ryppl
+from ryppl.status import is_dirty
+from ryppl.util import user_dir
+
+RESULTS_FILE = "tests.db"
+
+# Evict results not used for this long, or once their output takes up
+# more than this much space.
+MAX_AGE = 60 * 24 * 3600
+MAX_BYTES = 64 * 1024 * 1024
+
+_ryppl_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_sha_re = re.compile(r'^[0-9a-f]{40}$')
+
+_SCHEMA_VERSION = 2
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tested (
+    project TEXT NOT NULL,
+    member TEXT NOT NULL,
+    commit_sha TEXT NOT NULL,
+    PRIMARY KEY (project, member)
+);
+CREATE TABLE IF NOT EXISTS result (
+    key TEXT PRIMARY KEY,
+    ok INTEGER NOT NULL,
+    output TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS result_used ON result (used);
+"""
+
+
+def platform_key():
+    """Identifies the kind of machine tests run on here."""
+    return "%s %s python-%s" % (platform.system(), platform.machine(),
+                                platform.python_version())
+
+
+def result_key(states, platform=None):
+    """The content key of testing the project whose ProjectState comes
+    first in 'states', with the rest as its dependencies, on
+    'platform' (platform_key() by default).  None unless every working
+    tree is clean, as only committed trees have a name.
+    """
+    if [state for state in states if not state.clean]:
+        return None
+    if platform is None:
+        platform = platform_key()
+    trees = [states[0].tree] + sorted(state.tree for state in states[1:])
+    return hashlib.sha1("\0".join(trees + [platform])).hexdigest()
+
+
+class TestResults:
+    """The database of test runs at 'path' (~/.ryppl/tests.db by
+    default).  Projects are identified by absolute path.
+    """
+
+    def __init__(self, path=None):
+        if path is None:
+            path = user_dir(RESULTS_FILE)
+        # Other ryppl processes may be recording results too.
+        self.db = sqlite3.connect(path, timeout=30)
+        if self.db.execute("PRAGMA user_version").fetchone()[0] \
+               != _SCHEMA_VERSION:
+            self.db.executescript("DROP TABLE IF EXISTS tested;"
+                                  "DROP TABLE IF EXISTS result;")
+            self.db.executescript(_SCHEMA)
+            self.db.execute("PRAGMA user_version = %d" % _SCHEMA_VERSION)
+            self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+    def baseline(self, project):
+        """{member: commit} for 'project' and each of its dependencies,
+        as they were when 'project' last passed its tests.
+        """
+        return dict(self.db.execute(
+            "SELECT member, commit_sha FROM tested WHERE project = ?",
+            (os.path.abspath(project),)))
+
+    def lookup(self, key):
+        """The (ok, output) stored under 'key', or None."""
+        if key is None:
+            return None
+        row = self.db.execute("SELECT ok, output FROM result WHERE key = ?",
+                              (key,)).fetchone()
+        if row is None:
+            return None
+        self.db.execute("UPDATE result SET used = ? WHERE key = ?",
+                        (time.time(), key))
+        self.db.commit()
+        return bool(row[0]), row[1]
+
+    def record(self, project, ok, states, output="", platform=None):
+        """Note the outcome of testing 'project', given the ProjectStates
+        of it and everything it depends on (its own first).
+        """
+        project = os.path.abspath(project)
+        if ok:
+            self.db.execute("DELETE FROM tested WHERE project = ?",
+                            (project,))
+            self.db.executemany(
+                "INSERT INTO tested (project, member, commit_sha) "
+                "VALUES (?, ?, ?)",
+                [(project, os.path.abspath(state.path), state.commit)
+                 for state in states if state.commit is not None])
+        self.store(result_key(states, platform), ok, output)
+
+    def store(self, key, ok, output=""):
+        """Keep the outcome of a run under its result_key() 'key' (if
+        not None), without taking it as a baseline: for runs elsewhere,
+        as on test slaves.
+        """
+        if key is not None:
+            self.db.execute("INSERT OR REPLACE INTO result "
+                            "(key, ok, output, size, used) "
+                            "VALUES (?, ?, ?, ?, ?)",
+                            (key, int(ok), output, len(output), time.time()))
+        self.db.commit()
+
+    def evict(self, max_age=MAX_AGE, max_bytes=MAX_BYTES):
+        """Drop results unused for 'max_age' seconds, then the least
+        recently used ones until their output fits in 'max_bytes'.
+        """
+        db = self.db
+        db.execute("DELETE FROM result WHERE used < ?",
+                   (time.time() - max_age,))
+        total = db.execute("SELECT TOTAL(size) FROM result").fetchone()[0]
+        if total > max_bytes:
+            doomed = []
+            for key, size in db.execute(
+                    "SELECT key, size FROM result ORDER BY used"):
+                if total <= max_bytes:
+                    break
+                doomed.append((key,))
+                total -= size
+            db.executemany("DELETE FROM result WHERE key = ?", doomed)
+        db.commit()
+
+
+def test_command(project):
+    """The argument list of the project's test command, or None.  A
+    "test-modules <package>" line runs the package's test modules with
+    ryppl.testrunner, using every CPU.
+    """
+    for line in read_ryppl(project, "test").splitlines():
+        words = shlex.split(line, comments=True)
+        if words[:1] == ["test"] and words[1:]:
+            return words[1:]
+        if words[:1] == ["test-modules"] and len(words) == 2:
+            return [sys.executable, "-m", "ryppl.testrunner", words[1]]
+    return None
+
+
+def dependency_closure(projects, workspace):
+    """Return {project: [dependencies]} for 'projects' and, recursively,
+    their dependencies that are checked out in 'workspace'.  Keys and
+    values are project directories.
+    """
+    graph = {}
+    todo = list(projects)
+    while todo:
+        project = todo.pop()
+        if project in graph:
+            continue
+        deps = []
+        for name, constraint in read_depends(project):
+            path = os.path.normpath(os.path.join(workspace, name))
+            if os.path.isdir(path):
+                deps.append(path)
+        graph[project] = deps
+        todo.extend(deps)
+    return graph
+
+
+def closure_of(project, graph):
+    """'project' and everything it depends on in 'graph', directly or
+    not, the project itself first.
+    """
+    members = [project]
+    seen = set(members)
+    for member in members:
+        for dep in graph[member]:
+            if dep not in seen:
+                seen.add(dep)
+                members.append(dep)
+    return members
+
+
+class ProjectState:
+    """Where the project at 'path' stands: 'commit' and 'tree' of HEAD
+    (None if it has no commits) and whether its working tree is 'clean'.
+    Given the project's ryppl.stateindex.ProjectInfo, HEAD is taken from
+    that if it knows it.
+    """
+
+    def __init__(self, git, path, info=None):
+        self.git = git
+        self.path = path
+        if info is not None and info.commit and info.tree:
+            head = [info.commit, info.tree]
+        else:
+            head = git.git("rev-parse", "HEAD", "HEAD^{tree}",
+                           cwd=path).split()
+        if len(head) == 2 and all(_sha_re.match(sha) for sha in head):
+            self.commit, self.tree = head
+        else:
+            self.commit = self.tree = None
+        self.clean = self.commit is not None and not is_dirty(git, path)
+        self._changed = {}
+
+    def changed_since(self, commit):
+        """Whether the working tree differs from 'commit' at all."""
+        if commit is None or self.commit is None:
+            return True
+        if self.clean and commit == self.commit:
+            return False
+        if commit not in self._changed:
+            git, path = self.git, self.path
+            self._changed[commit] = bool(
+                git.git("diff", "--name-only", commit, "--", cwd=path).strip()
+                or git.git("ls-files", "--others", "--exclude-standard",
+                           cwd=path).strip())
+        return self._changed[commit]
+
+
+def select(git, projects, workspace, results, deep=False, index=None):
+    """Decide what to do about 'projects' (plus their dependencies, if
+    'deep').  Returns (to_test, cached, graph, states): the projects
+    whose tests need to run, in the order given; {project: (ok,
+    output)} for those whose exact state has a stored outcome; the
+    dependency graph of all of them; and the ProjectState of every
+    project in it.  Projects in neither list haven't changed since
+    they passed.  'index' is the workspace's refreshed StateIndex, if
+    any.
+    """
+    graph = dependency_closure(projects, workspace)
+    states = dict((p, ProjectState(git, p, index and index.get(p)))
+                  for p in graph)
+    to_test = []
+    cached = {}
+    wanted = list(projects)
+    if deep:
+        wanted += sorted(set(graph) - set(projects))
+    for project in wanted:
+        members = closure_of(project, graph)
+        found = results.lookup(result_key([states[p] for p in members]))
+        if found is not None:
+            cached[project] = found
+            continue
+        baseline = results.baseline(project)
+        for member in members:
+            if states[member].changed_since(
+                    baseline.get(os.path.abspath(member))):
+                to_test.append(project)
+                break
+    return to_test, cached, graph, states
+
+
+def suite_env():
+    """The environment to run test commands in: ours, but with this
+    very ryppl on PYTHONPATH for "python -m ryppl.testrunner".
+    """
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        [_ryppl_path] + [p for p in [env.get("PYTHONPATH")] if p])
+    return env
+
+
+def run_suite(project):
+    """Run the project's test command, printing its output.  Raises
+    ProjectFailed if it fails.
+    """
+    command = test_command(project)
+    if command is None:
+        print("no test command in %s" % project)
+        return
+    print("$ " + " ".join(command))
+    devnull = open(os.devnull)
+    try:
+        p = sub.Popen(command, cwd=project, stdin=devnull,
+                      stdout=sub.PIPE, stderr=sub.STDOUT, env=suite_env())
+        sys.stdout.write(p.communicate()[0])
+    finally:
+        devnull.close()
+    if p.returncode != 0:
+        raise ProjectFailed("tests failed with exit status %d" % p.returncode)
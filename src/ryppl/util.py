@@ -0,0 +1,128 @@
+"""ryppl.util
+
+Small helpers shared by the ryppl modules.
+"""
+
+import os
+import marshal
+
+# The per-user directory holding ryppl.cfg and ryppl's caches, relative
+# to the home directory (see Distribution.find_config_files).
+if os.name == 'posix':
+    USER_DIR = ".ryppl"
+else:
+    USER_DIR = "ryppl"
+
+
+def user_dir(*parts):
+    """Return the path of 'parts' inside the per-user ryppl directory,
+    creating the directory itself if necessary.
+    """
+    base = os.path.join(os.path.expanduser('~'), USER_DIR)
+    if not os.path.isdir(base):
+        os.makedirs(base)
+    return os.path.join(base, *parts)
+
+
+def load_cache(path, format):
+    """Return the data saved with save_cache(path, format, data), or
+    None if the file is missing, unreadable or of another format.
+    """
+    try:
+        f = open(path, 'rb')
+    except IOError:
+        return None
+    try:
+        try:
+            saved_format, data = marshal.loads(f.read())
+        except (EOFError, ValueError, TypeError):
+            return None
+    finally:
+        f.close()
+    if saved_format != format:
+        return None
+    return data
+
+
+def save_cache(path, format, data):
+    """Atomically replace the file 'path' with 'data' (anything marshal
+    can store), tagged with 'format'.  Failure is silently ignored: a
+    cache that can't be written is merely a cache that misses.
+    """
+    import tempfile
+    try:
+        fd, temp = tempfile.mkstemp(dir=os.path.dirname(path),
+                                    prefix=os.path.basename(path))
+        try:
+            os.write(fd, marshal.dumps((format, data)))
+        finally:
+            os.close(fd)
+        os.rename(temp, path)
+    except (IOError, OSError):
+        pass
+
+
+def read_git_config(repository):
+    """Return the settings in the .git/config file of the clone at
+    'repository' as a dict mapping "section.subsection.key" to values
+    (later settings win), without running git.  Returns {} if there is
+    no such file.
+    """
+    return parse_git_config(os.path.join(repository, ".git", "config"))
+
+
+_ESCAPES = {"n": "\n", "t": "\t", "b": "\b"}
+
+def _config_value(text):
+    """A config value as git reads it: quotes removed, backslash escapes
+    undone, and a comment outside quotes dropped.
+    """
+    value = []
+    kept = 0                        # what trailing blanks can't eat into
+    quoted = False
+    chars = iter(text.strip())
+    for c in chars:
+        if c == '"':
+            quoted = not quoted
+        elif c == "\\":
+            c = next(chars, "")
+            value.append(_ESCAPES.get(c, c))
+            kept = len(value)
+        elif c in "#;" and not quoted:
+            break
+        else:
+            value.append(c)
+            if quoted:
+                kept = len(value)
+    value = "".join(value)
+    return value[:kept] + value[kept:].rstrip()
+
+
+def parse_git_config(path):
+    """read_git_config for the file at 'path', which may be any file in
+    git's config format (.gitmodules, say).
+    """
+    if not os.path.isfile(path):
+        return {}
+    settings = {}
+    section = ""
+    f = open(path)
+    try:
+        for line in f:
+            line = line.strip()
+            if not line or line[0] in "#;":
+                continue
+            if line.startswith("["):
+                section = line[1:line.index("]")].strip()
+                if ' "' in section:         # [remote "origin"]
+                    name, sub = section.split(' "', 1)
+                    section = name.lower() + "." + sub.rstrip('"')
+                else:
+                    section = section.lower()
+                continue
+            key, sep, value = line.partition("=")
+            settings["%s.%s" % (section, key.strip().lower())] = \
+                _config_value(value)
+    finally:
+        f.close()
+    return settings
@@ -0,0 +1,154 @@
+"""ryppl.version
+
+PEP 386 version numbers, N.N[.N]+[{a|b|c|rc}N[.N]+][.postN][.devN],
+parsed once into small immutable objects.  Each Version carries a flat
+tuple of ints that sorts the way the versions do, so comparing two of
+them is a single tuple comparison.  Equal version strings share one
+instance, which keeps the many copies that dependency resolution and
+tag listings produce down to one each.
+"""
+
+import re
+import threading
+
+_version_re = re.compile(r'''
+    (?P<main>\d+\.\d+(?:\.\d+)*)
+    (?:(?P<pre>a|b|c|rc)(?P<prenum>\d+(?:\.\d+)*))?
+    (?:\.post(?P<post>\d+))?
+    (?:\.dev(?P<dev>\d+))?
+    $''', re.VERBOSE)
+
+# The same pattern applied to whole lines of a multi-line string.
+_version_lines_re = re.compile(r'^[ \t]*' + _version_re.pattern[:-1] +
+                               r'[ \t]*$', re.VERBOSE | re.MULTILINE)
+
+_prerelease_rank = {'a': 1, 'b': 2, 'c': 3, 'rc': 3}
+
+_NO_DEV = 0x7fffffff
+
+_interned = {}
+_intern_lock = threading.Lock()
+
+
+def _key(m):
+    main = [int(n) for n in m.group('main').split('.')]
+    while len(main) > 2 and main[-1] == 0:
+        main.pop()
+    pre, post, dev = m.group('pre'), m.group('post'), m.group('dev')
+    if pre:
+        phase = [_prerelease_rank[pre]] + \
+                [int(n) for n in m.group('prenum').split('.')]
+    elif dev is not None and post is None:
+        phase = [0]                     # N.N.devN precedes N.NaN
+    else:
+        phase = [4]
+    return tuple(main + [-1] + phase +
+                 [-1, post is None and -1 or int(post),
+                  dev is None and _NO_DEV or int(dev)])
+
+
+class Version(object):
+    """A parsed version number.  Version("1.0") is Version("1.0");
+    Version("1.0") == Version("1.0.0") (trailing zeros don't count)
+    although the two keep their own spelling in str().  Raises
+    ValueError if the string is not a valid version.
+    """
+
+    __slots__ = ('string', 'key')
+
+    def __new__(cls, string):
+        version = _interned.get(string)
+        if version is not None:
+            return version
+        m = _version_re.match(string)
+        if m is None:
+            raise ValueError("invalid version number '%s'" % string)
+        return cls._make(string, _key(m))
+
+    @classmethod
+    def _make(cls, string, key):
+        _intern_lock.acquire()
+        try:
+            version = _interned.get(string)
+            if version is None:
+                version = object.__new__(cls)
+                object.__setattr__(version, 'string', string)
+                object.__setattr__(version, 'key', key)
+                _interned[string] = version
+            return version
+        finally:
+            _intern_lock.release()
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Version objects are immutable")
+
+    def __reduce__(self):
+        return (Version, (self.string,))
+
+    def is_final(self):
+        """True unless this is a pre-release or development version."""
+        return self.key[self.key.index(-1) + 1] == 4 and self.key[-1] == _NO_DEV
+
+    def __str__(self):
+        return self.string
+
+    def __repr__(self):
+        return "Version('%s')" % self.string
+
+    def __hash__(self):
+        return hash(self.key)
+
+    def __eq__(self, other):
+        return isinstance(other, Version) and self.key == other.key
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __lt__(self, other):
+        return self.key < other.key
+
+    def __le__(self, other):
+        return self.key <= other.key
+
+    def __gt__(self, other):
+        return self.key > other.key
+
+    def __ge__(self, other):
+        return self.key >= other.key
+
+
+def version_key(string):
+    """The sort key of the version 'string'; see Version."""
+    return Version(string).key
+
+
+def parse_many(tags):
+    """Return the valid versions among 'tags', ascending.  'tags' is
+    either a list of strings or one string with a name per line (as
+    printed by "git tag -l"), which is scanned in a single pass.
+    Anything that isn't a version is skipped.
+    """
+    if isinstance(tags, basestring):
+        matches = _version_lines_re.finditer(tags)
+    else:
+        matches = [m for m in map(_version_re.match, tags) if m is not None]
+    versions = []
+    for m in matches:
+        string = m.group(0).strip()
+        version = _interned.get(string)
+        if version is None:
+            version = Version._make(string, _key(m))
+        versions.append(version)
+    versions.sort(key=lambda v: v.key)
+    return versions
+
+
+def latest(tags, final=True):
+    """The newest version among 'tags' (see parse_many), leaving out
+    pre-releases and development versions if 'final' is true.  None if
+    there is none.
+    """
+    for version in reversed(parse_many(tags)):
+        if version.is_final() or not final:
+            return version
+    return None
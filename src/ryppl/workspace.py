@@ -0,0 +1,321 @@
+"""ryppl.workspace
+
+Creates and updates the clones in a ryppl workspace without paying for
+a full clone of each.
+
+Every upstream repository is fetched into one bare object store,
+~/.ryppl/objects.git, each under refs of its own::
+
+  refs/ryppl/<id>/heads/*, refs/ryppl/<id>/tags/*
+
+where <id> is derived from the URL.  An object is stored once however
+many upstreams have it, so forks, mirrors and the submodules of a
+superproject share everything they have in common.  The clones in the
+workspace borrow from the store (git clone --reference, i.e. through
+.git/objects/info/alternates) and hold only their own new commits, so
+a workspace of dozens of related projects costs about one clone of
+disk and network traffic.  The store must never be pruned (git gc
+--prune, git prune): clones may rely on any object in it, whether or
+not a ref there still points to it.  ObjectStore.maintain() ("ryppl
+maintain") repacks it without dropping anything.  A clone made with
+"install --dissociate", or dissociated later ("ryppl maintain
+--dissociate"), copies what it borrowed and no longer relies on the
+store; once none does, the store may be deleted.
+
+Where each package comes from is recorded in the workspace, in
+.ryppl-workspace/sources::
+
+  libX git://example.org/libX.git
+
+End users who only want the software don't need any history.  A
+package can instead be installed in one of these modes, recorded in
+.ryppl-workspace/modes (no entry means "full"):
+
+  shallow   just the commit checked out (clone --depth 1); moving to
+            another version fetches that one commit
+  partial   every commit and tree, but only the file contents checked
+            out (clone --filter=blob:none), the rest fetched on demand
+
+Such clones bypass the object store, whose point is to hold history.
+deepen() turns them into full clones, for publish and merge-request
+(partial ones only with git 2.36 or later: older gits can't fetch what
+a partial clone lacks but on demand).
+"""
+
+import os
+import hashlib
+
+from ryppl.util import user_dir, read_git_config
+
+STORE_DIR = "objects.git"
+STATE_DIR = ".ryppl-workspace"
+SOURCES_FILE = "sources"
+MODES_FILE = "modes"
+
+MODES = ("full", "shallow", "partial")
+
+
+def _read_table(path):
+    """{name: value} from a file of "name value" lines."""
+    table = {}
+    if os.path.isfile(path):
+        f = open(path)
+        try:
+            for line in f:
+                fields = line.split(None, 1)
+                if len(fields) == 2 and not fields[0].startswith("#"):
+                    table[fields[0]] = fields[1].strip()
+        finally:
+            f.close()
+    return table
+
+
+def _write_table(path, table):
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    temp = path + ".tmp"
+    f = open(temp, "w")
+    try:
+        for name in sorted(table):
+            f.write("%s %s\n" % (name, table[name]))
+    finally:
+        f.close()
+    os.rename(temp, path)
+
+
+class ObjectStore:
+    """The shared bare repository at 'path' (~/.ryppl/objects.git by
+    default) holding the objects of every upstream fetched into it.
+    """
+
+    def __init__(self, git, path=None):
+        self.git = git
+        self.path = path or user_dir(STORE_DIR)
+        self._fetched = set()
+
+    def create(self):
+        if os.path.isdir(self.path):
+            return
+        self.git.git("init", "--bare", "--quiet", self.path)
+        # Clones borrow objects no ref here may still point to.
+        for key, value in (("gc.auto", "0"), ("gc.pruneExpire", "never"),
+                           ("core.logAllRefUpdates", "false")):
+            self.git.git("config", key, value, cwd=self.path)
+
+    def prefix(self, url):
+        """Where the refs of 'url' are kept in the store."""
+        return "refs/ryppl/%s" % hashlib.sha1(url).hexdigest()[:16]
+
+    def fetch(self, url):
+        """Bring the store up to date with 'url' (once per ObjectStore,
+        however often it is asked).  Returns git's output.
+        """
+        if url in self._fetched:
+            return ""
+        self.create()
+        prefix = self.prefix(url)
+        output = self.git.git("fetch", "--quiet", "--no-tags", url,
+                              "+refs/heads/*:%s/heads/*" % prefix,
+                              "+refs/tags/*:%s/tags/*" % prefix,
+                              cwd=self.path)
+        self._fetched.add(url)
+        return output
+
+    def maintain(self):
+        """Repack the store and its refs, dropping no object (see
+        above).  Returns git's output.
+        """
+        if not os.path.isdir(self.path):
+            return ""
+        return self.git.git("gc", "--quiet", "--prune=never", cwd=self.path)
+
+    def has(self, commit):
+        """Whether 'commit' is in the store."""
+        return os.path.isdir(self.path) and self.git.git(
+            "cat-file", "-t", commit, cwd=self.path).strip() == "commit"
+
+
+class Workspace:
+    """The ryppl workspace at 'root', cloning by way of 'store' (an
+    ObjectStore; the per-user one by default).  With 'dissociate', new
+    full clones get copies of what they borrow from the store.
+    """
+
+    def __init__(self, git, root=os.curdir, store=None, dissociate=False):
+        self.git = git
+        self.root = root
+        self.store = store or ObjectStore(git)
+        self.state = os.path.join(root, STATE_DIR)
+        self.dissociate_clones = dissociate
+
+    def path(self, name):
+        return os.path.join(self.root, name)
+
+    def sources(self):
+        """{package name: URL} for the packages of the workspace: those
+        recorded, updated with the origin of each existing clone.
+        """
+        sources = _read_table(os.path.join(self.state, SOURCES_FILE))
+        for name in os.listdir(self.root):
+            url = read_git_config(self.path(name)).get("remote.origin.url")
+            if url:
+                sources[name] = url
+        return sources
+
+    def add_sources(self, new):
+        """Record the URLs in 'new' ({name: URL})."""
+        path = os.path.join(self.state, SOURCES_FILE)
+        sources = _read_table(path)
+        sources.update(new)
+        _write_table(path, sources)
+
+    def mode(self, name):
+        """How 'name' is (or is to be) installed: one of MODES."""
+        return _read_table(os.path.join(self.state, MODES_FILE)).get(
+            name, "full")
+
+    def set_mode(self, name, mode):
+        if mode not in MODES:
+            raise ValueError("unknown install mode '%s' (not one of %s)"
+                             % (mode, ", ".join(MODES)))
+        path = os.path.join(self.state, MODES_FILE)
+        modes = _read_table(path)
+        if mode == "full":
+            modes.pop(name, None)
+        else:
+            modes[name] = mode
+        _write_table(path, modes)
+
+    def installed(self, name):
+        return os.path.isdir(os.path.join(self.path(name), ".git"))
+
+    def has(self, name, revision):
+        """Whether the clone of 'name' has 'revision'."""
+        return self.git.git("rev-parse", "--quiet", "--verify",
+                            revision + "^{commit}",
+                            cwd=self.path(name)).strip() != ""
+
+    def _alternates(self, name):
+        return os.path.join(self.path(name), ".git", "objects", "info",
+                            "alternates")
+
+    def borrows(self, name):
+        """Whether the clone of 'name' relies on the object store."""
+        path = self._alternates(name)
+        if not os.path.isfile(path):
+            return False
+        store = os.path.realpath(os.path.join(self.store.path, "objects"))
+        f = open(path)
+        try:
+            return store in [os.path.realpath(line.strip()) for line in f]
+        finally:
+            f.close()
+
+    def dissociate(self, name):
+        """Copy what the clone of 'name' borrows from the object store
+        into it, and stop it borrowing.  Returns whether it had to.
+        """
+        if not self.borrows(name):
+            return False
+        # -a includes the objects of alternates, unlike -l.
+        output = self.git.git("repack", "-a", "-d", "--quiet",
+                              cwd=self.path(name))
+        if output.strip():
+            raise RuntimeError("can't copy the objects %s borrows: %s"
+                               % (name, output.strip()))
+        os.remove(self._alternates(name))
+        return True
+
+    def _supports(self, feature):
+        supports = getattr(self.git, 'supports', None)
+        return supports is not None and supports(feature)
+
+    def checkout(self, name, url, revision=None):
+        """Make the workspace's clone of 'name' (from 'url'), creating
+        it in mode(name) if need be, and check out 'revision' (a tag,
+        branch or commit) in it; if None, a new clone gets the
+        upstream's default branch and an existing one is left alone.
+        Returns the clone's path.
+        """
+        path = self.path(name)
+        mode = self.mode(name)
+        if mode == "partial" and not self._supports("partial-clone"):
+            mode = "shallow"
+        checkout = ("checkout", "--quiet")
+        if not self.installed(name):
+            # --no-local makes even a clone of a path on this machine go
+            # through the transport that --reference and the rest affect.
+            if mode == "shallow":
+                options = ("--depth", "1")
+                if revision is not None:
+                    options += ("--branch", revision)
+            elif mode == "partial":
+                options = ("--filter=blob:none",)
+            else:
+                # Only what the store lacks comes over the wire.
+                self.store.fetch(url)
+                options = ("--reference", self.store.path)
+                if self.dissociate_clones and self._supports("dissociate"):
+                    options += ("--dissociate",)
+            output = self.git.git(*(("clone", "--quiet", "--no-checkout",
+                                     "--no-local") + options + (url, path)))
+            if not self.installed(name):
+                raise RuntimeError("can't clone %s: %s"
+                                   % (url, output.strip()))
+            self.set_mode(name, mode)
+            if self.dissociate_clones:
+                self.dissociate(name)   # for gits without --dissociate
+            # Nothing to lose yet, and the index is still empty.
+            checkout += ("--force",)
+            if revision is None:
+                revision = "HEAD"
+        elif revision is not None and not self.has(name, revision):
+            if mode == "shallow":
+                # Just the one commit, whatever the depth so far.
+                self.git.git("fetch", "--quiet", "--depth", "1", "origin",
+                             "tag", revision, cwd=path)
+            else:
+                self.git.git("fetch", "--quiet", "--tags", "origin",
+                             cwd=path)
+        if revision is not None:
+            output = self.git.git(*(checkout + (revision,)), cwd=path)
+            if output.strip():
+                raise RuntimeError("can't check out %s in %s: %s"
+                                   % (revision, name, output.strip()))
+        return path
+
+    def deepen(self, name):
+        """Give the clone of 'name' its full history, if it was
+        installed shallow or partial.  Returns whether it had to.
+        Raises RuntimeError if it can't; the clone then keeps its mode.
+        """
+        mode = self.mode(name)
+        if mode == "full" or not self.installed(name):
+            return False
+        path = self.path(name)
+        if mode == "shallow":
+            output = self.git.git("fetch", "--quiet", "--unshallow",
+                                  "--tags", "origin", cwd=path)
+        elif self._supports("refetch"):
+            # --refetch would otherwise ask for the same filter again.
+            key = "remote.origin.partialclonefilter"
+            filter = read_git_config(path).get(key)
+            if filter is not None:
+                self.git.git("config", "--unset", key, cwd=path)
+            output = self.git.git("fetch", "--quiet", "--refetch", "--tags",
+                                  "origin", cwd=path)
+            if output.strip() and filter is not None:
+                self.git.git("config", key, filter, cwd=path)
+        else:
+            raise RuntimeError("%s is a partial clone, and only git 2.36 "
+                               "or later can fetch all it lacks" % name)
+        if output.strip():
+            raise RuntimeError("can't fetch the history of %s: %s"
+                               % (name, output.strip()))
+        if mode == "partial":
+            # It has everything now: stop asking origin for more.
+            for key in ("remote.origin.promisor", "extensions.partialclone"):
+                self.git.git("config", "--unset", key, cwd=path)
+        self.set_mode(name, "full")
+        return True